@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Build the in-memory autocomplete index (user/autocomplete.py) in the
+# background while the worker starts serving
+from user.autocomplete import autocomplete  # noqa: E402
+
+autocomplete.warm()
@@ -82,11 +82,106 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite tuned for concurrent requests, run on every new connection:
+# WAL lets readers carry on while one writer commits, synchronous=NORMAL
+# is durable in WAL mode short of power loss, and busy_timeout (ms) waits
+# for the write lock instead of failing. IMMEDIATE transactions take that
+# lock up front, as a read-then-write transaction that upgrades later
+# fails at once with "database is locked" rather than waiting.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+    'cache_size': -int(os.getenv('SQLITE_CACHE_KB', 64_000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_BYTES', 256 * 2**20)),
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Connections close after each request by default. Under WSGI set
+        # DB_CONN_MAX_AGE (e.g. 600) to reuse one per worker thread; leave it
+        # at 0 under ASGI, where requests don't keep to one thread
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Read replica for the read-only user endpoints (user/routers.py): a
+    # copy of the primary kept fresh by `manage.py refresh_replica --every N`.
+    # query_only makes any write that reaches it fail.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_REPLICA_NAME', BASE_DIR / 'db.replica.sqlite3'),
+        # Always closed after the request: refresh_replica renames a new copy
+        # over the file, and a kept connection would read the old one forever
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(
+                f'PRAGMA {name}={value}' for name, value in
+                [*SQLITE_PRAGMAS.items(), ('query_only', 'ON')] if name != 'journal_mode'
+            ),
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['user.routers.PrimaryReplicaRouter']
+
+# Reads go to the replica while it is at most MAX_LAG seconds behind
+# (checked every CHECK_INTERVAL); users written to read from the primary
+# for PIN_SECONDS (default MAX_LAG + 1), pinned in PIN_CACHE (see Caches)
+REPLICA = {
+    'ALIAS': 'replica',
+    'MAX_LAG': int(os.getenv('REPLICA_MAX_LAG', 10)),
+    'CHECK_INTERVAL': 1,
+    'PIN_CACHE': 'shared' if os.getenv('REDIS_URL') else 'default',
+}
+
+
+# Caches
+# 'shared' is seen by every worker process and only exists when REDIS_URL
+# is set (needs the `redis` package). The profile cache then keeps a second
+# tier there, with a per-user version that retires an updated profile in
+# every worker, and replica pins hold across workers. Without it both stay
+# in each process: a miss is one load with no cache writes on the database,
+# but another worker's copy of an updated profile can lag by LOCAL_TTL,
+# and a pin only covers the worker that handled the write. A cache table
+# in the database was tried and dropped: a miss cost three writes under
+# SQLite's write lock and a hit two reads of the primary.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+if os.getenv('REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
     }
+
+# Serialized public profiles: TTL in the shared cache, and how long a
+# worker's own copy may lag an update made by another worker
+PROFILE_CACHE = {
+    'ALIAS': 'shared' if 'shared' in CACHES else None,
+    'TTL': int(os.getenv('PROFILE_CACHE_TTL', 300)),
+    'LOCAL_TTL': int(os.getenv('PROFILE_CACHE_LOCAL_TTL', 30)),
+    'LOCAL_MAX_ENTRIES': 10_000,
+}
+
+
+# Password hashing pool (user/hashing.py): hashes running at once, how
+# many more may wait, and the Retry-After of the 429 once the queue is full
+PASSWORD_HASHING = {
+    'MAX_WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', max(1, (os.cpu_count() or 2) // 2))),
+    'MAX_QUEUE': int(os.getenv('PASSWORD_HASHING_QUEUE', 32)),
+    'RETRY_AFTER': 1,
 }
 
 
@@ -149,6 +244,42 @@ APPLE_KEY_ID = os.getenv('APPLE_KEY_ID')
 APPLE_CLIENT_ID = os.getenv('APPLE_CLIENT_ID')
 APPLE_REDIRECT_URI = os.getenv('APPLE_REDIRECT_URI')
 
+# Shared outbound HTTP client for OAuth providers (seconds). Logins whose
+# provider is saturated, down or too slow get a 503 with RETRY_AFTER
+OAUTH_HTTP = {
+    'CONNECT_TIMEOUT': float(os.getenv('OAUTH_HTTP_CONNECT_TIMEOUT', 3.05)),
+    'READ_TIMEOUT': float(os.getenv('OAUTH_HTTP_READ_TIMEOUT', 10)),
+    'MAX_CONCURRENCY_PER_HOST': int(os.getenv('OAUTH_HTTP_MAX_CONCURRENCY_PER_HOST', 20)),
+    'POOL_SIZE': 20,
+    'RETRY_AFTER': 5,
+}
+
+# Seconds before the in-memory spend leaderboard is rebuilt from the database
+LEADERBOARD_MAX_AGE = int(os.getenv('LEADERBOARD_MAX_AGE', 300))
+
+# In-memory autocomplete over active users' names and emails (user/autocomplete.py),
+# built as each worker starts and rebuilt every MAX_AGE seconds
+AUTOCOMPLETE = {
+    'MAX_AGE': int(os.getenv('AUTOCOMPLETE_MAX_AGE', 300)),
+    'MAX_RESULTS': 50,
+}
+
+# Spend rollups by country/city/gender (user/rollups.py). Quantiles are within
+# RELATIVE_ACCURACY; changing it needs `manage.py rebuild_spend_rollups`
+SPEND_ROLLUPS = {
+    'RELATIVE_ACCURACY': 0.01,
+    'MIN_VALUE': 0.01,
+}
+
+# Row counts in page-number listings: exact below EXACT_BELOW rows, cached
+# per filter combination for CACHE_TTL seconds, planner estimates from ESTIMATE_ABOVE
+COUNT_STRATEGY = {
+    'EXACT_BELOW': int(os.getenv('COUNT_EXACT_BELOW', 10_000)),
+    'ESTIMATE_ABOVE': int(os.getenv('COUNT_ESTIMATE_ABOVE', 1_000_000)),
+    'CACHE_TTL': int(os.getenv('COUNT_CACHE_TTL', 60)),
+    'MAX_ENTRIES': 1024,
+}
+
 
 
 # Internationalization
@@ -197,7 +328,7 @@ FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
 # Rest Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.CachedJWTAuthentication',
         #'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
@@ -214,7 +345,24 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    
+    # Reverse proxies in front of the app. Client IPs (the auth_ip throttle)
+    # come from X-Forwarded-For only past this many hops; at 0 they are the
+    # peer address, since anyone can send the header
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+    # Sliding-window limits of the unauthenticated auth endpoints, see user/ratelimit.py
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': os.getenv('THROTTLE_AUTH_IP', '30/min'),
+        'auth_email': os.getenv('THROTTLE_AUTH_EMAIL', '10/min'),
+        'auth_provider': os.getenv('THROTTLE_AUTH_PROVIDER', '600/min'),
+    },
+}
+
+# Shared store of the rate limiter: a SQLite file every worker process
+# opens, and how long a hit may wait on it before counting locally
+RATE_LIMIT = {
+    'PATH': os.getenv('RATE_LIMIT_DB', BASE_DIR / '.cache' / 'ratelimit.sqlite3'),
+    'TIMEOUT': 0.1,
+    'PURGE_INTERVAL': 60,
 }
 
 
@@ -290,4 +438,22 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
    
     'JTI_CLAIM': 'jti',
+    
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user.serializers.TokenRefreshSerializer',
+}
+
+# Revoked refresh tokens: how often each process's Bloom filter picks up
+# revocations made elsewhere, and when it is rebuilt to drop purged ones
+TOKEN_REVOCATION = {
+    'SYNC_INTERVAL': float(os.getenv('TOKEN_REVOCATION_SYNC_INTERVAL', 1)),
+    'REBUILD_INTERVAL': 3600,
+    'MIN_CAPACITY': 100_000,
+    'ERROR_RATE': 0.001,
+}
+
+# Per-process cache of the user fields JWT authentication checks
+AUTH_USER_CACHE = {
+    'TTL': int(os.getenv('AUTH_USER_CACHE_TTL', 30)),
+    'MAX_ENTRIES': 10_000,
 }
\ No newline at end of file
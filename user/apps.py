@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
     name = 'user'
+    
+    def ready(self):
+        # Registers the background job handlers, model signal receivers and
+        # the OpenAPI extensions
+        from . import tasks, signals, schema  # noqa: F401
@@ -0,0 +1,165 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import serializers, status
+
+from .hashing import HashingBusy, password_hashing
+from .models import User
+from .oauth_http import UNAVAILABLE_ERRORS, oauth_http
+from .provider_profiles import PROVIDERS
+from .ratelimit import AUTH_THROTTLES, OAUTH_THROTTLES, check_rate_limits, set_rate_limit_headers
+from .retry import retry_on_lock
+from .serializers import UserProfileSerializer, UserSignupSerializer
+from .social import social_login
+from .tokens import RefreshToken
+
+
+def parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+
+    data = request.POST.dict()
+    # Apple's form_post sends the user object as a JSON string
+    if isinstance(data.get('user'), str):
+        try:
+            data['user'] = json.loads(data['user'])
+        except ValueError:
+            data['user'] = None
+    return data
+
+
+def busy_response(exc):
+    response = JsonResponse({'detail': str(exc.detail)}, status=exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def tokens_for(user):
+    refresh = RefreshToken.for_user(user)
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+#==================================================#
+# Async variants of the auth/<provider>/ endpoints.
+# Plain Django async views, so under ASGI (uvicorn core.asgi:application)
+# they run on the event loop without holding a worker thread while the
+# provider calls are in flight.
+#==================================================#
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSocialLoginView(View):
+    provider = None
+    http_method_names = ['post']
+
+    async def post(self, request):
+        data = parse_body(request)
+        if not isinstance(data, dict):
+            return JsonResponse({'detail': 'Malformed request body.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limits, throttled = await check_rate_limits(request, data, self, OAUTH_THROTTLES)
+        if throttled:
+            return throttled
+
+        required, _ = PROVIDERS[self.provider]
+        missing = {field: ['This field is required.'] for field in required if not data.get(field)}
+        if missing:
+            return JsonResponse(missing, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = await social_login(self.provider, data)
+        except serializers.ValidationError as e:
+            return JsonResponse(serializers.as_serializer_error(e), status=status.HTTP_400_BAD_REQUEST)
+        except UNAVAILABLE_ERRORS:
+            return busy_response(oauth_http.unavailable())
+
+        return set_rate_limit_headers(JsonResponse(result, status=status.HTTP_200_OK), limits)
+
+
+#==================================================#
+# Async variants of signup/ and login/. The password hash is awaited on
+# the bounded hashing pool (user/hashing.py), so a slow hash never holds
+# an event loop or a sync worker thread.
+#==================================================#
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSignupView(View):
+    http_method_names = ['post']
+
+    async def post(self, request):
+        data = parse_body(request)
+        if not isinstance(data, dict):
+            return JsonResponse({'detail': 'Malformed request body.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limits, throttled = await check_rate_limits(request, data, self, AUTH_THROTTLES)
+        if throttled:
+            return throttled
+
+        serializer = UserSignupSerializer(data=data, context={'request': request})
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        validated_data = dict(serializer.validated_data)
+        try:
+            password = await password_hashing.arun(make_password, validated_data.pop('password'))
+        except HashingBusy as e:
+            return busy_response(e)
+
+        user = await sync_to_async(retry_on_lock(User.objects.create))(password=password, **validated_data)
+
+        response = JsonResponse(
+            {
+                'message': 'Account created successfully...',
+                'user': UserProfileSerializer(user).data,
+                'tokens': await sync_to_async(tokens_for)(user),
+            },
+            status=status.HTTP_201_CREATED
+        )
+        return set_rate_limit_headers(response, limits)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLoginView(View):
+    http_method_names = ['post']
+
+    async def post(self, request):
+        data = parse_body(request)
+        if not isinstance(data, dict):
+            return JsonResponse({'detail': 'Malformed request body.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limits, throttled = await check_rate_limits(request, data, self, AUTH_THROTTLES)
+        if throttled:
+            return throttled
+
+        email, password = data.get('email'), data.get('password')
+        if not email or not password:
+            return JsonResponse({'detail': 'Email and password are required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = await User.objects.filter(email=email).afirst()
+        try:
+            if user is None:
+                # Hash anyway, so response times don't tell which emails exist
+                await password_hashing.arun(make_password, password)
+                valid = False
+            else:
+                valid = await user.acheck_password(password)
+        except HashingBusy as e:
+            return busy_response(e)
+
+        if not valid or not user.is_active:
+            return JsonResponse({'detail': 'Invalid email or password.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = JsonResponse(
+            {
+                'message': 'Logged in successfully...!',
+                'user': UserProfileSerializer(user, context={'request': request}).data,
+                'tokens': await sync_to_async(tokens_for)(user),
+            },
+            status=status.HTTP_200_OK
+        )
+        return set_rate_limit_headers(response, limits)
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import metrics
+from .tokens import TOKEN_VERSION_CLAIM
+
+
+User = get_user_model()
+
+# What authentication and permission checks read; anything else loads the row
+SNAPSHOT_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser', 'token_version')
+
+
+class UserSnapshotCache:
+    """
+    Bounded, short-lived per-process cache of the SNAPSHOT_FIELDS of users
+    seen by authentication. Entries are dropped when the user is saved or
+    deleted in this process; other processes pick changes up within `ttl`.
+    """
+
+    def __init__(self, ttl=30, max_entries=10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # user id -> (snapshot, expires_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'AUTH_USER_CACHE', {})
+        return cls(ttl=options.get('TTL', 30), max_entries=options.get('MAX_ENTRIES', 10_000))
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        snapshot = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(*SNAPSHOT_FIELDS).first()
+        if snapshot is not None:
+            with self._lock:
+                self._entries[key] = (snapshot, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+
+user_snapshots = UserSnapshotCache.from_settings()
+metrics.register('auth_user_cache', user_snapshots.stats)
+
+
+class LazyUser(SimpleLazyObject):
+    """
+    `request.user` that answers the snapshot fields, `is_authenticated` and
+    truthiness from the cached snapshot and loads the User row on first use
+    of anything else.
+    """
+
+    def __init__(self, snapshot):
+        super().__init__(lambda: User.objects.get(pk=snapshot['id']))
+        for name, value in snapshot.items():
+            self.__dict__[name] = value
+        self.__dict__['pk'] = snapshot['id']
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __bool__(self):
+        return True
+
+    def __setattr__(self, name, value):
+        # Keep the snapshot copy in step with writes that go to the row
+        if name in self.__dict__ and name != '_wrapped':
+            self.__dict__[name] = value
+        super().__setattr__(name, value)
+
+
+def resolve_user(user):
+    """The real User behind a LazyUser, loading it if needed."""
+    if isinstance(user, LazyUser):
+        if user._wrapped is empty:
+            user._setup()
+        return user._wrapped
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the per-request User SELECT. Token checks use
+    a cached snapshot of the user (active, staff flags and token version);
+    the full row only loads if the view touches other attributes.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        snapshot = user_snapshots.get(user_id)
+        if snapshot is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not snapshot['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        # Tokens from before the claim existed count as version 0
+        if validated_token.get(TOKEN_VERSION_CLAIM, 0) != snapshot['token_version']:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+        return LazyUser(snapshot)
@@ -0,0 +1,287 @@
+import heapq
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from . import metrics
+
+
+User = get_user_model()
+
+LOW_BITS = (1 << 64) - 1
+SEPARATOR = '\x1f'
+
+# The User fields an entry is made of; a save touching none of them is skipped
+ENTRY_FIELDS = ('first_name', 'last_name', 'email', 'is_active')
+
+
+def normalize(text):
+    return ' '.join(text.split()).casefold()
+
+
+def entry_of(values):
+    """(first_name, last_name, email) of an active user, None for an inactive one."""
+    if not values['is_active']:
+        return None
+    return values['first_name'] or '', values['last_name'] or '', values['email']
+
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index over the names and emails of active users.
+
+    Each user's (first_name, last_name, email) is one record in an
+    append-only UTF-8 blob, with its UUID in two 64-bit arrays. Three
+    arrays of record numbers are kept sorted by (casefolded text, id) for
+    the full name, the last name and the email, so a prefix is two
+    bisects per array and the users under it are read off in order; a
+    user is found exactly by its values and id for an update. That is 36
+    bytes per user plus the text itself.
+
+    Results are the first `limit` matches in (casefolded text, id) order
+    across the three arrays, each user once. A change appends a new record and moves the user's
+    positions (an O(n) memmove); replaced records stay in the blob until
+    the next rebuild.
+
+    The index is built on `warm()` or first use and rebuilt in the
+    background every `max_age` seconds, which picks up changes made by
+    other processes and by `QuerySet.update()`; lookups keep using the
+    current one meanwhile. Saves in this process are applied as they
+    commit.
+    """
+
+    # The text each sorted array is ordered by
+    KEYS = {
+        'name': lambda first, last, email: normalize(f'{first} {last}'),
+        'last_name': lambda first, last, email: normalize(last),
+        'email': lambda first, last, email: email.casefold(),
+    }
+
+    def __init__(self, max_age=300, max_results=50):
+        self.max_age = max_age
+        self.max_results = max_results
+
+        self._blob = bytearray()
+        self._ends = array('Q')
+        self._high = array('Q')
+        self._low = array('Q')
+        self._sorted = {key: array('I') for key in self.KEYS}
+        self._built_at = None
+        self._stale = False
+        self._refreshing = False
+        self._building = False
+        self._pending = []
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+        self.rebuilds = 0
+        self.updates = 0
+        self.lookups = 0
+        self.last_build_ms = None
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'AUTOCOMPLETE', {})
+        return cls(
+            max_age=options.get('MAX_AGE', 300),
+            max_results=options.get('MAX_RESULTS', 50),
+        )
+
+    @staticmethod
+    def _id_parts(user_id):
+        number = user_id.int if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id)).int
+        return number >> 64, number & LOW_BITS
+
+    def _record(self, slot):
+        start = self._ends[slot - 1] if slot else 0
+        return self._blob[start:self._ends[slot]].decode().split(SEPARATOR)
+
+    def _sort_key(self, key):
+        text = self.KEYS[key]
+        return lambda slot: (text(*self._record(slot)), self._high[slot], self._low[slot])
+
+    def _append(self, entry, high, low):
+        self._blob += SEPARATOR.join(entry).encode()
+        self._ends.append(len(self._blob))
+        self._high.append(high)
+        self._low.append(low)
+        return len(self._ends) - 1
+
+    def _find(self, key, entry, high, low):
+        # Position of the user's record in the `key` array, None if it is not there
+        target = (self.KEYS[key](*entry), high, low)
+        positions = self._sorted[key]
+        position = bisect_left(positions, target, key=self._sort_key(key))
+        if position < len(positions) and self._sort_key(key)(positions[position]) == target:
+            return position
+        return None
+
+    def _apply(self, user_id, old, new):
+        # Idempotent, so changes replayed over a fresh build are harmless. Each
+        # array is checked on its own: a build that already saw the change has
+        # `new` under every key, while `old` may share some keys' text with it
+        high, low = self._id_parts(user_id)
+        if old is not None:
+            for key, positions in self._sorted.items():
+                position = self._find(key, old, high, low)
+                if position is not None:
+                    del positions[position]
+        if new is not None:
+            missing = [key for key in self._sorted if self._find(key, new, high, low) is None]
+            if missing:
+                slot = self._append(new, high, low)
+                for key in missing:
+                    positions, sort_key = self._sorted[key], self._sort_key(key)
+                    positions.insert(bisect_left(positions, sort_key(slot), key=sort_key), slot)
+
+    def update(self, user_id, old, new):
+        """
+        Move a user from entry `old` to entry `new` (see entry_of). `old` is
+        None for a new or reactivated user, `new` for a deleted or
+        deactivated one.
+        """
+        if old == new:
+            return
+
+        with self._lock:
+            self.updates += 1
+            if self._building:
+                self._pending.append((user_id, old, new))
+            if self._built_at is not None:
+                self._apply(user_id, old, new)
+
+    def invalidate(self):
+        """Rebuild soon; for changes whose previous values are unknown."""
+        with self._lock:
+            self._stale = True
+
+    def rebuild(self, if_missing=False):
+        with self._build_lock:
+            # Threads that queued up behind the first build reuse it
+            if if_missing and self._built_at is not None:
+                return
+
+            with self._lock:
+                self._building = True
+                self._pending = []
+
+            start = time.perf_counter()
+            try:
+                index = type(self)(self.max_age, self.max_results)
+                rows = User.objects.filter(is_active=True).values_list('id', 'first_name', 'last_name', 'email')
+                for user_id, first, last, email in rows.iterator(chunk_size=10000):
+                    index._append((first or '', last or '', email), *self._id_parts(user_id))
+                for key, text in self.KEYS.items():
+                    # One bytes object per record instead of a (text, high, low) tuple halves
+                    # the peak; UTF-8 and big-endian bytes sort in the same order
+                    order = sorted(
+                        range(len(index._ends)),
+                        key=lambda slot: b'\0'.join((
+                            text(*index._record(slot)).encode(),
+                            index._high[slot].to_bytes(8, 'big') + index._low[slot].to_bytes(8, 'big'),
+                        )),
+                    )
+                    index._sorted[key] = array('I', order)
+                    del order
+            except BaseException:
+                with self._lock:
+                    self._building = False
+                    self._pending = []
+                raise
+
+            # One critical section, so no change lands between the swap and the replay
+            with self._lock:
+                self._blob, self._ends, self._high, self._low = index._blob, index._ends, index._high, index._low
+                self._sorted = index._sorted
+                # Saves that committed while the table was being read
+                for change in self._pending:
+                    self._apply(*change)
+                self._pending = []
+                self._building = False
+                self._built_at = time.monotonic()
+                self._stale = False
+                self.rebuilds += 1
+                self.last_build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def _refresh(self):
+        try:
+            self.rebuild()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def warm(self):
+        """Build in a background thread, e.g. as a worker starts; one at a time."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='autocomplete-build', daemon=True).start()
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # Nothing to serve yet, so wait for a build (the warm-up's, if it is running)
+            self.rebuild(if_missing=True)
+        elif self._stale or time.monotonic() - self._built_at >= self.max_age:
+            self.warm()
+
+    def _matches(self, key, prefix):
+        # (text, high, low, slot) of every record under `prefix`, in order
+        positions = self._sorted[key]
+        sort_key = self._sort_key(key)
+        for i in range(bisect_left(positions, (prefix,), key=sort_key), len(positions)):
+            slot = positions[i]
+            text, high, low = sort_key(slot)
+            if not text.startswith(prefix):
+                return
+            yield text, high, low, slot
+
+    def lookup(self, prefix, limit=10):
+        """Up to `limit` active users whose full name, last name or email starts with `prefix`."""
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, self.max_results))
+        if not prefix:
+            return []
+
+        self._ensure_fresh()
+        results, seen = [], set()
+        with self._lock:
+            self.lookups += 1
+            merged = heapq.merge(*(self._matches(key, prefix) for key in self._sorted))
+            for _, high, low, slot in merged:
+                if (high, low) in seen:
+                    continue
+                seen.add((high, low))
+                first, last, email = self._record(slot)
+                results.append({
+                    'id': uuid.UUID(int=(high << 64) | low),
+                    'first_name': first,
+                    'last_name': last,
+                    'email': email,
+                })
+                if len(results) == limit:
+                    break
+        return results
+
+    def stats(self):
+        with self._lock:
+            arrays = (self._ends, self._high, self._low, *self._sorted.values())
+            return {
+                'users': len(self._sorted['email']),
+                'records': len(self._ends),
+                'bytes': len(self._blob) + sum(a.itemsize * len(a) for a in arrays),
+                'age': None if self._built_at is None else round(time.monotonic() - self._built_at),
+                'rebuilds': self.rebuilds,
+                'last_build_ms': self.last_build_ms,
+                'updates': self.updates,
+                'lookups': self.lookups,
+            }
+
+
+autocomplete = AutocompleteIndex.from_settings()
+metrics.register('autocomplete', autocomplete.stats)
@@ -0,0 +1,89 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalRetrieveMixin:
+    """
+    ETag / Last-Modified on reads, 304 for `If-None-Match` and
+    `If-Modified-Since`, 412 for a stale `If-Match` on writes.
+
+    Validators come from the row's `id` and `updated_at` only, so a 304 or
+    412 is answered from a single-column query, before the row is loaded
+    or serialized. The ETag also covers what changes the body for the same
+    row: the view, the ?fields= subset, the renderer and the host that
+    absolute URLs are built on.
+    """
+
+    def get_version(self):
+        """`(id, updated_at)` of the requested row, None if there is none."""
+        # A mixin further down may know it without a query (see CachedRetrieveMixin)
+        parent = getattr(super(), 'get_version', None)
+        if parent is not None:
+            return parent()
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        lookup = self.kwargs[lookup_url_kwarg]
+        updated_at = (
+            self.get_queryset().filter(**{self.lookup_field: lookup})
+            .values_list('updated_at', flat=True).first()
+        )
+        return None if updated_at is None else (lookup, updated_at)
+
+    def get_validators(self):
+        """`(etag, last_modified timestamp)`, or `(None, None)` for a missing row."""
+        version = self.get_version()
+        if version is None:
+            return None, None
+
+        pk, updated_at = version
+        fields = self.get_response_fields() if hasattr(self, 'get_response_fields') else None
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        key = ':'.join([
+            type(self).__name__, str(pk), updated_at.isoformat(),
+            ','.join(fields or ()), getattr(renderer, 'format', ''), self.request.get_host(),
+        ])
+        return quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32]), int(updated_at.timestamp())
+
+    @staticmethod
+    def set_validators(response, etag, last_modified):
+        if etag is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def check_preconditions(self, request):
+        # None when the request should go ahead, otherwise the 304/412 to send
+        self.validators = etag, last_modified = self.get_validators()
+        if etag is None:
+            return None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None and response.status_code == 304:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.check_preconditions(request)
+        if response is not None:
+            return response
+
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response, *self.validators)
+
+    def update(self, request, *args, **kwargs):
+        response = self.check_preconditions(request)
+        if response is not None:
+            return response
+
+        response = super().update(request, *args, **kwargs)
+        # updated_at has moved on, hand out the new validators
+        return self.set_validators(response, *self.get_validators())
+
+    def destroy(self, request, *args, **kwargs):
+        response = self.check_preconditions(request)
+        if response is not None:
+            return response
+
+        return super().destroy(request, *args, **kwargs)
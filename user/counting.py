@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+class CountStrategy:
+    """
+    Row counts for paginated listings without a COUNT(*) on every request.
+
+    - Tables under `exact_below` rows are counted exactly every time.
+    - Bigger tables are counted once per filter combination and the result
+      is cached for `ttl` seconds, or until a row of that model is created
+      or deleted.
+    - From `estimate_above` rows the planner's estimate is used instead,
+      where the database can give one for the query.
+
+    `count()` returns `(count, exact)`. The table size comes from the
+    planner statistics (PostgreSQL) or the largest rowid (SQLite), so
+    picking a strategy is cheap too. The SQLite size is an upper bound:
+    it still counts deleted rows below the newest one, so a table that
+    lost many rows may be estimated, or cached, when a count would be cheap.
+    """
+
+    def __init__(self, exact_below=10_000, estimate_above=1_000_000, ttl=60, max_entries=1024):
+        self.exact_below = exact_below
+        self.estimate_above = estimate_above
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # (model label, sql, params) -> (count, exact, expires_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.exact_counts = 0
+        self.estimates = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'COUNT_STRATEGY', {})
+        return cls(
+            exact_below=options.get('EXACT_BELOW', 10_000),
+            estimate_above=options.get('ESTIMATE_ABOVE', 1_000_000),
+            ttl=options.get('CACHE_TTL', 60),
+            max_entries=options.get('MAX_ENTRIES', 1024),
+        )
+
+    def count(self, queryset):
+        queryset = queryset.order_by()
+        size = self.table_size(queryset.model, queryset.db)
+        if size is not None and size < self.exact_below:
+            with self._lock:
+                self.exact_counts += 1
+            return queryset.count(), True
+
+        sql, params = queryset.query.sql_with_params()
+        key = (queryset.model._meta.label, sql, tuple(map(str, params)))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[2]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[:2]
+            self.misses += 1
+
+        result = None
+        if size is None or size >= self.estimate_above:
+            estimate = self.estimate(queryset, size)
+            if estimate is not None:
+                result = (estimate, False)
+
+        if result is None:
+            result = (queryset.count(), True)
+
+        with self._lock:
+            if result[1]:
+                self.exact_counts += 1
+            else:
+                self.estimates += 1
+            self._entries[key] = (*result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return result
+
+    def invalidate(self, model):
+        label = model._meta.label
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == label]:
+                del self._entries[key]
+
+    def table_size(self, model, using):
+        """Approximate number of rows in the model's table, None if unknown."""
+        connection = connections[using]
+        table = connection.ops.quote_name(model._meta.db_table)
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # The largest rowid, O(log n): an upper bound, since rows deleted
+                # below it still count (ANALYZE's sqlite_stat1 is never run here)
+                cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+                size = cursor.fetchone()[0]
+                return size or 0
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                # -1 until the table has been vacuumed or analyzed
+                return row[0] if row and row[0] >= 0 else None
+        return None
+
+    def estimate(self, queryset, size):
+        """The planner's row estimate for `queryset`, None if there is none."""
+        connection = connections[queryset.db]
+
+        if not queryset.query.where:
+            return size
+
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        # SQLite's planner does not report row estimates, so filtered
+        # listings fall back to a cached exact count
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'exact_counts': self.exact_counts,
+                'estimates': self.estimates,
+            }
+
+
+counts = CountStrategy.from_settings()
+metrics.register('counts', counts.stats)
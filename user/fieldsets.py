@@ -0,0 +1,93 @@
+from functools import lru_cache
+
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+from .readonly import ordering_columns
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class):
+    """Serializer field name -> model column, for the fields a response can contain."""
+    return {
+        name: field.source
+        for name, field in serializer_class().fields.items()
+        if not field.write_only
+    }
+
+
+def sparse_fields_parameters(serializer_class):
+    names = ', '.join(readable_fields(serializer_class))
+    return [
+        OpenApiParameter(
+            'fields', str,
+            description=f'Comma-separated fields to return, out of: {names}.'
+        ),
+        OpenApiParameter(
+            'exclude', str,
+            description='Comma-separated fields to leave out of the response.'
+        ),
+    ]
+
+
+class SparseFieldsMixin:
+    """
+    `?fields=id,first_name` returns only those serializer fields and
+    `?exclude=bio` leaves fields out. Both are checked against the
+    serializer, apply to reads only, and narrow the query to the columns
+    behind the remaining fields.
+    """
+
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_response_fields(self):
+        if not hasattr(self, '_response_fields'):
+            self._response_fields = self.parse_response_fields()
+        return self._response_fields
+
+    def parse_response_fields(self):
+        request = self.request
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+
+        def names(param):
+            return [name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()]
+
+        requested, excluded = names(self.fields_query_param), names(self.exclude_query_param)
+        if not requested and not excluded:
+            return None
+
+        available = readable_fields(self.get_serializer_class())
+        errors = {}
+        for param, given in ((self.fields_query_param, requested), (self.exclude_query_param, excluded)):
+            unknown = [name for name in given if name not in available]
+            if unknown:
+                errors[param] = [f'Unknown field(s): {", ".join(unknown)}. Choose from: {", ".join(available)}.']
+        if errors:
+            raise ValidationError(errors)
+
+        selected = tuple(name for name in available if (not requested or name in requested) and name not in excluded)
+        if not selected:
+            raise ValidationError({self.exclude_query_param: ['No fields left to return.']})
+        return selected
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_response_fields()
+        if fields is None:
+            return queryset
+
+        available = readable_fields(self.get_serializer_class())
+        columns = {available[name] for name in fields} | set(ordering_columns(self))
+        return queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.get_response_fields()
+        if fields is not None:
+            target = getattr(serializer, 'child', serializer)
+            for name in [name for name in target.fields if name not in fields]:
+                target.fields.pop(name)
+        return serializer
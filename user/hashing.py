@@ -0,0 +1,116 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import Throttled
+
+from . import metrics
+
+
+class HashingBusy(Throttled):
+    default_detail = _('Too many sign-ins in progress, please retry shortly.')
+    default_code = 'hashing_busy'
+
+
+class HashingExecutor:
+    """
+    Bounded pool for password hashing and checking.
+
+    Hashing is deliberately slow and CPU-bound; run inline, every login in
+    flight competes for the same cores as the cheap requests beside it.
+    Here at most `max_workers` hashes run at once and at most `max_queue`
+    more wait their turn; past that, callers fail fast with HashingBusy
+    (429 with Retry-After) instead of piling up behind the pool.
+
+    Sync callers block on the result; async views await it without holding
+    a thread. `max_workers=0` hashes inline on the calling thread.
+    """
+
+    thread_name_prefix = 'password-hashing'
+
+    def __init__(self, max_workers=1, max_queue=32, retry_after=1):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self._pool = ThreadPoolExecutor(max_workers, self.thread_name_prefix) if max_workers else None
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue) if max_workers else None
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'PASSWORD_HASHING', {})
+        return cls(
+            max_workers=options.get('MAX_WORKERS', max(1, (os.cpu_count() or 2) // 2)),
+            max_queue=options.get('MAX_QUEUE', 32),
+            retry_after=options.get('RETRY_AFTER', 1),
+        )
+
+    def _timed(self, fn, args, queued_at):
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.wait_seconds += started - queued_at
+                self.hash_seconds += finished - started
+            self._slots.release()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy(wait=self.retry_after)
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return self._pool.submit(self._timed, fn, args, time.monotonic())
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+
+    def run(self, fn, *args):
+        """`fn(*args)` on the pool, blocking until it is done."""
+        # Nested calls (a rehash from inside a check) are already on the pool
+        if self._pool is None or threading.current_thread().name.startswith(self.thread_name_prefix):
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn, *args):
+        """`fn(*args)` on the pool, awaited from the event loop."""
+        if self._pool is None:
+            return fn(*args)
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self):
+        with self._lock:
+            completed = self.completed
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'completed': completed,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(self.wait_seconds / completed * 1000, 3) if completed else None,
+                'avg_hash_ms': round(self.hash_seconds / completed * 1000, 3) if completed else None,
+            }
+
+
+password_hashing = HashingExecutor.from_settings()
+metrics.register('password_hashing', password_hashing.stats)
@@ -0,0 +1,105 @@
+import os
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .profile_cache import profile_cache
+
+
+User = get_user_model()
+
+VARIANT_SIZES = (48, 128, 512)
+
+# extension -> (Pillow format, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(name, size, ext):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{size}.{ext}'
+
+
+def build_variants(storage, name):
+    """
+    Writes square thumbnails of the stored image `name` in every size and
+    format next to the original and returns their storage names.
+    """
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        # Apply the EXIF rotation before it is dropped with the rest of the metadata
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    variants = {'source': name}
+    for size in VARIANT_SIZES:
+        thumb = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+
+        for ext, (fmt, options) in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            # No exif/icc arguments, so the output carries no metadata
+            thumb.save(buffer, fmt, **options)
+
+            target = variant_name(name, size, ext)
+            if storage.exists(target):
+                storage.delete(target)
+            variants.setdefault(str(size), {})[ext] = storage.save(target, ContentFile(buffer.getvalue()))
+
+    return variants
+
+
+def delete_variants(storage, variants):
+    for size in VARIANT_SIZES:
+        for name in variants.get(str(size), {}).values():
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def generate_variants(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+
+    storage = user.profile_picture.storage
+    source = user.profile_picture.name or None
+    old = user.profile_picture_variants or {}
+    if source == old.get('source'):
+        return
+
+    variants = build_variants(storage, source) if source else {}
+    if old and old.get('source') != source:
+        delete_variants(storage, old)
+
+    # Queryset update: no post_save loop, and a no-op if the picture changed meanwhile
+    updated = User.objects.filter(pk=user.pk, profile_picture=user.profile_picture.name).update(
+        profile_picture_variants=variants,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        profile_cache.invalidate(user.pk)
+    else:
+        # Replaced while we resized it; the job queued for the new picture makes its own
+        delete_variants(storage, variants)
+
+
+def variant_urls(variants, request=None):
+    urls = {}
+    storage = User._meta.get_field('profile_picture').storage
+
+    for size in VARIANT_SIZES:
+        for ext, name in (variants or {}).get(str(size), {}).items():
+            url = storage.url(name)
+            urls.setdefault(str(size), {})[ext] = request.build_absolute_uri(url) if request else url
+
+    return urls
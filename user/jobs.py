@@ -0,0 +1,130 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, JobStatus
+
+
+logger = logging.getLogger(__name__)
+
+# job name -> callable(**payload)
+HANDLERS = {}
+
+
+class PermanentJobError(Exception):
+    """Raise from a handler when retrying cannot help; the job fails at once."""
+
+
+def job(name):
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload, dedup_key=None, max_attempts=5):
+    fields = {'name': name, 'payload': payload, 'max_attempts': max_attempts, 'run_after': timezone.now()}
+    if not dedup_key:
+        Job.objects.create(**fields)
+        return
+
+    while True:
+        # Refresh a job that is still waiting instead of queueing a second one. A running
+        # job has already read its payload, so a new one waits behind it.
+        if Job.objects.filter(dedup_key=dedup_key, status=JobStatus.PENDING).update(**fields):
+            return
+
+        try:
+            with transaction.atomic():
+                Job.objects.create(dedup_key=dedup_key, **fields)
+            return
+        except IntegrityError:
+            # Another enqueue or a retry made the pending job first; refresh that one
+            pass
+
+
+def backoff(attempts, base=30, cap=3600):
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.9, 1.1))
+
+
+def requeue_stale(stale_after):
+    """Hand jobs back to the queue when the worker that claimed them died."""
+    stale = Job.objects.filter(
+        status=JobStatus.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    ).values_list('pk', flat=True)
+
+    requeued = 0
+    for pk in list(stale):
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(pk=pk, status=JobStatus.RUNNING).update(
+                    status=JobStatus.PENDING, locked_at=None
+                )
+        except IntegrityError:
+            # A newer job with the same key is already waiting and does the same work
+            Job.objects.filter(pk=pk, status=JobStatus.RUNNING).update(
+                status=JobStatus.FAILED, locked_at=None, last_error='Superseded by a newer job'
+            )
+    return requeued
+
+
+def claim(limit):
+    now = timezone.now()
+    # A job enqueued again while it runs waits until that run is over
+    running = Job.objects.filter(status=JobStatus.RUNNING, dedup_key__isnull=False).values('dedup_key')
+    candidates = Job.objects.filter(
+        status=JobStatus.PENDING, run_after__lte=now
+    ).exclude(dedup_key__in=running).order_by('run_after').values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        # Conditional update so two workers never take the same job
+        if Job.objects.filter(pk=pk, status=JobStatus.PENDING).update(
+            status=JobStatus.RUNNING, locked_at=now, attempts=F('attempts') + 1
+        ):
+            claimed.append(pk)
+
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_after'))
+
+
+def run(job):
+    handler = HANDLERS.get(job.name)
+
+    try:
+        if handler is None:
+            raise PermanentJobError(f'No handler registered for {job.name!r}')
+        handler(**job.payload)
+    except Exception as e:
+        job.last_error = traceback.format_exc()
+        if isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+            job.status = JobStatus.FAILED
+            logger.error('Job %s (%s) failed: %s', job.pk, job.name, e)
+        else:
+            job.status = JobStatus.PENDING
+            job.run_after = timezone.now() + backoff(job.attempts)
+            logger.warning('Job %s (%s) attempt %s failed, retrying: %s', job.pk, job.name, job.attempts, e)
+    else:
+        job.status = JobStatus.DONE
+        job.last_error = None
+
+    job.locked_at = None
+    update_fields = ['status', 'run_after', 'locked_at', 'last_error', 'updated_at']
+    try:
+        with transaction.atomic():
+            job.save(update_fields=update_fields)
+    except IntegrityError:
+        # Enqueued again while it ran, so the waiting job retries it with the newer payload
+        job.status = JobStatus.FAILED
+        job.save(update_fields=update_fields)
+    return job
+
+
+def run_pending(limit=10):
+    return [run(job) for job in claim(limit)]
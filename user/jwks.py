@@ -0,0 +1,140 @@
+import logging
+import re
+import threading
+import time
+
+import jwt
+import requests as req
+from jwt.algorithms import RSAAlgorithm
+
+from . import metrics
+from .oauth_http import oauth_http
+
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class JWKSKeyStore:
+    """
+    Process-wide cache of a provider's JWKS signing keys.
+
+    Keys are parsed to RSA objects once and looked up by `kid`. The set is
+    refetched when its Cache-Control max-age runs out or when a token arrives
+    with a `kid` we have never seen (the provider rotated its keys). Only one
+    thread fetches at a time; the others wait and reuse its result.
+    """
+
+    def __init__(self, provider, url, default_ttl=3600, max_ttl=86400, min_refresh_interval=60, client=None):
+        self.provider = provider
+        self.url = url
+        # Refreshes go through the shared pooled client and its timeouts
+        self.client = client or oauth_http
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        # Stops tokens with made-up kids from hammering the provider
+        self.min_refresh_interval = min_refresh_interval
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    def get_key(self, kid):
+        key = self._keys.get(kid)
+        if key is not None and time.monotonic() < self._expires_at:
+            self.hits += 1
+            return key
+
+        self.misses += 1
+        with self._lock:
+            # Another login may have refreshed the keys while we were waiting
+            key = self._keys.get(kid)
+            if key is not None and time.monotonic() < self._expires_at:
+                return key
+
+            if self._fetched_at is None or time.monotonic() - self._fetched_at >= self.min_refresh_interval:
+                self._refresh()
+
+            # On a failed refresh this still serves the stale key set
+            return self._keys.get(kid)
+
+    def _refresh(self):
+        self._fetched_at = time.monotonic()
+        self.fetches += 1
+
+        try:
+            response = self.client.get(self.provider, self.url)
+            response.raise_for_status()
+            keys = {
+                jwk['kid']: RSAAlgorithm.from_jwk(jwk)
+                for jwk in response.json()['keys']
+                if jwk.get('kty') == 'RSA'
+            }
+        except (req.RequestException, ValueError, KeyError, jwt.PyJWTError):
+            self.fetch_errors += 1
+            logger.warning('Could not refresh JWKS from %s', self.url, exc_info=True)
+            return
+
+        self._keys = keys
+        self._expires_at = self._fetched_at + self._ttl(response.headers.get('Cache-Control', ''))
+
+    def _ttl(self, cache_control):
+        match = MAX_AGE_RE.search(cache_control)
+        if not match:
+            return self.default_ttl
+
+        return max(self.min_refresh_interval, min(int(match.group(1)), self.max_ttl))
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'hits': self.hits,
+            'misses': self.misses,
+            'fetches': self.fetches,
+            'fetch_errors': self.fetch_errors,
+            'expires_in': max(0, round(self._expires_at - time.monotonic())),
+        }
+
+
+class GoogleTokenVerifier:
+    """
+    Verifies Google ID tokens locally against a cached JWKS key set, the
+    same checks `google.oauth2.id_token.verify_oauth2_token` performs, but
+    without downloading Google's certificates on every call.
+    """
+
+    issuers = ('accounts.google.com', 'https://accounts.google.com')
+
+    def __init__(self, keys, clock_skew=0):
+        self.keys = keys
+        self.clock_skew = clock_skew
+
+    def verify(self, token, audience):
+        header = jwt.get_unverified_header(token)
+        key = self.keys.get_key(header.get('kid'))
+        if key is None:
+            raise jwt.InvalidTokenError('Unknown signing key')
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=['RS256'],
+            audience=audience,
+            issuer=self.issuers,
+            leeway=self.clock_skew,
+        )
+
+
+apple_jwks = JWKSKeyStore('apple', 'https://appleid.apple.com/auth/keys')
+metrics.register('apple_jwks', apple_jwks.stats)
+
+google_jwks = JWKSKeyStore('google', 'https://www.googleapis.com/oauth2/v3/certs')
+google_verifier = GoogleTokenVerifier(google_jwks)
+metrics.register('google_jwks', google_jwks.stats)
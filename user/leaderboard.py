@@ -0,0 +1,269 @@
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from . import metrics
+
+
+User = get_user_model()
+
+LOW_BITS = (1 << 64) - 1
+
+
+class SpendLeaderboard:
+    """
+    In-memory ranking of users by `total_spent`, highest first.
+
+    Entries are kept sorted by (-total_spent, id) in three parallel arrays
+    (score, high and low 64 bits of the UUID), about 24 bytes per user,
+    plus a dict from id to score (about 100 bytes per user) so a user's
+    entry is found, moved or removed from its id alone. Lookups are binary
+    searches; a spend change moves one entry with an O(n) memmove, which
+    is far cheaper than re-sorting the table.
+
+    The ranking is built on first use and rebuilt in the background every
+    `max_age` seconds, which picks up changes made by other processes and
+    by `QuerySet.update()`; lookups keep using the current one meanwhile.
+    Saves in this process are applied as they commit. Ranks use
+    competition ranking: equal spend, equal rank.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+
+        self._scores = array('d')
+        self._high = array('Q')
+        self._low = array('Q')
+        self._spend = {}
+        self._built_at = None
+        self._stale = False
+        self._refreshing = False
+        self._building = False
+        self._pending = []
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+        self.rebuilds = 0
+        self.updates = 0
+        self.last_build_ms = None
+
+    @staticmethod
+    def _number(user_id):
+        return user_id.int if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id)).int
+
+    @staticmethod
+    def _key(number, score):
+        return score, number >> 64, number & LOW_BITS
+
+    def _entry(self, position):
+        user_id = uuid.UUID(int=(self._high[position] << 64) | self._low[position])
+        return {
+            'rank': self._rank(self._scores[position]),
+            'id': user_id,
+            'total_spent': -self._scores[position],
+        }
+
+    def _rank(self, score):
+        # Users with strictly more spend, plus one
+        return bisect_left(self._scores, score) + 1
+
+    def _find(self, key):
+        # Leftmost position whose (score, high, low) is not less than key
+        lo = bisect_left(self._scores, key[0])
+        hi = bisect_right(self._scores, key[0], lo)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (self._high[mid], self._low[mid]) < key[1:]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _contains(self, position, key):
+        return (
+            position < len(self._scores)
+            and (self._scores[position], self._high[position], self._low[position]) == key
+        )
+
+    def _insert(self, key):
+        position = self._find(key)
+        if not self._contains(position, key):
+            self._scores.insert(position, key[0])
+            self._high.insert(position, key[1])
+            self._low.insert(position, key[2])
+
+    def _remove(self, key):
+        position = self._find(key)
+        if self._contains(position, key):
+            del self._scores[position], self._high[position], self._low[position]
+
+    def _apply(self, user_id, total_spent):
+        # Idempotent, so changes replayed over a fresh build are harmless
+        number = self._number(user_id)
+        score = None if total_spent is None else -float(total_spent)
+        old = self._spend.get(number)
+        if old == score:
+            return
+        if old is not None:
+            self._remove(self._key(number, old))
+            del self._spend[number]
+        if score is not None:
+            self._insert(self._key(number, score))
+            self._spend[number] = score
+
+    def update(self, user_id, total_spent):
+        """Set a user's spend; None for a deleted user."""
+        with self._lock:
+            self.updates += 1
+            if self._building:
+                self._pending.append((user_id, total_spent))
+            if self._built_at is not None:
+                self._apply(user_id, total_spent)
+
+    def invalidate(self):
+        """Rebuild soon, e.g. after a bulk change made outside the model."""
+        with self._lock:
+            self._stale = True
+
+    def rebuild(self, if_missing=False):
+        with self._build_lock:
+            # Threads that queued up behind the first build reuse it
+            if if_missing and self._built_at is not None:
+                return
+
+            with self._lock:
+                self._building = True
+                self._pending = []
+
+            start = time.perf_counter()
+            try:
+                spend = {
+                    self._number(user_id): -float(total_spent)
+                    for user_id, total_spent in User.objects.values_list('id', 'total_spent').iterator(chunk_size=10000)
+                }
+                keys = sorted(self._key(number, score) for number, score in spend.items())
+                scores = array('d', (key[0] for key in keys))
+                high = array('Q', (key[1] for key in keys))
+                low = array('Q', (key[2] for key in keys))
+                del keys
+            except BaseException:
+                with self._lock:
+                    self._building = False
+                    self._pending = []
+                raise
+
+            # One critical section, so no change lands between the swap and the replay
+            with self._lock:
+                self._scores, self._high, self._low, self._spend = scores, high, low, spend
+                # Saves that committed while the table was being read
+                for change in self._pending:
+                    self._apply(*change)
+                self._pending = []
+                self._building = False
+                self._built_at = time.monotonic()
+                self._stale = False
+                self.rebuilds += 1
+                self.last_build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def _refresh(self):
+        try:
+            self.rebuild()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def warm(self):
+        """Build in a background thread; one at a time."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='leaderboard-build', daemon=True).start()
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # Nothing to serve yet, so wait for a build (a background one, if it is running)
+            self.rebuild(if_missing=True)
+        elif self._stale or time.monotonic() - self._built_at >= self.max_age:
+            self.warm()
+
+    def top(self, n):
+        """The `n` biggest spenders, O(n log n)."""
+        self._ensure_fresh()
+        with self._lock:
+            return [self._entry(position) for position in range(min(n, len(self._scores)))]
+
+    def _locate(self, user_id):
+        # The user's entry, from the id alone; None if it is not ranked
+        number = self._number(user_id)
+        with self._lock:
+            score = self._spend.get(number)
+            if score is not None:
+                return self._key(number, score)
+
+        if User.objects.filter(id=user_id).exists():
+            # Created by another process since the last build: the next one picks it up
+            self.warm()
+        return None
+
+    def rank(self, user_id):
+        """
+        Rank and percentile of one user, O(log n). The percentile is the
+        share of users who spent strictly less. None for an unknown user.
+        """
+        self._ensure_fresh()
+        key = self._locate(user_id)
+        if key is None:
+            return None
+
+        with self._lock:
+            position = self._find(key)
+            if not self._contains(position, key):
+                return None
+
+            total = len(self._scores)
+            below = total - bisect_right(self._scores, key[0])
+            return {
+                **self._entry(position),
+                'percentile': round(below / total * 100, 2),
+                'total_users': total,
+            }
+
+    def neighbours(self, user_id, k):
+        """The user and up to `k` users either side of them, O(k log n)."""
+        self._ensure_fresh()
+        key = self._locate(user_id)
+        if key is None:
+            return None
+
+        with self._lock:
+            position = self._find(key)
+            if not self._contains(position, key):
+                return None
+
+            start, end = max(0, position - k), min(len(self._scores), position + k + 1)
+            return {
+                'above': [self._entry(i) for i in range(start, position)],
+                'user': self._entry(position),
+                'below': [self._entry(i) for i in range(position + 1, end)],
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._scores),
+                'bytes': sum(a.itemsize * len(a) for a in (self._scores, self._high, self._low)),
+                'age': None if self._built_at is None else round(time.monotonic() - self._built_at),
+                'rebuilds': self.rebuilds,
+                'last_build_ms': self.last_build_ms,
+                'updates': self.updates,
+            }
+
+
+leaderboard = SpendLeaderboard(max_age=getattr(settings, 'LEADERBOARD_MAX_AGE', 300))
+metrics.register('leaderboard', leaderboard.stats)
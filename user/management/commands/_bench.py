@@ -0,0 +1,99 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+
+User = get_user_model()
+
+FIRST_NAMES = ['Rahim', 'Karim', 'Ayesha', 'Nusrat', 'Tanvir', 'Farhan', 'Sadia', 'Mehedi', 'Rafi', 'Tania', 'John', 'Maria']
+LAST_NAMES = ['Hossain', 'Rahman', 'Islam', 'Ahmed', 'Chowdhury', 'Khan', 'Sarker', 'Das', 'Smith', 'Garcia']
+CITIES = [('Bangladesh', 'Dhaka'), ('Bangladesh', 'Chittagong'), ('Bangladesh', 'Sylhet'), ('India', 'Kolkata'), ('USA', 'New York')]
+GENDERS = ['male', 'female', 'other', None]
+
+
+def add_benchmark_arguments(parser):
+    parser.add_argument('--db', help='SQLite file to keep the seeded benchmark data in between runs '
+                                     '(default: a throwaway temp file)')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per measurement')
+
+
+@contextmanager
+def benchmark_database(path=None):
+    """
+    Runs the benchmark against a separate, migrated test database so the
+    development data in db.sqlite3 is never touched.
+    """
+    keep = bool(path)
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = path or os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keep)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+        teardown_test_environment()
+
+
+def seed_users(count, batch_size=5000, stdout=None):
+    """Bulk-inserts users until the table holds `count` rows."""
+    existing = User.objects.count()
+    if existing >= count:
+        return existing
+
+    password = make_password(None)
+    now = timezone.now()
+    created_at = User._meta.get_field('created_at')
+
+    # Let bulk_create keep our spread-out created_at values
+    created_at.auto_now_add = False
+    try:
+        for start in range(existing, count, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, count)):
+                country, city = random.choice(CITIES)
+                batch.append(User(
+                    email=f'user{i}@bench.test',
+                    first_name=random.choice(FIRST_NAMES),
+                    last_name=random.choice(LAST_NAMES),
+                    password=password,
+                    gender=random.choice(GENDERS),
+                    country=country,
+                    city=city,
+                    total_spent=round(random.lognormvariate(4, 1.5), 2),
+                    is_active=random.random() < 0.9,
+                    created_at=now - timedelta(seconds=random.randrange(3 * 365 * 86400)),
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(batch)
+
+            if stdout and (start // batch_size) % 20 == 0:
+                stdout.write(f'  seeded {start + len(batch):,}/{count:,} users')
+    finally:
+        created_at.auto_now_add = True
+
+    return count
+
+
+def timed(func, repeat):
+    """Median and p95 wall time of `func()` in milliseconds."""
+    func()  # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
@@ -0,0 +1,70 @@
+import itertools
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from user.autocomplete import AutocompleteIndex
+
+from ._bench import FIRST_NAMES, LAST_NAMES, User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'Type-ahead lookups: an istartswith query vs the in-memory autocomplete index'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--limit', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['limit'], options['repeat'])
+
+    def run(self, limit, repeat):
+        index = AutocompleteIndex(max_age=float('inf'))
+        index.rebuild()
+        stats = index.stats()
+        self.stdout.write(
+            f'build: {stats["last_build_ms"]:,.0f}ms for {stats["users"]:,} users, '
+            f'{stats["bytes"] / 2**20:.1f} MiB ({stats["bytes"] / max(stats["users"], 1):.0f} bytes/user)'
+        )
+
+        emails = itertools.cycle(User.objects.filter(is_active=True).order_by('?').values_list('email', flat=True)[:repeat + 1])
+        names = itertools.cycle(random.sample(FIRST_NAMES, len(FIRST_NAMES)))
+        lasts = itertools.cycle(random.sample(LAST_NAMES, len(LAST_NAMES)))
+
+        def sql(prefix):
+            # The indexed query a keystroke would otherwise cost
+            matches = Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix) | Q(email__istartswith=prefix)
+            return list(User.objects.filter(matches, is_active=True).order_by('email')
+                        .values('id', 'first_name', 'last_name', 'email')[:limit])
+
+        cases = [
+            ('1 letter', lambda: next(names)[:1]),
+            ('3 letters', lambda: next(names)[:3]),
+            ('first + last', lambda: f'{next(names)} {next(lasts)[:2]}'),
+            ('email prefix', lambda: next(emails)[:8]),
+            ('no match', lambda: 'zzqx'),
+        ]
+        for label, make_prefix in cases:
+            sql_p50, sql_p95 = timed(lambda: sql(make_prefix()), repeat)
+            mem_p50, mem_p95 = timed(lambda: index.lookup(make_prefix(), limit), repeat)
+            self.stdout.write(
+                f'{label:<13} sql p50={sql_p50:8.2f}ms p95={sql_p95:8.2f}ms   '
+                f'index p50={mem_p50:6.3f}ms p95={mem_p95:6.3f}ms'
+            )
+
+        user = User.objects.filter(is_active=True).values('id', 'first_name', 'last_name', 'email').first()
+        old = (user['first_name'], user['last_name'], user['email'])
+        new = ('Zara', *old[1:])
+
+        def rename():
+            # There and back, so the index is unchanged for the next run
+            index.update(user['id'], old, new)
+            index.update(user['id'], new, old)
+
+        p50, p95 = timed(rename, repeat)
+        self.stdout.write(f'{"2 renames":<13} index p50={p50:6.3f}ms p95={p95:6.3f}ms')
@@ -0,0 +1,74 @@
+import random
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from user.images import VARIANT_FORMATS, VARIANT_SIZES, build_variants
+
+
+User = get_user_model()
+
+
+def synthetic_photo(width=1600, height=1200):
+    # Gradient plus shapes and noise compresses roughly like a phone photo
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = random.randrange(width), random.randrange(height)
+        r = random.randrange(20, 300)
+        draw.ellipse((x, y, x + r, y + r), fill=tuple(random.randrange(256) for _ in range(3)))
+    image = Image.blend(image, Image.effect_noise((width, height), 40).convert('RGB'), 0.25)
+
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Bytes of profile pictures a user list page references: originals vs resized variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=settings.REST_FRAMEWORK['PAGE_SIZE'])
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Use generated photos in a temp dir instead of the users in the database')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+
+        if options['synthetic']:
+            storage = FileSystemStorage(location=tempfile.mkdtemp())
+            pages = []
+            for i in range(page_size):
+                name = storage.save(f'dps/bench_{i}.jpg', ContentFile(synthetic_photo()))
+                pages.append((name, build_variants(storage, name)))
+        else:
+            storage = User._meta.get_field('profile_picture').storage
+            users = (
+                User.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+                .order_by('-created_at')[:page_size]
+            )
+            pages = [
+                (user.profile_picture.name, user.profile_picture_variants or build_variants(storage, user.profile_picture.name))
+                for user in users
+            ]
+
+        if not pages:
+            self.stdout.write(self.style.WARNING('No users with a profile picture, try --synthetic'))
+            return
+
+        original = sum(storage.size(name) for name, _ in pages)
+        self.stdout.write(f'{len(pages)} pictures per page')
+        self.stdout.write(f'{"original":<12} {original:>12,} bytes')
+
+        for size in VARIANT_SIZES:
+            for ext in VARIANT_FORMATS:
+                total = sum(storage.size(variants[str(size)][ext]) for _, variants in pages)
+                self.stdout.write(
+                    f'{f"{size}px {ext}":<12} {total:>12,} bytes  ({total / original:6.1%} of original)'
+                )
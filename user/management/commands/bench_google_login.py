@@ -0,0 +1,138 @@
+import json
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from django.core.management.base import BaseCommand
+from google.auth.transport import requests
+from google.oauth2 import id_token
+from jwt.algorithms import RSAAlgorithm
+
+from user.jwks import GoogleTokenVerifier, JWKSKeyStore
+
+
+AUDIENCE = 'bench-client-id.apps.googleusercontent.com'
+KID = 'bench-key'
+
+
+def make_key_material():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench')])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+
+    # v1 is the PEM format google-auth downloads, v3 is the JWKS format
+    v1 = {KID: cert.public_bytes(serialization.Encoding.PEM).decode()}
+    jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({'kid': KID, 'alg': 'RS256', 'use': 'sig'})
+    v3 = {'keys': [jwk]}
+
+    return key, v1, v3
+
+
+def make_id_token(key):
+    now = int(time.time())
+    claims = {
+        'iss': 'https://accounts.google.com',
+        'aud': AUDIENCE,
+        'sub': '1234567890',
+        'email': 'bench@example.com',
+        'email_verified': True,
+        'iat': now,
+        'exp': now + 3600,
+    }
+    return jwt.encode(claims, key, algorithm='RS256', headers={'kid': KID})
+
+
+class StubCertServer:
+    """Serves Google-style v1/v3 cert documents and counts the requests."""
+
+    def __init__(self, v1, v3, latency):
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(latency)
+                body = json.dumps(v1 if self.path.endswith('/v1') else v3).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'public, max-age=21600')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Command(BaseCommand):
+    help = 'Compare Google ID-token verification latency and cert downloads, per-call transport vs cached verifier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--latency-ms', type=float, default=40,
+                            help='Artificial delay added by the stub cert server to mimic a real round trip')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        key, v1, v3 = make_key_material()
+        token = make_id_token(key)
+
+        with StubCertServer(v1, v3, options['latency_ms'] / 1000) as server:
+            def before():
+                # What GoogleOAuthSerializer used to do on every login
+                idinfo = id_token.verify_token(token, requests.Request(), AUDIENCE, certs_url=f'{server.url}/v1')
+                assert idinfo['iss'] in GoogleTokenVerifier.issuers
+
+            verifier = GoogleTokenVerifier(JWKSKeyStore('google', f'{server.url}/v3'))
+
+            def after():
+                verifier.verify(token, AUDIENCE)
+
+            for label, verify in (('before (fresh transport)', before), ('after (cached verifier)', after)):
+                server.requests = 0
+                timings = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    verify()
+                    timings.append((time.perf_counter() - start) * 1000)
+
+                timings.sort()
+                self.stdout.write(
+                    f'{label:<26} p50={statistics.median(timings):7.2f}ms '
+                    f'p95={timings[int(len(timings) * 0.95) - 1]:7.2f}ms '
+                    f'outbound requests={server.requests}/{iterations}'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,101 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.test import APIRequestFactory
+
+from user import models
+from user.hashing import HashingExecutor
+from user.tokens import RefreshToken
+from user.views import MyProfileView, UserLoginView
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users
+
+PASSWORD = 'bench-password-1'
+
+
+class Command(BaseCommand):
+    help = 'me/ latency while login/ runs at full load, hashing inline vs on the bounded hashing pool'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--logins', type=int, default=16, help='Concurrent login clients')
+        parser.add_argument('--seconds', type=float, default=5, help='Load duration per run')
+        parser.add_argument('--workers', type=int, default=1, help='Hashing pool size')
+        parser.add_argument('--queue', type=int, default=8, help='Hashing pool queue depth')
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            seed_users(options['logins'] + 1)
+            self.run(options)
+
+    def run(self, options):
+        factory = APIRequestFactory()
+        users = list(User.objects.all()[:options['logins'] + 1])
+        User.objects.filter(pk__in=[user.pk for user in users]).update(
+            is_active=True, password=make_password(PASSWORD)
+        )
+        reader, clients = users[0], users[1:]
+
+        me = MyProfileView.as_view()
+        header = f'Bearer {RefreshToken.for_user(reader).access_token}'
+        # Measuring the hashing pool, not the login rate limits
+        login = UserLoginView.as_view(throttle_classes=[])
+
+        def fetch_me():
+            start = time.perf_counter()
+            response = me(factory.get('/api/user/me/', HTTP_AUTHORIZATION=header))
+            response.render()
+            assert response.status_code in (200, 304), response.status_code
+            return (time.perf_counter() - start) * 1000
+
+        def percentiles(samples):
+            samples = sorted(samples)
+            return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+        idle = [fetch_me() for _ in range(options['repeat'] * 5)]
+        self.stdout.write(f'{"idle":<24} me/ p50={percentiles(idle)[0]:7.2f}ms p95={percentiles(idle)[1]:7.2f}ms')
+
+        for label, executor in (
+            ('inline hashing', HashingExecutor(max_workers=0)),
+            (f'pool {options["workers"]}+{options["queue"]}', HashingExecutor(options['workers'], options['queue'])),
+        ):
+            stop = threading.Event()
+            statuses = Counter()
+
+            def client(user):
+                try:
+                    while not stop.is_set():
+                        request = factory.post('/api/user/login/', {'email': user.email, 'password': PASSWORD}, format='json')
+                        response = login(request)
+                        statuses[response.status_code] += 1
+                        if response.status_code == 429:
+                            time.sleep(float(response['Retry-After']) / 10)
+                finally:
+                    connections.close_all()
+
+            with mock.patch.object(models, 'password_hashing', executor):
+                threads = [threading.Thread(target=client, args=(user,)) for user in clients]
+                for thread in threads:
+                    thread.start()
+
+                samples = []
+                deadline = time.perf_counter() + options['seconds']
+                while time.perf_counter() < deadline:
+                    samples.append(fetch_me())
+                    time.sleep(0.01)
+
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+            p50, p95 = percentiles(samples)
+            self.stdout.write(
+                f'{label:<24} me/ p50={p50:7.2f}ms p95={p95:7.2f}ms  '
+                f'logins/s={statuses[200] / options["seconds"]:6.1f}  429s={statuses[429]}'
+            )
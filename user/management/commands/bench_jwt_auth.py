@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from user.authentication import CachedJWTAuthentication
+from user.tokens import RefreshToken
+from user.views import PublicAddressView, PublicProfileView
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'DB queries and latency per authenticated request with JWTAuthentication vs CachedJWTAuthentication'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['repeat'])
+
+    def run(self, repeat):
+        factory = APIRequestFactory()
+        user = User.objects.filter(is_active=True).first()
+        header = f'Bearer {RefreshToken.for_user(user).access_token}'
+
+        # Profile reads come from the profile cache, so authentication is the only query left
+        for label, view_class, path in (
+            ('profile', PublicProfileView, f'/api/user/profile/{user.pk}/'),
+            ('address', PublicAddressView, f'/api/user/addr/{user.pk}/'),
+        ):
+            for auth_class in (JWTAuthentication, CachedJWTAuthentication):
+                view = view_class.as_view(authentication_classes=[auth_class])
+
+                def fetch():
+                    response = view(factory.get(path, HTTP_AUTHORIZATION=header), id=user.pk)
+                    assert response.status_code == 200, response.status_code
+                    response.render()
+
+                fetch()
+                with CaptureQueriesContext(connection) as queries:
+                    fetch()
+
+                p50, p95 = timed(fetch, repeat)
+                self.stdout.write(
+                    f'{label:<8} {auth_class.__name__:<24} queries={len(queries.captured_queries)} '
+                    f'p50={p50:7.3f}ms p95={p95:7.3f}ms'
+                )
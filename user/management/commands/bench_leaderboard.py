@@ -0,0 +1,76 @@
+import itertools
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from user.leaderboard import SpendLeaderboard
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'Top-N, rank and neighbour queries from SQL vs the in-memory spend leaderboard'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--window', type=int, default=5, help='Neighbours either side of the user')
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['top'], options['window'], options['repeat'])
+
+    def run(self, n, k, repeat):
+        board = SpendLeaderboard(max_age=float('inf'))
+        board.rebuild()
+        stats = board.stats()
+        self.stdout.write(
+            f'build: {stats["last_build_ms"]:,.0f}ms for {stats["users"]:,} users, {stats["bytes"] / 2**20:.1f} MiB'
+        )
+
+        sample = list(User.objects.order_by('?').values_list('id', flat=True)[:repeat + 1])
+        users = itertools.cycle(sample)
+
+        def sql_rank():
+            total_spent = User.objects.filter(id=next(users)).values_list('total_spent', flat=True).get()
+            total = User.objects.count()
+            above = User.objects.filter(total_spent__gt=total_spent).count()
+            below = User.objects.filter(total_spent__lt=total_spent).count()
+            return above + 1, below / total
+
+        def sql_neighbours():
+            user = User.objects.only('id', 'total_spent').get(id=next(users))
+            after = Q(total_spent__lt=user.total_spent) | Q(total_spent=user.total_spent, id__lt=user.id)
+            before = Q(total_spent__gt=user.total_spent) | Q(total_spent=user.total_spent, id__gt=user.id)
+            list(User.objects.filter(before).order_by('total_spent', 'id').values('id', 'total_spent')[:k])
+            list(User.objects.filter(after).order_by('-total_spent', '-id').values('id', 'total_spent')[:k])
+
+        def move():
+            user_id = next(users)
+            old = User.objects.filter(id=user_id).values_list('total_spent', flat=True).get()
+            # There and back, so the ranking is unchanged for the next run
+            new = old + random.uniform(1, 1000)
+            board.update(user_id, old, new)
+            board.update(user_id, new, old)
+
+        cases = [
+            (f'top {n}', lambda: list(User.objects.order_by('-total_spent', '-id').values('id', 'total_spent')[:n]),
+             lambda: board.top(n)),
+            ('rank + percentile', sql_rank, lambda: board.rank(next(users))),
+            (f'neighbours k={k}', sql_neighbours, lambda: board.neighbours(next(users), k)),
+        ]
+
+        for label, sql, memory in cases:
+            sql_p50, sql_p95 = timed(sql, repeat)
+            mem_p50, mem_p95 = timed(memory, repeat)
+            self.stdout.write(
+                f'{label:<18} sql p50={sql_p50:8.2f}ms p95={sql_p95:8.2f}ms   '
+                f'leaderboard p50={mem_p50:8.2f}ms p95={mem_p95:8.2f}ms'
+            )
+
+        p50, p95 = timed(move, repeat)
+        self.stdout.write(f'{"2 spend changes":<18} leaderboard p50={p50:8.2f}ms p95={p95:8.2f}ms')
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from user.pagination import KeysetPagination
+from user.views import UserListViewSet
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'Latency of page 1 vs a deep page of api/user/list/ with page-number and keyset pagination'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--page', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['page'], options['repeat'])
+
+    def run(self, deep_page, repeat):
+        factory = APIRequestFactory()
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+        # Cursor that lands on `deep_page`: the last row of the page before it
+        paginator = KeysetPagination()
+        request = Request(factory.get('/api/user/list/'))
+        paginator.ordering = paginator.get_ordering(request, User.objects.all(), UserListViewSet(request=request))
+        last_row = User.objects.order_by(*paginator.ordering)[(deep_page - 1) * page_size - 1]
+        deep_cursor = paginator.make_cursor(last_row, reverse=False)
+
+        # ?page= goes through the page-number fallback with the same ordering
+        cases = [
+            ('page-number', {'page': 1}, {'page': deep_page}),
+            ('keyset', {}, {'cursor': deep_cursor}),
+        ]
+
+        view = UserListViewSet.as_view({'get': 'list'})
+        for label, first, deep in cases:
+            for page_label, params in (('page 1', first), (f'page {deep_page:,}', deep)):
+                def fetch():
+                    response = view(factory.get('/api/user/list/', params))
+                    assert response.status_code == 200, response.status_code
+                    response.render()
+
+                p50, p95 = timed(fetch, repeat)
+                self.stdout.write(f'{label:<12} {page_label:<12} p50={p50:8.2f}ms p95={p95:8.2f}ms')
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from user.readonly import converter_for
+from user.serializers import UserListSerializer, UserProfileSerializer, UserStatsSerializer
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'Rows/sec for a page of users through ModelSerializer vs the .values() converter'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--page-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['page_size'], options['repeat'])
+
+    def run(self, page_size, repeat):
+        request = Request(APIRequestFactory().get('/api/user/list/'))
+        page = User.objects.order_by('-created_at', '-id')
+
+        for serializer_class in (UserListSerializer, UserProfileSerializer, UserStatsSerializer):
+            converter = converter_for(serializer_class)
+
+            def serializer():
+                return serializer_class(page[:page_size], many=True, context={'request': request}).data
+
+            def values():
+                return converter.convert_many(page.values(*converter.columns)[:page_size], request)
+
+            # Same payload either way, or the comparison means nothing
+            assert [dict(row) for row in serializer()] == values()
+
+            self.stdout.write(serializer_class.__name__)
+            for label, func in (('ModelSerializer', serializer), ('values converter', values)):
+                p50, p95 = timed(func, repeat)
+                self.stdout.write(
+                    f'  {label:<17} p50={p50:8.2f}ms p95={p95:8.2f}ms  {page_size / p50 * 1000:>10,.0f} rows/s'
+                )
@@ -0,0 +1,110 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+
+from user import retry
+from user.retry import retry_on_lock
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users
+
+
+class Command(BaseCommand):
+    help = 'Concurrent reads and writes on the User table: default SQLite settings vs the tuned DATABASES profile'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=20_000)
+        parser.add_argument('--readers', type=int, default=6)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5, help='Duration per profile')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is about the SQLite settings')
+
+        settings_dict = connection.settings_dict
+        tuned = {'CONN_MAX_AGE': settings_dict['CONN_MAX_AGE'], 'OPTIONS': dict(settings_dict['OPTIONS'])}
+        default = {'CONN_MAX_AGE': 0, 'OPTIONS': {}}
+
+        with benchmark_database(options['db']):
+            seed_users(options['rows'])
+            self.ids = list(User.objects.values_list('pk', flat=True))
+
+            for label, profile, journal_mode in (('default', default, 'DELETE'), ('tuned', tuned, 'WAL')):
+                connections.close_all()
+                settings_dict.update(profile)
+                # journal_mode is stored in the file, so switch it back for the default run
+                with connection.cursor() as cursor:
+                    cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+                connections.close_all()
+
+                self.run(label, options)
+
+            settings_dict.update(tuned)
+
+    def request(self, op):
+        # What request_started / request_finished do around every view
+        close_old_connections()
+        try:
+            op()
+        finally:
+            close_old_connections()
+
+    def read(self):
+        User.objects.filter(pk=random.choice(self.ids)).values('id', 'email', 'total_spent').first()
+        list(User.objects.filter(is_active=True).order_by('-created_at').values('id', 'email')[:16])
+
+    @retry_on_lock
+    def write(self):
+        if random.random() < 0.2:
+            User.objects.create(email=f'{uuid.uuid4().hex}@bench.test')
+            return
+
+        # Read, then write in the same transaction, like a profile update
+        with transaction.atomic():
+            user = User.objects.only('total_spent').get(pk=random.choice(self.ids))
+            User.objects.filter(pk=user.pk).update(total_spent=user.total_spent + 1)
+
+    def run(self, label, options):
+        stop = threading.Event()
+        done, errors = Counter(), Counter()
+        read_latencies = []
+        retries = retry.stats()['retries']
+
+        def worker(kind, op):
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        self.request(op)
+                    except OperationalError:
+                        errors[kind] += 1
+                        continue
+                    done[kind] += 1
+                    if kind == 'read':
+                        read_latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=('read', self.read)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write', self.write)) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        seconds = options['seconds']
+        p95 = statistics.quantiles(read_latencies, n=20)[-1] if len(read_latencies) > 1 else 0
+        self.stdout.write(
+            f'{label:<8} reads/s={done["read"] / seconds:8,.0f} writes/s={done["write"] / seconds:7,.0f} '
+            f'read p95={p95:6.2f}ms  locked errors: reads={errors["read"]} writes={errors["write"]} '
+            f'(write retries={retry.stats()["retries"] - retries})'
+        )
@@ -0,0 +1,95 @@
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.views import TokenRefreshView
+
+from user import tokens
+from user.models import RevokedToken
+from user.revocation import RevocationStore
+
+from ._bench import User, add_benchmark_arguments, benchmark_database, seed_users
+
+
+class DatabaseOnlyStore(RevocationStore):
+    """Every check is an indexed lookup, the way simplejwt's token_blacklist works."""
+
+    def is_revoked(self, jti):
+        self.checks += 1
+        self.db_checks += 1
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+
+class Command(BaseCommand):
+    help = 'Refresh throughput (rotation + revocation) with and without the Bloom filter in front of the store'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--revoked', type=int, default=200_000, help='Live revoked tokens already stored')
+        parser.add_argument('--refreshes', type=int, default=2000, help='Refreshes per run')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads')
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['db']):
+            seed_users(options['concurrency'])
+            self.seed_revoked(options['revoked'])
+            self.run(options['refreshes'], options['concurrency'])
+
+    def seed_revoked(self, count):
+        existing = RevokedToken.objects.count()
+        if existing >= count:
+            return
+
+        self.stdout.write(f'Seeding {count:,} revoked tokens...')
+        bucket = RevocationStore.bucket(time.time() + 86400)
+        for start in range(existing, count, 10_000):
+            RevokedToken.objects.bulk_create(
+                [RevokedToken(jti=uuid.uuid4().hex, bucket=bucket) for _ in range(start, min(start + 10_000, count))]
+            )
+
+    def run(self, refreshes, concurrency):
+        view = TokenRefreshView.as_view()
+        factory = APIRequestFactory()
+        users = list(User.objects.all()[:concurrency])
+        User.objects.filter(pk__in=[user.pk for user in users]).update(is_active=True)
+
+        def refresh(token):
+            response = view(factory.post('/api/token/refresh/', {'refresh': token}, format='json'))
+            assert response.status_code == 200, response.data
+            return response.data['refresh']
+
+        for label, store in (('database lookup', DatabaseOnlyStore()), ('bloom filter', RevocationStore())):
+            with mock.patch.object(tokens, 'revocations', store):
+                token = refresh(str(tokens.RefreshToken.for_user(users[0])))
+                with CaptureQueriesContext(connection) as queries:
+                    refresh(token)
+
+                def client(user, count):
+                    token = str(tokens.RefreshToken.for_user(user))
+                    try:
+                        for _ in range(count):
+                            token = refresh(token)
+                    finally:
+                        connections.close_all()
+
+                threads = [
+                    threading.Thread(target=client, args=(user, refreshes // concurrency)) for user in users
+                ]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+
+            done = refreshes // concurrency * concurrency
+            self.stdout.write(
+                f'{label:<16} {done / elapsed:8,.0f} refreshes/s  '
+                f'queries/refresh={len(queries.captured_queries)}  '
+                f'revocation checks hitting the DB={store.db_checks}/{store.checks}'
+            )
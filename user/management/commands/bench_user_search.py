@@ -0,0 +1,75 @@
+import itertools
+import random
+from functools import reduce
+from operator import and_, or_
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from user.search import SEARCH_FIELDS, search_queryset, search_terms
+
+from ._bench import FIRST_NAMES, LAST_NAMES, User, add_benchmark_arguments, benchmark_database, seed_users, timed
+
+
+class Command(BaseCommand):
+    help = 'First page of a user search: icontains over the text columns vs the full-text index'
+
+    def add_arguments(self, parser):
+        add_benchmark_arguments(parser)
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--page-size', type=int, default=16)
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('There is no full-text index on this database')
+
+        with benchmark_database(options['db']):
+            self.stdout.write(f'Seeding {options["rows"]:,} users...')
+            seed_users(options['rows'], stdout=self.stdout)
+            self.run(options['page_size'], options['repeat'])
+
+    def run(self, page_size, repeat):
+        firsts = itertools.cycle(random.sample(FIRST_NAMES, len(FIRST_NAMES)))
+        lasts = itertools.cycle(random.sample(LAST_NAMES, len(LAST_NAMES)))
+        active = User.objects.filter(is_active=True)
+        emails = itertools.cycle(active.order_by('?').values_list('email', flat=True)[:repeat + 1])
+
+        def like(text):
+            # What ?search= would be without the index: every word in any column, newest first
+            matches = [
+                reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS))
+                for term in search_terms(text)
+            ]
+            return list(active.filter(reduce(and_, matches)).order_by('-created_at', '-id')
+                        .values('id', 'email')[:page_size])
+
+        def fts(text):
+            return list(search_queryset(active, text).order_by('search_rank', 'id')
+                        .values('id', 'email')[:page_size])
+
+        cases = [
+            ('full email', lambda: next(emails)),
+            ('first name', lambda: next(firsts)),
+            ('first + last name', lambda: f'{next(firsts)} {next(lasts)}'),
+            ('3-letter prefix', lambda: next(firsts)[:3]),
+            ('no match', lambda: 'zzqx'),
+        ]
+        for label, make_text in cases:
+            like_p50, like_p95 = timed(lambda: like(make_text()), repeat)
+            fts_p50, fts_p95 = timed(lambda: fts(make_text()), repeat)
+            matches = search_queryset(active, make_text()).count()
+            self.stdout.write(
+                f'{label:<18} ~{matches:>9,} matches   icontains p50={like_p50:8.2f}ms p95={like_p95:8.2f}ms   '
+                f'full-text p50={fts_p50:8.2f}ms p95={fts_p95:8.2f}ms'
+            )
+
+        user = User.objects.only('id', 'first_name').order_by('?').first()
+        names = itertools.cycle(FIRST_NAMES)
+
+        def rename():
+            user.first_name = next(names)
+            user.save(update_fields=['first_name'])
+
+        p50, p95 = timed(rename, repeat)
+        self.stdout.write(f'{"rename (reindexed)":<18} p50={p50:8.2f}ms p95={p95:8.2f}ms')
@@ -0,0 +1,93 @@
+import itertools
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from user.pagination import KeysetPagination
+from user.views import UserListViewSet
+
+
+# Sample filter values; the planner only cares which columns are constrained
+FILTER_VALUES = {'is_active': True, 'gender': 'male'}
+
+SAMPLE_VALUES = {
+    'DateTimeField': timezone.now,
+    'UUIDField': uuid.uuid4,
+    'FloatField': lambda: 100.0,
+}
+
+
+def classify(plan):
+    if connection.vendor == 'sqlite':
+        full_scan = any(
+            'SCAN' in line and 'USING' not in line and 'SCAN CONSTANT' not in line
+            for line in plan.splitlines()
+        )
+        sort = 'USE TEMP B-TREE' in plan
+    else:
+        full_scan = 'Seq Scan' in plan
+        sort = 'Sort' in plan
+
+    if full_scan:
+        return 'FULL SCAN'
+    return 'SORT' if sort else 'ok'
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the page queries of every api/user/list/ filter/ordering combination and report full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full plan of every query')
+        parser.add_argument('--strict', action='store_true', help='Exit with an error if any query scans the table')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        paginator = KeysetPagination()
+
+        filter_sets = [
+            combo
+            for size in range(len(UserListViewSet.filterset_fields) + 1)
+            for combo in itertools.combinations(UserListViewSet.filterset_fields, size)
+        ]
+        orderings = [prefix + field for field in UserListViewSet.ordering_fields for prefix in ('', '-')]
+
+        scans = []
+        for filters, ordering in itertools.product(filter_sets, orderings):
+            params = {name: FILTER_VALUES[name] for name in filters}
+            request = Request(factory.get('/api/user/list/', {**params, 'ordering': ordering}))
+            view = UserListViewSet(request=request, format_kwarg=None, action='list', args=(), kwargs={})
+            queryset = view.filter_queryset(view.get_queryset())
+
+            paginator.ordering = paginator.get_ordering(request, queryset, view)
+            page_size = paginator.page_size + 1
+            first_page = queryset.order_by(*paginator.ordering)[:page_size]
+
+            # A later page adds the keyset predicate, which can change the plan
+            values = [
+                SAMPLE_VALUES.get(queryset.model._meta.get_field(field.lstrip('-')).get_internal_type(), lambda: 'm')()
+                for field in paginator.ordering
+            ]
+            next_page = queryset.filter(paginator.keyset_filter(values, False)).order_by(*paginator.ordering)[:page_size]
+
+            label = f'{",".join(filters) or "-":<18} {" ".join(paginator.ordering):<28}'
+            for page, query in (('first', first_page), ('next', next_page)):
+                plan = query.explain()
+                status = classify(plan)
+                style = {'ok': self.style.SUCCESS, 'SORT': self.style.WARNING}.get(status, self.style.ERROR)
+                self.stdout.write(f'{label} {page:<6} {style(status)}')
+                if options['verbose_plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+                if status == 'FULL SCAN':
+                    scans.append(f'{label.strip()} ({page} page)')
+
+        if scans:
+            message = f'{len(scans)} queries scan the full user table'
+            if options['strict']:
+                raise CommandError(message)
+            self.stdout.write(self.style.ERROR(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No query scans the full user table'))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.export import FORMATS, UserExportFilter, export_chunks, export_queryset
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Stream the user directory (UserListSerializer rows) as CSV or NDJSON to a file or stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=list(FORMATS), default='csv')
+        parser.add_argument('--file', help='Write here instead of stdout')
+        parser.add_argument('--is-active', choices=['true', 'false'])
+        parser.add_argument('--gender', choices=[choice for choice, _ in User.GENDER_CHOICES])
+        parser.add_argument('--since', help='Only rows updated at or after this ISO 8601 time')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows read and written per chunk')
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('is_active', 'gender', 'since') if options[name]}
+        filterset = UserExportFilter(params, queryset=User.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        queryset = export_queryset(filterset.qs)
+        stream = open(options['file'], 'w', encoding='utf-8', newline='') if options['file'] else sys.stdout
+        try:
+            for chunk in export_chunks(queryset, options['output'], chunk_size=options['chunk_size']):
+                stream.write(chunk)
+        finally:
+            if options['file']:
+                stream.close()
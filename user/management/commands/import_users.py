@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from user.models import User
+from user.rollups import spend_rollups
+
+
+# Columns taken as they are, validated by the model fields
+FIELDS = ('email', 'first_name', 'last_name', 'phone_number', 'gender', 'bio',
+          'street', 'city', 'zip_code', 'country', 'is_active')
+# `password` is hashed here, `password_hash` is stored as given
+COLUMNS = set(FIELDS) | {'password', 'password_hash'}
+
+
+def clean_row(row):
+    """(field values, None) for a valid row, (None, errors by column) otherwise."""
+    errors, values = {}, {}
+
+    unknown = sorted(set(row) - COLUMNS)
+    if unknown:
+        errors['non_field_errors'] = [f'Unknown column(s): {", ".join(unknown)}']
+
+    for name in FIELDS:
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw in (None, ''):
+            if name == 'email':
+                errors[name] = ['This field is required.']
+            continue
+
+        field = User._meta.get_field(name)
+        if name == 'is_active' and isinstance(raw, str):
+            raw = raw.capitalize()
+        try:
+            values[name] = field.clean(raw, None)
+        except ValidationError as e:
+            errors[name] = e.messages
+
+    password, password_hash = row.get('password') or None, row.get('password_hash') or None
+    if password and password_hash:
+        errors['password'] = ['Give either password or password_hash, not both.']
+    elif password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            errors['password_hash'] = ['Not a hash from any of PASSWORD_HASHERS.']
+        values['password'] = password_hash
+    elif password:
+        values['raw_password'] = str(password)
+    else:
+        # No password: the user signs in with a provider or resets it first
+        values['password'] = make_password(None)
+
+    if errors:
+        return None, errors
+
+    values['email'] = User.objects.normalize_email(values['email'])
+    return values, None
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    unknown = sorted(set(reader.fieldnames or ()) - COLUMNS)
+    if unknown:
+        raise CommandError(f'Unknown CSV column(s): {", ".join(unknown)}')
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+def read_ndjson(stream):
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, line.rstrip('\n'), {'non_field_errors': [f'Malformed JSON: {e}']}
+            continue
+        if not isinstance(row, dict):
+            yield line_num, row, {'non_field_errors': ['Expected a JSON object.']}
+            continue
+        yield line_num, row, None
+
+
+class Command(BaseCommand):
+    help = 'Import users from CSV or NDJSON (a file or - for stdin) in batched, chunked transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV or NDJSON file, - for stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Input format (default: from the file extension, csv for stdin)')
+        parser.add_argument('--rejects', help='Where to write rejected rows as NDJSON '
+                                              '(default: <source>.rejects.ndjson, or rejects.ndjson for stdin)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk INSERT')
+        parser.add_argument('--transaction-size', type=int, default=20_000, help='Rows per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes hashing plain-text passwords (1 hashes inline)')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        fmt = options['format'] or ('ndjson' if source.endswith(('.ndjson', '.jsonl')) else 'csv')
+        self.rejects_path = options['rejects'] or ('rejects.ndjson' if source == '-' else f'{source}.rejects.ndjson')
+        self.rejects_file = None
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        self.pool = None
+
+        self.imported = self.rejected = 0
+        self.seen_emails, self.seen_phones = set(), set()
+        self.started = time.perf_counter()
+
+        if source == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        else:
+            stream = open(source, encoding='utf-8-sig', newline='')
+
+        try:
+            rows = read_csv(stream) if fmt == 'csv' else read_ndjson(stream)
+            self.run(rows, options['transaction_size'])
+        finally:
+            stream.close()
+            if self.pool is not None:
+                self.pool.shutdown()
+            if self.rejects_file is not None:
+                self.rejects_file.close()
+
+        # bulk_create sends no post_save. The spend rollups and the search index
+        # are updated with each batch; the servers' in-memory counts, leaderboard
+        # and autocomplete index live in other processes and pick the new users
+        # up at their next expiry or rebuild (COUNT_STRATEGY['CACHE_TTL'],
+        # LEADERBOARD_MAX_AGE, AUTOCOMPLETE['MAX_AGE']).
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {self.imported:,} user(s) in {self.elapsed():.1f}s'))
+        if self.rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected {self.rejected:,} row(s), see {self.rejects_path}'))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def reject(self, line_num, row, errors):
+        if self.rejects_file is None:
+            self.rejects_file = open(self.rejects_path, 'w', encoding='utf-8')
+        self.rejects_file.write(json.dumps({'line': line_num, 'row': row, 'errors': errors}, default=str) + '\n')
+        self.rejected += 1
+
+    def run(self, rows, transaction_size):
+        chunk, batch = [], []
+        for line_num, row, errors in rows:
+            values = None
+            if errors is None:
+                values, errors = clean_row(row)
+            if errors is None:
+                errors = self.duplicate_errors(values)
+            if errors is not None:
+                self.reject(line_num, row, errors)
+                continue
+
+            batch.append((line_num, row, values))
+            if len(batch) >= self.batch_size:
+                chunk.append(batch)
+                batch = []
+                if len(chunk) * self.batch_size >= transaction_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+
+        if batch:
+            chunk.append(batch)
+        if chunk:
+            self.import_chunk(chunk)
+
+    def duplicate_errors(self, values):
+        # Repeats within the file; rows already in the database are caught per batch
+        errors = {}
+        email, phone = values['email'], values.get('phone_number')
+        if email in self.seen_emails:
+            errors['email'] = ['Duplicate of an earlier row.']
+        if phone and phone in self.seen_phones:
+            errors['phone_number'] = ['Duplicate of an earlier row.']
+        if errors:
+            return errors
+
+        self.seen_emails.add(email)
+        if phone:
+            self.seen_phones.add(phone)
+        return None
+
+    def hash_passwords(self, raw_passwords):
+        if self.workers <= 1 or len(raw_passwords) < 2:
+            return [make_password(password) for password in raw_passwords]
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=django.setup)
+        chunksize = max(1, len(raw_passwords) // (self.workers * 4))
+        return list(self.pool.map(make_password, raw_passwords, chunksize=chunksize))
+
+    def import_chunk(self, chunk):
+        # Duplicate checks and password hashing come first: with IMMEDIATE
+        # transactions the write lock is taken at BEGIN, and every other
+        # writer waits on it until the chunk commits
+        prepared = [self.prepare_batch(batch) for batch in chunk]
+        with transaction.atomic():
+            for rows, users in prepared:
+                self.insert_batch(rows, users)
+
+        self.stdout.write(
+            f'{self.imported:,} imported, {self.rejected:,} rejected '
+            f'({self.imported / self.elapsed():,.0f} rows/s)'
+        )
+
+    def prepare_batch(self, batch):
+        """The batch's rows not already taken in the database, and their unsaved Users."""
+        emails = [values['email'] for _, _, values in batch]
+        phones = [values['phone_number'] for _, _, values in batch if values.get('phone_number')]
+        taken_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        taken_phones = set(User.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+
+        rows = []
+        for line_num, row, values in batch:
+            errors = {}
+            if values['email'] in taken_emails:
+                errors['email'] = ['A user with this email already exists.']
+            if values.get('phone_number') in taken_phones:
+                errors['phone_number'] = ['A user with this phone number already exists.']
+            if errors:
+                self.reject(line_num, row, errors)
+            else:
+                rows.append((line_num, row, values))
+
+        raw = [values.pop('raw_password') for _, _, values in rows if 'raw_password' in values]
+        hashes = iter(self.hash_passwords(raw))
+        users = []
+        for _, _, values in rows:
+            if 'password' not in values:
+                values['password'] = next(hashes)
+            users.append(User(**values))
+        return rows, users
+
+    def insert_batch(self, rows, users):
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                spend_rollups.add_users(users)
+            self.imported += len(users)
+        except IntegrityError:
+            # Someone else took an email or phone number since the check, find which row by row
+            for (line_num, row, _), user in zip(rows, users):
+                try:
+                    with transaction.atomic():
+                        user.save(force_insert=True)
+                    self.imported += 1
+                except IntegrityError as e:
+                    self.reject(line_num, row, {'non_field_errors': [str(e)]})
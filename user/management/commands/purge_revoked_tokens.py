@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.revocation import revocations
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked refresh tokens that are past their expiry (REFRESH_TOKEN_LIFETIME)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, metavar='SECONDS',
+                            help='Keep running and purge on this interval instead of once')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                deleted = revocations.purge()
+                self.stdout.write(f'Purged {deleted} expired revoked token(s)')
+
+                if not options['every']:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
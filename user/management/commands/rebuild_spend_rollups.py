@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from user.rollups import spend_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the spend rollups by country, city and gender from the User table '
+            '(after QuerySet.update() or raw SQL on total_spent or the address fields; '
+            'migrate builds them on a new install)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users read per query')
+
+    def handle(self, *args, **options):
+        rollups = spend_rollups.rebuild(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rollups:,} rollup(s) in {spend_rollups.last_build_ms / 1000:.1f}s'
+        ))
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from user.models import ReplicaHeartbeat
+from user.replica import replica
+
+
+class Command(BaseCommand):
+    help = 'Stamp the replica heartbeat on the primary and copy the primary into the SQLite read replica'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, metavar='SECONDS',
+                            help='Keep running and refresh on this interval instead of once')
+
+    def handle(self, *args, **options):
+        if not replica.configured:
+            raise CommandError(f'No {replica.alias!r} database in DATABASES')
+
+        primary, target = connections['default'], connections[replica.alias]
+        # Other backends replicate on their own; the heartbeat still measures their lag
+        copy = primary.vendor == 'sqlite' and target.vendor == 'sqlite'
+
+        try:
+            while True:
+                start = time.perf_counter()
+                ReplicaHeartbeat.objects.using('default').update_or_create(pk=1, defaults={'beat_at': timezone.now()})
+                if copy:
+                    self.copy(primary.settings_dict['NAME'], target.settings_dict['NAME'])
+                self.stdout.write(f'Replica refreshed in {(time.perf_counter() - start) * 1000:.0f}ms')
+
+                if not options['every']:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
+
+    def copy(self, source_name, target_name):
+        # One backup step copies the primary under a single read transaction,
+        # which in WAL mode doesn't hold up its writers. (A step-by-step copy
+        # starts over whenever the primary is written, so under steady writes
+        # it may never finish.) The page copy keeps rowids, which the search
+        # index refers to. The copy is made beside the replica and renamed
+        # over it, so the replica's readers never wait for it and see either
+        # the old copy or the new one. A connection stays on the file it
+        # opened, which is why the replica's CONN_MAX_AGE is always 0.
+        partial = f'{target_name}.partial'
+        source = sqlite3.connect(source_name)
+        target = sqlite3.connect(partial)
+        try:
+            source.backup(target, pages=-1)
+            # Readers open it query-only, so no -wal/-shm files beside it
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+            source.close()
+        os.replace(partial, target_name)
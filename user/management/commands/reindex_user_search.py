@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from user.search import missing_search_triggers, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the full-text user search index (user/search.py) from the User table and restore its triggers. '
+            'Run it after every VACUUM, which may renumber the rowids the index refers to')
+
+    def handle(self, *args, **options):
+        missing = missing_search_triggers(connection)
+        if missing:
+            self.stdout.write(self.style.WARNING(f'Restoring missing trigger(s): {", ".join(missing)}'))
+
+        start = time.perf_counter()
+        rebuild_search_index(connection)
+        self.stdout.write(self.style.SUCCESS(
+            f'Reindexed user search on {connection.vendor} in {time.perf_counter() - start:.1f}s'
+        ))
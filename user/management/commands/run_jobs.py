@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user import jobs
+from user.models import JobStatus
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (avatar imports, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=10, help='Jobs claimed per poll')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Seconds after which a running job is assumed orphaned and requeued')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Job worker started')
+
+        try:
+            while True:
+                requeued = jobs.requeue_stale(options['stale_after'])
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+
+                finished = jobs.run_pending(options['batch'])
+                for job in finished:
+                    style = self.style.SUCCESS if job.status == JobStatus.DONE else self.style.WARNING
+                    self.stdout.write(style(f'{job.name} #{job.pk}: {job.status} (attempt {job.attempts})'))
+
+                if not finished:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write('Job worker stopped')
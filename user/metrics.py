@@ -0,0 +1,18 @@
+import threading
+
+
+# name -> callable returning a dict of counters for that component
+_sources = {}
+_lock = threading.Lock()
+
+
+def register(name, source):
+    with _lock:
+        _sources[name] = source
+
+
+def snapshot():
+    with _lock:
+        sources = dict(_sources)
+
+    return {name: source() for name, source in sources.items()}
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100)),
+                ('city', models.CharField(max_length=100)),
+                ('gender', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('min_spent', models.FloatField(null=True)),
+                ('max_spent', models.FloatField(null=True)),
+                ('bounds_exact', models.BooleanField(default=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('country', 'city', 'gender'), name='spend_rollup_segment_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SpendRollupBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('rollup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='user.spendrollup')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('rollup', 'bucket'), name='spend_rollup_bucket_unique')],
+            },
+        ),
+    ]
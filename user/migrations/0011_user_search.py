@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:30
+
+from django.db import migrations
+
+from user.search import create_search_index, drop_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_spendrollup'),
+    ]
+
+    operations = [
+        # FTS5 table and triggers on SQLite, a GIN index on PostgreSQL, see user/search.py
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,8 +1,13 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, router, transaction
 from django.core.validators import RegexValidator
+from django.contrib.auth.hashers import verify_password
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.utils import timezone
 import uuid
 
+from .hashing import password_hashing
+
 
 class AuthProvider(models.TextChoices):
     SELF = 'self', 'Self'
@@ -65,6 +70,8 @@ class User(AbstractUser):
     phone_number = models.CharField(validators=[phone_regex], max_length=14, unique=True, null=True, blank=True)
     password = models.CharField(max_length=128)
     profile_picture = models.ImageField(upload_to='dps/', null=True, blank=True)
+    # Resized copies of profile_picture, see user/images.py
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     gender = models.CharField(max_length=20, choices=GENDER_CHOICES, null=True, blank=True)
     bio = models.TextField(null=True, blank=True)
     street = models.CharField(max_length=255, null=True, blank=True)
@@ -87,11 +94,193 @@ class User(AbstractUser):
         null=True,
         blank=True
     )
+    # Bumped to revoke every token issued before, see user/authentication.py
+    token_version = models.PositiveIntegerField(default=0, editable=False)
     
     objects = UserManager()
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Keyset pagination keys of UserListViewSet and UserStatsViewSet
+            models.Index(fields=['-created_at', '-id'], name='user_created_id_idx'),
+            models.Index(fields=['-total_spent', '-id'], name='user_spent_id_idx'),
+            
+            # UserListViewSet filters with its default ordering
+            models.Index(fields=['is_active', '-created_at', '-id'], name='user_active_created_id_idx'),
+            models.Index(fields=['gender', '-created_at', '-id'], name='user_gender_created_id_idx'),
+            
+            # The other ?ordering= fields (email is covered by its unique index)
+            models.Index(fields=['updated_at', 'id'], name='user_updated_id_idx'),
+            models.Index(fields=['first_name', 'id'], name='user_first_name_id_idx'),
+            models.Index(fields=['last_name', 'id'], name='user_last_name_id_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as loaded, so post_save receivers can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # One transaction for the row and what post_save receivers write with
+        # it (the spend rollups), so a failure in either leaves neither
+        adding = self._state.adding
+        try:
+            with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+                super().save(*args, **kwargs)
+        except BaseException:
+            # Rolled back: a retry (retry_on_lock) must insert the row again
+            self._state.adding = adding
+            raise
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
+    
+    def set_password(self, raw_password):
+        # Hashing runs on the bounded pool, see user/hashing.py
+        password_hashing.run(super().set_password, raw_password)
+        # A new password signs out every existing session
+        if not self._state.adding:
+            self.token_version += 1
+    
+    def _verify_password(self, raw_password):
+        # Runs on the hashing pool, so it only compares hashes: (ok, needs_upgrade)
+        return verify_password(raw_password, self.password)
+    
+    def _upgrade_password(self, raw_password):
+        # Hash upgrades keep the password, so existing tokens stay valid
+        password_hashing.run(super().set_password, raw_password)
+        self._password = None
+        self.save(update_fields=['password'])
+    
+    def check_password(self, raw_password):
+        ok, needs_upgrade = password_hashing.run(self._verify_password, raw_password)
+        if ok and needs_upgrade:
+            self._upgrade_password(raw_password)
+        return ok
+    
+    async def acheck_password(self, raw_password):
+        ok, needs_upgrade = await password_hashing.arun(self._verify_password, raw_password)
+        if ok and needs_upgrade:
+            await sync_to_async(self._upgrade_password)(raw_password)
+        return ok
+    
+    def loaded_value(self, attname, default=None):
+        """Value of `attname` before the current save, `default` if unknown."""
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+    
+    def __str__(self):
+        return f"Name: {self.first_name if self.first_name else 'John Doe'} | Email: {self.email}"    
+    
+    
+class JobStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    RUNNING = 'running', 'Running'
+    DONE = 'done', 'Done'
+    FAILED = 'failed', 'Failed'
+    
+    
+class Job(models.Model):
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    
+    # At most one pending job may share a dedup key; it can wait behind a running one
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status=JobStatus.PENDING),
+                name='job_unique_pending_dedup_key',
+            ),
+        ]
+    
     def __str__(self):
-        return f"Name: {self.first_name if self.first_name else 'John Doe'} | Email: {self.email}"
\ No newline at end of file
+        return f"{self.name} [{self.status}] | Attempts: {self.attempts}/{self.max_attempts}"
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh token JTI that must not be accepted again. `bucket` is the
+    hour the token expires in, so expired rows are purged a bucket at a
+    time, see user/revocation.py.
+    """
+    
+    jti = models.CharField(max_length=64, unique=True)
+    bucket = models.PositiveIntegerField(db_index=True)
+    
+    def __str__(self):
+        return self.jti
+
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row stamped on the primary whenever the replica is refreshed.
+    The replica's copy of `beat_at` says how far behind it is, see
+    user/replica.py.
+    """
+    
+    beat_at = models.DateTimeField()
+    
+    def __str__(self):
+        return self.beat_at.isoformat()
+
+
+class SpendRollup(models.Model):
+    """
+    `total_spent` summarised for one segment of users, kept up to date as
+    users change, see user/rollups.py. A '*' field matches every value,
+    so ('BD', '*', '*') is everyone in BD and ('*', '*', '*') everyone;
+    '' stands for a country, city or gender that is not set.
+    """
+    
+    country = models.CharField(max_length=100)
+    city = models.CharField(max_length=100)
+    gender = models.CharField(max_length=20)
+    # Not a PositiveIntegerField: rollups that were never built must not fail user deletes
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0.0)
+    min_spent = models.FloatField(null=True)
+    max_spent = models.FloatField(null=True)
+    # False once min/max had to be re-derived from the sketch after the
+    # extreme user left; a rebuild makes them exact again
+    bounds_exact = models.BooleanField(default=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['country', 'city', 'gender'], name='spend_rollup_segment_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.country}/{self.city}/{self.gender} | {self.count} users"
+
+
+class SpendRollupBucket(models.Model):
+    """One bucket of a SpendRollup's quantile sketch."""
+    
+    rollup = models.ForeignKey(SpendRollup, on_delete=models.CASCADE, related_name='buckets')
+    bucket = models.IntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rollup', 'bucket'], name='spend_rollup_bucket_unique'),
+        ]
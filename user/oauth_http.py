@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests as req
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from requests.adapters import HTTPAdapter
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import metrics
+
+
+class ProviderBusyError(req.ConnectionError):
+    """Raised when a provider host already has the maximum number of calls in flight."""
+
+
+# A full pool, a refused connection or a timeout: the provider, not the request, is at fault
+UNAVAILABLE_ERRORS = (req.ConnectionError, req.Timeout)
+
+
+class ProviderUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('The login provider is not responding, please retry shortly.')
+    default_code = 'provider_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        # Sent as Retry-After by DRF's exception handler
+        self.wait = wait
+
+
+class LatencyHistogram:
+    # Upper bounds in milliseconds, the last bucket catches everything slower
+    buckets = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms, error=False):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+            self.total += 1
+            self.sum_ms += elapsed_ms
+            if error:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            labels = [f'le_{bound}ms' for bound in self.buckets] + ['inf']
+            return {
+                'count': self.total,
+                'errors': self.errors,
+                'avg_ms': round(self.sum_ms / self.total, 2) if self.total else None,
+                'buckets': dict(zip(labels, self.counts)),
+            }
+
+
+class ProviderHTTPClient:
+    """
+    One outbound HTTP client shared by every OAuth provider call.
+
+    Each provider host gets its own keep-alive session and connection pool and
+    a cap on calls in flight. Every call gets the same connect/read timeouts,
+    and its latency is recorded per provider.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10, max_per_host=20, pool_size=20, retry_after=5):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_per_host = max_per_host
+        self.pool_size = pool_size
+        self.retry_after = retry_after
+
+        self._sessions = {}
+        self._slots = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'OAUTH_HTTP', {})
+        return cls(
+            connect_timeout=options.get('CONNECT_TIMEOUT', 3.05),
+            read_timeout=options.get('READ_TIMEOUT', 10),
+            max_per_host=options.get('MAX_CONCURRENCY_PER_HOST', 20),
+            pool_size=options.get('POOL_SIZE', 20),
+            retry_after=options.get('RETRY_AFTER', 5),
+        )
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                session = req.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+
+            return self._sessions[host], self._slots[host]
+
+    def _histogram(self, provider):
+        with self._lock:
+            return self._histograms.setdefault(provider, LatencyHistogram())
+
+    def request(self, provider, method, url, **kwargs):
+        session, slots = self._host(urlsplit(url).netloc)
+        kwargs.setdefault('timeout', self.timeout)
+
+        # Wait no longer than a connect would take for a free slot on this host
+        if not slots.acquire(timeout=self.timeout[0]):
+            self._histogram(provider).observe(0, error=True)
+            raise ProviderBusyError(f'Too many concurrent requests to {provider}')
+
+        start = time.perf_counter()
+        error = True
+        try:
+            response = session.request(method, url, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            slots.release()
+            self._histogram(provider).observe((time.perf_counter() - start) * 1000, error=error)
+
+    def get(self, provider, url, **kwargs):
+        return self.request(provider, 'GET', url, **kwargs)
+
+    def post(self, provider, url, **kwargs):
+        return self.request(provider, 'POST', url, **kwargs)
+
+    def unavailable(self):
+        """The 503 for a call that failed with one of UNAVAILABLE_ERRORS."""
+        return ProviderUnavailable(wait=self.retry_after)
+
+    def stats(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            hosts = sorted(self._sessions)
+
+        return {
+            'hosts': hosts,
+            'providers': {provider: histogram.stats() for provider, histogram in histograms.items()},
+        }
+
+
+oauth_http = ProviderHTTPClient.from_settings()
+metrics.register('oauth_http', oauth_http.stats)
+
+
+class ProviderErrorsMixin:
+    """Answers a provider that is saturated, down or too slow with a 503, not a 500."""
+
+    def handle_exception(self, exc):
+        if isinstance(exc, UNAVAILABLE_ERRORS):
+            exc = oauth_http.unavailable()
+        return super().handle_exception(exc)
@@ -0,0 +1,316 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .counting import counts
+
+
+class EstimatedPage(Page):
+    # Set when the count is an estimate, so the next link follows the rows actually there
+    more = None
+
+    def has_next(self):
+        return super().has_next() if self.more is None else self.more
+
+
+class CountedPaginator(Paginator):
+    """
+    Django's paginator with the count from the count strategy. When that
+    count is an estimate, pages past it are still served and each page
+    fetches one extra row to tell whether another follows.
+    """
+
+    @cached_property
+    def counted(self):
+        return counts.count(self.object_list)
+
+    @property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def count_exact(self):
+        return self.counted[1]
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.count_exact or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        if self.count_exact:
+            return super().page(number)
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+
+        page = self._get_page(rows[:self.per_page], number, self)
+        page.more = len(rows) > self.per_page
+        return page
+
+    def _get_page(self, *args, **kwargs):
+        return EstimatedPage(*args, **kwargs)
+
+
+class CountedPageNumberPagination(PageNumberPagination):
+    """Page-number pagination whose `count` may be cached or estimated, see `count_exact`."""
+
+    django_paginator_class = CountedPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_exact': self.page.paginator.count_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_exact'] = {
+            'type': 'boolean',
+            'description': 'False when `count` is the database\'s estimate.',
+        }
+        return response_schema
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the view's ordering plus a unique tie-breaker.
+
+    A page is fetched with `WHERE (ordering columns) after (cursor values)
+    LIMIT page_size + 1`, so it never runs COUNT(*) and page 10,000 is as
+    cheap as page 1. Cursors are opaque base64 tokens. Ordering columns must
+    be non-null.
+
+    Clients that still send `?page=` get `fallback_class` pagination.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_query_description = _('The pagination cursor value.')
+    invalid_cursor_message = _('Invalid cursor')
+    tie_breaker = 'id'
+
+    page_query_param = 'page'
+    fallback_class = CountedPageNumberPagination
+
+    def get_ordering(self, request, queryset, view):
+        # Honour ?ordering= when the view has an OrderingFilter, like DRF's CursorPagination.
+        # As in filter_queryset(), the last backend that orders wins (a search ranks its results).
+        ordering_filters = [
+            backend for backend in getattr(view, 'filter_backends', []) if hasattr(backend, 'get_ordering')
+        ]
+        ordering = None
+        for backend in reversed(ordering_filters):
+            ordering = backend().get_ordering(request, queryset, view)
+            if ordering:
+                break
+        ordering = list(ordering or getattr(view, 'ordering', None) or [])
+
+        # A unique column already gives a total order, otherwise break ties on the
+        # primary key in the same direction so one (column, id) index serves both
+        if not any(self.is_unique(queryset.model, field.lstrip('-')) for field in ordering):
+            descending = ordering[0].startswith('-') if ordering else False
+            ordering.append(f'-{self.tie_breaker}' if descending else self.tie_breaker)
+        return ordering
+
+    @staticmethod
+    def is_unique(model, name):
+        try:
+            return model._meta.get_field(name).unique
+        except FieldDoesNotExist:
+            # An annotation, such as a search rank
+            return False
+
+    @staticmethod
+    def to_python(model, name, value):
+        try:
+            return model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            # Annotations are numbers, which JSON gives back as they were
+            return value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        if self.page_query_param in request.query_params:
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset.order_by(*self.ordering), request, view)
+        self.fallback = None
+
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            reverse = False
+        else:
+            values, reverse = cursor
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+
+        ordering = [self.flip(field) for field in self.ordering] if reverse else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def keyset_filter(self, values, reverse):
+        # (a, b) after (x, y)  ==  a > x OR (a = x AND b > y), per column direction
+        clauses = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            clause = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for prev, value in zip(self.ordering[:i], values):
+                clause &= Q(**{prev.lstrip('-'): value})
+            clauses.append(clause)
+
+        # Redundant bound on the leading column so the database can seek the index to it
+        first = self.ordering[0]
+        descending = first.startswith('-') != reverse
+        bound = Q(**{f'{first.lstrip("-")}__{"lte" if descending else "gte"}': values[0]})
+        return bound & reduce(or_, clauses)
+
+    def row_values(self, row):
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    @staticmethod
+    def dump(value):
+        if isinstance(value, (int, float, str)):
+            return value
+        # datetimes, dates and UUIDs; read back with the model field's to_python()
+        return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+    def make_cursor(self, row, reverse):
+        values = [self.dump(value) for value in self.row_values(row)]
+        token = json.dumps({'o': self.ordering, 'k': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+    def encode_cursor(self, row, reverse):
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.make_cursor(row, reverse)
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            token = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            raw, reverse = token['k'], bool(token['r'])
+            # A cursor is only valid for the ordering it was issued for
+            if token['o'] != self.ordering or len(raw) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.to_python(self.model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, raw)
+            ]
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return values, reverse
+
+    def get_next_link(self):
+        if self.fallback:
+            return self.fallback.get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if self.fallback:
+            return self.fallback.get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback:
+            return self.fallback.get_paginated_response(data)
+
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.cursor_query_description),
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
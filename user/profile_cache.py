@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+class ProfileCache:
+    """
+    Two-tier read-through cache for serialized per-user payloads.
+
+    A lookup tries a per-process LRU first, then the shared cache backend
+    (`CACHES[alias]`) if there is one, then calls the loader. Concurrent
+    misses for one key share a single load: in-process through a future,
+    across processes through a short lease in the shared backend that the
+    losers poll. With `alias=None` the cache is local only.
+
+    `invalidate(user_id)` drops the user's local entries and bumps a
+    per-user version in the shared backend, which retires their shared
+    entries everywhere. Other processes' local entries age out within
+    `local_ttl`.
+    """
+
+    def __init__(self, alias=None, ttl=300, local_ttl=30, local_max_entries=10_000,
+                 lease_timeout=5, lease_wait=0.5):
+        self.alias = alias
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_max_entries = local_max_entries
+        self.lease_timeout = lease_timeout
+        self.lease_wait = lease_wait
+
+        # (kind, user_id, variant) -> (value, expires_at)
+        self._local = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'PROFILE_CACHE', {})
+        return cls(
+            alias=options.get('ALIAS'),
+            ttl=options.get('TTL', 300),
+            local_ttl=options.get('LOCAL_TTL', 30),
+            local_max_entries=options.get('LOCAL_MAX_ENTRIES', 10_000),
+        )
+
+    @property
+    def shared(self):
+        return None if self.alias is None else caches[self.alias]
+
+    @staticmethod
+    def _version_key(user_id):
+        return f'user-profile-version:{user_id}'
+
+    def _shared_key(self, key, version):
+        kind, user_id, variant = key
+        return f'user-profile:{kind}:{user_id}:{version}:{variant}'
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry[0]
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + self.local_ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, kind, user_id, variant, loader):
+        """
+        Cached value for `kind` of `user_id`, built by `loader()` on a miss.
+        `variant` separates payloads that differ for the same user, such as
+        absolute URLs per host. A loader returning None is not cached.
+        """
+        key = (kind, str(user_id), variant)
+        value = self._get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            self.coalesced += 1
+            return future.result()
+
+        try:
+            value = self._get_shared_or_load(key, loader)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _get_shared_or_load(self, key, loader):
+        shared = self.shared
+        if shared is None:
+            return self._load(key, loader)
+
+        user_id = key[1]
+        version = shared.get(self._version_key(user_id), 0)
+        shared_key = self._shared_key(key, version)
+
+        value = shared.get(shared_key)
+        if value is None and not shared.add(f'{shared_key}:lease', 1, self.lease_timeout):
+            # Another process is loading this entry, give it a moment before loading too
+            deadline = time.monotonic() + self.lease_wait
+            while value is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = shared.get(shared_key)
+
+        if value is not None:
+            self.shared_hits += 1
+            self._set_local(key, value)
+            return value
+
+        try:
+            value = self._load(key, loader)
+        finally:
+            shared.delete(f'{shared_key}:lease')
+
+        if value is not None:
+            shared.set(shared_key, value, self.ttl)
+        return value
+
+    def _load(self, key, loader):
+        self.misses += 1
+        invalidations = self.invalidations
+        value = loader()
+        # An invalidation during the load may have been for this row
+        if value is not None and self.invalidations == invalidations:
+            self._set_local(key, value)
+        return value
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        self.invalidations += 1
+        with self._lock:
+            for key in [key for key in self._local if key[1] == user_id]:
+                del self._local[key]
+
+        shared = self.shared
+        if shared is None:
+            return
+        version_key = self._version_key(user_id)
+        try:
+            shared.add(version_key, 0, None)
+            shared.incr(version_key)
+        except ValueError:
+            # Evicted between add and incr
+            shared.set(version_key, 1, None)
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._local)
+
+        lookups = self.local_hits + self.shared_hits + self.misses + self.coalesced
+        return {
+            'local_entries': entries,
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': round((lookups - self.misses) / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations,
+        }
+
+
+profile_cache = ProfileCache.from_settings()
+metrics.register('profile_cache', profile_cache.stats)
@@ -0,0 +1,241 @@
+import asyncio
+from functools import partial
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import serializers
+
+from .jwks import apple_jwks, google_verifier
+from .models import AuthProvider
+from .oauth_http import oauth_http
+
+
+#==================================================#
+# Social login profiles, shared by the sync serializers and the async
+# views. Each provider's fetch is a generator: it yields a list of
+# blocking calls (provider HTTP, key lookups), is sent back their results
+# (or has their error raised where it yielded) and returns the profile.
+# run() makes the calls one after another on this thread; arun() makes
+# each batch concurrently in worker threads, so the event loop never
+# waits.
+#==================================================#
+
+def run(steps):
+    """The profile from a provider fetch, its calls made on this thread."""
+    try:
+        calls = next(steps)
+        while True:
+            try:
+                results = [call() for call in calls]
+            except Exception as e:
+                # Raised where the fetch yielded, so it can handle the error
+                calls = steps.throw(e)
+            else:
+                calls = steps.send(results)
+    except StopIteration as done:
+        return done.value
+
+
+async def arun(steps):
+    """The profile from a provider fetch, each batch of its calls made together."""
+    try:
+        calls = next(steps)
+        while True:
+            try:
+                results = await asyncio.gather(*(sync_to_async(call, thread_sensitive=False)() for call in calls))
+            except Exception as e:
+                calls = steps.throw(e)
+            else:
+                calls = steps.send(list(results))
+    except StopIteration as done:
+        return done.value
+
+
+def split_name(full_name):
+    parts = (full_name or '').split(' ', 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def check_provider(user, provider):
+    """Reject a login to an existing account made with another method."""
+    if user.provider == AuthProvider.SELF:
+        raise serializers.ValidationError('Account already exists. Please login with email and password')
+    if user.provider != provider:
+        raise serializers.ValidationError(f'Account already exists. Please login with {user.provider}.')
+
+
+def google_profile(data):
+    try:
+        # Verified locally against Google's cached signing keys
+        google_user, = yield [partial(google_verifier.verify, data['id_token'], settings.GOOGLE_CLIENT_ID)]
+    except jwt.PyJWTError:
+        raise serializers.ValidationError('Invalid or expired Google token')
+
+    if not google_user.get('email'):
+        raise serializers.ValidationError('Google account has no email. Please use another login method.')
+
+    return {
+        'email': google_user['email'],
+        'first_name': google_user.get('given_name', ''),
+        'last_name': google_user.get('family_name', ''),
+        'picture': google_user.get('picture', ''),
+        'provider_id': google_user.get('sub'),
+    }
+
+
+def github_profile(data):
+    token_response, = yield [partial(
+        oauth_http.post,
+        'github',
+        'https://github.com/login/oauth/access_token',
+        headers={'Accept': 'application/json'},
+        data={
+            'client_id': settings.GITHUB_CLIENT_ID,
+            'client_secret': settings.GITHUB_CLIENT_SECRET,
+            'code': data['code']
+        }
+    )]
+    access_token = token_response.json().get('access_token')
+    if not access_token:
+        raise serializers.ValidationError('Invalid GitHub authorization code')
+
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Accept': 'application/json'
+    }
+
+    # Profile and emails only need the token, so they are one batch
+    user_response, email_response = yield [
+        partial(oauth_http.get, 'github', 'https://api.github.com/user', headers=headers),
+        partial(oauth_http.get, 'github', 'https://api.github.com/user/emails', headers=headers),
+    ]
+    github_user = user_response.json()
+
+    primary_email = next(
+        (e['email'] for e in email_response.json() if e.get('primary') and e.get('verified')), None
+    )
+    if not primary_email:
+        raise serializers.ValidationError(
+            'GitHub account has no verified email. Please add one or use another login method.'
+        )
+
+    first_name, last_name = split_name(github_user.get('name'))
+    return {
+        'email': primary_email,
+        'first_name': first_name,
+        'last_name': last_name,
+        'picture': github_user.get('avatar_url'),
+        'provider_id': str(github_user.get('id')),
+    }
+
+
+def facebook_profile(data):
+    response, = yield [partial(
+        oauth_http.get,
+        'facebook',
+        f'{settings.FACEBOOK_GRAPH_API_URL}/me',
+        params={
+            'fields': 'id,email,first_name,last_name,picture.type(large)',
+            'access_token': data['access_token'],
+        }
+    )]
+    if response.status_code != 200:
+        raise serializers.ValidationError('Invalid Facebook access token')
+
+    fb_user = response.json()
+    if not fb_user.get('email'):
+        raise serializers.ValidationError('Facebook account has no email. Please try another login method')
+
+    return {
+        'email': fb_user['email'],
+        'first_name': fb_user.get('first_name', ''),
+        'last_name': fb_user.get('last_name', ''),
+        'picture': fb_user.get('picture', {}).get('data', {}).get('url'),
+        'provider_id': fb_user.get('id'),
+    }
+
+
+def linkedin_profile(data):
+    token_response, = yield [partial(
+        oauth_http.post,
+        'linkedin',
+        'https://www.linkedin.com/oauth/v2/accessToken',
+        data={
+            'grant_type': 'authorization_code',
+            'code': data['code'],
+            'redirect_uri': settings.LINKEDIN_REDIRECT_URI,
+            'client_id': settings.LINKEDIN_CLIENT_ID,
+            'client_secret': settings.LINKEDIN_CLIENT_SECRET
+        }
+    )]
+    if token_response.status_code != 200:
+        raise serializers.ValidationError('Invalid LinkedIn authorization code')
+
+    access_token = token_response.json().get('access_token')
+    if not access_token:
+        raise serializers.ValidationError('Failed to obtain access token')
+
+    response, = yield [partial(
+        oauth_http.get,
+        'linkedin',
+        'https://api.linkedin.com/v2/userinfo',
+        headers={'Authorization': f'Bearer {access_token}'}
+    )]
+    if response.status_code != 200:
+        raise serializers.ValidationError('Failed to fetch LinkedIn user data')
+
+    linkedin_user = response.json()
+    if not linkedin_user.get('email'):
+        raise serializers.ValidationError('LinkedIn account has no email. Please use another login method.')
+
+    return {
+        'email': linkedin_user['email'],
+        'first_name': linkedin_user.get('given_name', ''),
+        'last_name': linkedin_user.get('family_name', ''),
+        'picture': linkedin_user.get('picture'),
+        'provider_id': linkedin_user.get('sub'),
+    }
+
+
+def apple_profile(data):
+    id_token = data['id_token']
+    try:
+        # Apple rotates its keys; they are cached process-wide and only refetched for an unknown kid
+        header = jwt.get_unverified_header(id_token)
+        public_key, = yield [partial(apple_jwks.get_key, header.get('kid'))]
+        if public_key is None:
+            raise serializers.ValidationError('Invalid or expired Apple token')
+
+        payload = jwt.decode(
+            id_token,
+            public_key,
+            algorithms=['RS256'],
+            audience=settings.APPLE_CLIENT_ID,
+            issuer='https://appleid.apple.com'
+        )
+    except jwt.PyJWTError:
+        raise serializers.ValidationError('Invalid or expired Apple token')
+
+    if not payload.get('email'):
+        raise serializers.ValidationError('Apple account has no email.')
+
+    # Apple only sends the name on the very first login
+    name = (data.get('user') or {}).get('name', {})
+    return {
+        'email': payload['email'],
+        'first_name': name.get('firstName', ''),
+        'last_name': name.get('lastName', ''),
+        'picture': None,
+        'provider_id': payload.get('sub'),
+    }
+
+
+# provider -> (required request fields, profile fetch)
+PROVIDERS = {
+    AuthProvider.GOOGLE: (('id_token',), google_profile),
+    AuthProvider.GITHUB: (('code',), github_profile),
+    AuthProvider.FACEBOOK: (('access_token',), facebook_profile),
+    AuthProvider.LINKEDIN: (('code',), linkedin_profile),
+    AuthProvider.APPLE: (('id_token',), apple_profile),
+}
@@ -0,0 +1,281 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.throttling import SimpleRateThrottle
+
+from . import metrics
+
+
+Decision = namedtuple('Decision', 'allowed limit remaining reset retry_after')
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding-window request counter shared by every worker process.
+
+    Hits are counted per key in fixed windows in a small SQLite file
+    (`path`), and a key's rate is the current window's count plus the
+    previous one's, weighted by how much of it still overlaps the sliding
+    window. One upsert and one indexed read per hit, so limits hold across
+    uvicorn workers without a separate server.
+
+    Keys found over their limit are remembered in-process until they are
+    allowed again, so a client hammering a blocked key costs no I/O. If the
+    store stays locked past `timeout` seconds, this process counts on its
+    own until it answers again.
+    """
+
+    def __init__(self, path, timeout=0.1, purge_interval=60, max_entries=10_000):
+        self.path = str(path)
+        self.timeout = timeout
+        self.purge_interval = purge_interval
+        self.max_entries = max_entries
+
+        self._local = threading.local()
+        # key -> blocked until (monotonic)
+        self._blocked = OrderedDict()
+        # (key, window index) -> count, used while the store is unavailable
+        self._fallback = OrderedDict()
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+        self.allowed = 0
+        self.rejected = 0
+        self.fast_rejects = 0
+        self.store_errors = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'RATE_LIMIT', {})
+        return cls(
+            path=options.get('PATH', settings.BASE_DIR / '.cache' / 'ratelimit.sqlite3'),
+            timeout=options.get('TIMEOUT', 0.1),
+            purge_interval=options.get('PURGE_INTERVAL', 60),
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS hits ('
+                'key TEXT NOT NULL, window INTEGER NOT NULL, count INTEGER NOT NULL, expires REAL NOT NULL, '
+                'PRIMARY KEY (key, window)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS hits_expires ON hits (expires)')
+            self._local.conn = conn
+        return conn
+
+    def _count_shared(self, key, index, window):
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO hits (key, window, count, expires) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (key, window) DO UPDATE SET count = count + 1',
+            (key, index, (index + 2) * window),
+        )
+        counts = dict(conn.execute('SELECT window, count FROM hits WHERE key = ? AND window >= ?', (key, index - 1)))
+
+        now = time.monotonic()
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            conn.execute('DELETE FROM hits WHERE expires < ?', (time.time(),))
+        return counts.get(index - 1, 0), counts.get(index, 0)
+
+    def _count_local(self, key, index):
+        with self._lock:
+            current = self._fallback[key, index] = self._fallback.get((key, index), 0) + 1
+            self._fallback.move_to_end((key, index))
+            while len(self._fallback) > self.max_entries:
+                self._fallback.popitem(last=False)
+            return self._fallback.get((key, index - 1), 0), current
+
+    @staticmethod
+    def _retry_after(previous, current, limit, window, elapsed):
+        room = limit - 1  # the retried request counts too
+        if previous and current <= room:
+            needed = 1 - (room - current) / previous
+            if needed < 1:
+                return max(0.0, needed - elapsed) * window
+        # Only once this window is the previous one can its count decay
+        needed = 1 - room / current if current else 0
+        return (1 - elapsed + max(0.0, needed)) * window
+
+    def hit(self, key, limit, window):
+        """Count one request for `key` against `limit` per `window` seconds."""
+        now = time.time()
+        index = int(now // window)
+        elapsed = now % window / window
+        reset = math.ceil((1 - elapsed) * window)
+
+        with self._lock:
+            blocked_until = self._blocked.get(key)
+        if blocked_until is not None:
+            wait = blocked_until - time.monotonic()
+            if wait > 0:
+                self.fast_rejects += 1
+                self.rejected += 1
+                return Decision(False, limit, 0, reset, math.ceil(wait))
+            with self._lock:
+                self._blocked.pop(key, None)
+
+        try:
+            previous, current = self._count_shared(key, index, window)
+        except sqlite3.Error:
+            self.store_errors += 1
+            previous, current = self._count_local(key, index)
+
+        rate = previous * (1 - elapsed) + current
+        if rate <= limit:
+            self.allowed += 1
+            return Decision(True, limit, int(limit - rate), reset, None)
+
+        self.rejected += 1
+        wait = self._retry_after(previous, current, limit, window, elapsed)
+        with self._lock:
+            self._blocked[key] = time.monotonic() + wait
+            while len(self._blocked) > self.max_entries:
+                self._blocked.popitem(last=False)
+        return Decision(False, limit, 0, reset, math.ceil(wait))
+
+    def stats(self):
+        with self._lock:
+            blocked = len(self._blocked)
+
+        return {
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'fast_rejects': self.fast_rejects,
+            'store_errors': self.store_errors,
+            'blocked_keys': blocked,
+        }
+
+
+rate_limiter = SlidingWindowLimiter.from_settings()
+metrics.register('rate_limit', rate_limiter.stats)
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    DRF throttle on `rate_limiter`. Rates come from DEFAULT_THROTTLE_RATES
+    by `scope`, like DRF's own throttles; subclasses pick the key.
+    """
+
+    decision = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def get_cache_key(self, request, view):
+        key = self.get_key(request, view)
+        return None if key is None else f'{self.scope}:{key}'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        self.decision = rate_limiter.hit(key, self.num_requests, self.duration)
+        return self.decision.allowed
+
+    def wait(self):
+        return self.decision.retry_after if self.decision else None
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    scope = 'auth_ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    """Per target account, so one address can't be brute-forced from many IPs."""
+
+    scope = 'auth_email'
+
+    def get_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email:
+            return None
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+
+
+class ProviderRateThrottle(SlidingWindowThrottle):
+    """Overall cap per OAuth provider, which bounds the outbound calls made to it."""
+
+    scope = 'auth_provider'
+
+    def get_key(self, request, view):
+        return getattr(view, 'provider', None)
+
+
+AUTH_THROTTLES = [IPRateThrottle, EmailRateThrottle]
+OAUTH_THROTTLES = [IPRateThrottle, ProviderRateThrottle]
+
+
+def set_rate_limit_headers(response, decisions):
+    """X-RateLimit-* headers for the tightest of `decisions`."""
+    decisions = [decision for decision in decisions if decision is not None]
+    if not decisions:
+        return response
+
+    tightest = min(decisions, key=lambda decision: (decision.remaining, -decision.reset))
+    response['X-RateLimit-Limit'] = str(tightest.limit)
+    response['X-RateLimit-Remaining'] = str(tightest.remaining)
+    response['X-RateLimit-Reset'] = str(tightest.reset)
+    return response
+
+
+class RateLimitHeadersMixin:
+    """Adds X-RateLimit-* headers from the view's sliding-window throttles."""
+
+    def get_throttles(self):
+        self.throttles = super().get_throttles()
+        return self.throttles
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return set_rate_limit_headers(response, [getattr(t, 'decision', None) for t in getattr(self, 'throttles', ())])
+
+
+async def check_rate_limits(request, data, view, throttle_classes):
+    """
+    Throttles for plain Django async views, which DRF doesn't run. Returns
+    the throttles' decisions and a 429 response if any of them refused.
+    """
+    # Just what the throttles read off a DRF request
+    drf_request = SimpleNamespace(META=request.META, data=data)
+
+    def check():
+        throttles = [throttle() for throttle in throttle_classes]
+        allowed = [throttle.allow_request(drf_request, view) for throttle in throttles]
+        return all(allowed), throttles
+
+    allowed, throttles = await sync_to_async(check, thread_sensitive=False)()
+    decisions = [throttle.decision for throttle in throttles]
+    if allowed:
+        return decisions, None
+
+    wait = max(throttle.wait() or 0 for throttle in throttles)
+    response = JsonResponse(
+        {'detail': f'Request was throttled. Expected available in {wait} seconds.'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(wait)
+    return decisions, set_rate_limit_headers(response, decisions)
@@ -0,0 +1,238 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import ISO_8601, fields
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .images import variant_urls
+from .profile_cache import profile_cache
+from .serializers import PictureVariantsField
+
+
+def _datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return None
+
+    def convert(value, request):
+        # DateTimeField.to_representation without the per-call attribute lookups
+        if settings.USE_TZ and timezone.is_aware(value):
+            value = value.astimezone(getattr(field, 'timezone', None) or timezone.get_current_timezone())
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+def _file(field):
+    if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+        return None
+
+    storage = field.parent.Meta.model._meta.get_field(field.source).storage
+
+    def convert(value, request):
+        # .values() gives the stored name, not a FieldFile
+        if not value:
+            return None
+        url = storage.url(value)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return convert
+
+
+def _picture_variants(field):
+    return lambda value, request: variant_urls(value, request)
+
+
+def _plain(convert):
+    return lambda field: lambda value, request: convert(value)
+
+
+# Most specific first. A builder returns None when the field is configured
+# in a way it cannot reproduce, and the field's own to_representation is used.
+CONVERTERS = [
+    (PictureVariantsField, _picture_variants),
+    (fields.UUIDField, _plain(str)),
+    (fields.DateTimeField, _datetime),
+    (fields.FileField, _file),
+    (fields.FloatField, _plain(float)),
+    (fields.IntegerField, _plain(int)),
+    (fields.BooleanField, _plain(bool)),
+    (fields.CharField, None),
+    (fields.ChoiceField, None),
+    (fields.JSONField, None),
+    (fields.ReadOnlyField, None),
+]
+
+
+class ValuesConverter:
+    """
+    Turns `.values()` rows into the same dicts a read-only ModelSerializer
+    would produce, without building model instances or walking field
+    objects per row.
+
+    The serializer's fields are inspected once; each becomes a plain
+    `(name, column, convert)` step, with `convert` None when the database
+    value is already what the serializer would output. `fields` limits the
+    output to those field names.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        self.steps = []
+
+        for name, field in serializer_class().fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} does not read a single model column, '
+                    f'so it cannot be served from .values()'
+                )
+
+            self.steps.append((name, field.source, self._converter(field)))
+
+        self.columns = [column for _, column, _ in self.steps]
+
+    @staticmethod
+    def _converter(field):
+        for field_class, builder in CONVERTERS:
+            if isinstance(field, field_class):
+                if builder is None:
+                    return None
+                convert = builder(field)
+                if convert is not None:
+                    return convert
+                break
+
+        # Anything unusual keeps the serializer's own output
+        return lambda value, request: field.to_representation(value)
+
+    def convert(self, row, request=None):
+        data = {}
+        for name, column, convert in self.steps:
+            value = row[column]
+            data[name] = value if value is None or convert is None else convert(value, request)
+        return data
+
+    def convert_many(self, rows, request=None):
+        return [self.convert(row, request) for row in rows]
+
+
+@lru_cache(maxsize=256)
+def converter_for(serializer_class, fields=None):
+    # Built once per serializer class and field subset
+    return ValuesConverter(serializer_class, fields)
+
+
+def ordering_columns(view):
+    # Keyset cursors are built from the ordering columns, so reads have to load them
+    ordering_fields = getattr(view, 'ordering_fields', None)
+    ordering = [
+        *(getattr(view, 'ordering', None) or []),
+        *(ordering_fields if isinstance(ordering_fields, (list, tuple)) else []),
+        'id',
+    ]
+    return [field.lstrip('-') for field in ordering]
+
+
+class ValuesReadMixin:
+    """
+    `list()` and `retrieve()` from `.values()` rows through a ValuesConverter
+    instead of the serializer. For read-only endpoints whose serializer
+    fields each map to one column; writes keep using the serializer.
+    """
+
+    def get_response_fields(self):
+        # Tuple of serializer field names to return, None for all of them
+        return None
+
+    def get_values_converter(self):
+        return converter_for(self.get_serializer_class(), self.get_response_fields())
+
+    def get_values_columns(self, converter):
+        columns = list(converter.columns)
+        for column in ordering_columns(self):
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def list(self, request, *args, **kwargs):
+        converter = self.get_values_converter()
+        queryset = self.filter_queryset(self.get_queryset())
+        # Annotations a filter backend orders by (the search rank) are cursor columns too
+        queryset = queryset.values(*self.get_values_columns(converter), *queryset.query.annotations)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(converter.convert_many(page, request))
+
+        return Response(converter.convert_many(queryset, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        converter = self.get_values_converter()
+        queryset = self.filter_queryset(self.get_queryset()).values(*converter.columns)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, row)
+
+        return Response(converter.convert(row, request))
+
+
+class CachedRetrieveMixin(ValuesReadMixin):
+    """
+    `retrieve()` from the profile cache: the full serialized payload of the
+    row plus its `updated_at`, cached per user and host (URLs are absolute).
+    A ?fields= subset is cut from the cached payload, and conditional
+    requests get their validators from it as well, so a hit never touches
+    the database.
+    """
+
+    cache_kind = None
+
+    def get_cached_entry(self):
+        if not hasattr(self, '_cached_entry'):
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            self._cached_entry = profile_cache.get(
+                self.cache_kind or type(self).__name__,
+                self.kwargs[lookup_url_kwarg],
+                self.request.get_host(),
+                self.load_cache_entry,
+            )
+        return self._cached_entry
+
+    def load_cache_entry(self):
+        converter = converter_for(self.get_serializer_class())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = (
+            self.get_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values(*converter.columns, 'updated_at').first()
+        )
+        if row is None:
+            return None
+        return {'data': converter.convert(row, self.request), 'updated_at': row['updated_at']}
+
+    def get_version(self):
+        entry = self.get_cached_entry()
+        if entry is None:
+            return None
+        return self.kwargs[self.lookup_url_kwarg or self.lookup_field], entry['updated_at']
+
+    def retrieve(self, request, *args, **kwargs):
+        entry = self.get_cached_entry()
+        if entry is None:
+            raise NotFound()
+
+        data = entry['data']
+        self.check_object_permissions(request, data)
+
+        fields = self.get_response_fields()
+        if fields is not None:
+            data = {name: data[name] for name in fields}
+        return Response(data)
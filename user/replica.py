@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics
+from .models import ReplicaHeartbeat
+
+
+# Set while a read-only view runs; only then may reads go to the replica
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads_enabled():
+    return _replica_reads.get()
+
+
+class ReplicaMonitor:
+    """
+    Whether the read replica may serve reads right now, and which users
+    must read from the primary.
+
+    Lag is the age of the replica's ReplicaHeartbeat row, which the
+    primary stamps on every refresh (`manage.py refresh_replica`). It is
+    checked at most every `check_interval` seconds per process; a replica
+    that is missing, failing or more than `max_lag` seconds behind sends
+    every read to the primary.
+
+    A user written to is pinned to the primary for `pin_seconds` in the
+    `cache_alias` cache, so they (and anyone reading their row) see the
+    write; through every worker when that cache is shared, through this
+    one otherwise. Pins outlast `max_lag`, after which any replica
+    still in use has caught up.
+    """
+
+    def __init__(self, alias='replica', max_lag=10, check_interval=1, pin_seconds=None, cache_alias='shared'):
+        self.alias = alias
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_seconds = pin_seconds if pin_seconds is not None else max_lag + 1
+        self.cache_alias = cache_alias
+
+        self._lag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+        self.replica_reads = 0
+        self.lagging_reads = 0
+        self.lagging_requests = 0
+        self.pinned_requests = 0
+        self.check_errors = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'REPLICA', {})
+        return cls(
+            alias=options.get('ALIAS', 'replica'),
+            max_lag=options.get('MAX_LAG', 10),
+            check_interval=options.get('CHECK_INTERVAL', 1),
+            pin_seconds=options.get('PIN_SECONDS'),
+            cache_alias=options.get('PIN_CACHE', 'shared'),
+        )
+
+    @property
+    def configured(self):
+        return self.alias in settings.DATABASES
+
+    def _check(self):
+        connection = connections[self.alias]
+        if connection.vendor == 'sqlite' and not os.path.exists(connection.settings_dict['NAME']):
+            # Not refreshed yet; connecting would only create an empty file
+            return None
+        try:
+            beat_at = ReplicaHeartbeat.objects.using(self.alias).values_list('beat_at', flat=True).first()
+        except DatabaseError:
+            self.check_errors += 1
+            return None
+        return None if beat_at is None else (timezone.now() - beat_at).total_seconds()
+
+    def lag(self):
+        """Seconds the replica is behind, None when it can't be used."""
+        if not self.configured:
+            return None
+
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            # One check per interval; the others use the last result
+            if self._lock.acquire(blocking=self._checked_at is None):
+                try:
+                    self._lag = self._check()
+                    self._checked_at = time.monotonic()
+                finally:
+                    self._lock.release()
+        return self._lag
+
+    def available(self):
+        lag = self.lag()
+        return lag is not None and lag <= self.max_lag
+
+    def route_read(self):
+        """The alias for a read in a replica_reads() block."""
+        if self.available():
+            self.replica_reads += 1
+            return self.alias
+        self.lagging_reads += 1
+        return 'default'
+
+    @staticmethod
+    def _pin_key(user_id):
+        return f'replica-pin:{user_id}'
+
+    def pin(self, user_id):
+        caches[self.cache_alias].set(self._pin_key(user_id), 1, self.pin_seconds)
+
+    def pinned(self, *user_ids):
+        keys = [self._pin_key(user_id) for user_id in user_ids if user_id is not None]
+        return bool(keys) and bool(caches[self.cache_alias].get_many(keys))
+
+    def stats(self):
+        return {
+            'configured': self.configured,
+            'lag_seconds': round(self._lag, 3) if self._lag is not None else None,
+            'replica_reads': self.replica_reads,
+            'lagging_reads': self.lagging_reads,
+            'lagging_requests': self.lagging_requests,
+            'pinned_requests': self.pinned_requests,
+            'check_errors': self.check_errors,
+        }
+
+
+replica = ReplicaMonitor.from_settings()
+metrics.register('replica', replica.stats)
+
+
+class ReplicaReadMixin:
+    """
+    Lets a read-only view's queries go to the replica (see
+    user/routers.py). Authentication and permission checks run before
+    and stay on the primary; so does the whole request when the user
+    making it, or the user it reads, was written to recently.
+    """
+
+    replica_actions = ('list', 'retrieve')
+
+    def use_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        if not replica.available():
+            replica.lagging_requests += 1
+            return False
+        # Plain generic views have no action, only viewsets do
+        action = getattr(self, 'action', None)
+        if action is not None and action not in self.replica_actions:
+            return False
+
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if replica.pinned(request.user.pk if request.user.is_authenticated else None, lookup):
+            replica.pinned_requests += 1
+            return False
+        return True
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.use_replica(request):
+            self._replica_token = _replica_reads.set(True)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            token = getattr(self, '_replica_token', None)
+            if token is not None:
+                _replica_reads.reset(token)
+                self._replica_token = None
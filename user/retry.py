@@ -0,0 +1,80 @@
+import asyncio
+import functools
+import inspect
+import random
+import threading
+import time
+
+from django.db import OperationalError, connection
+
+from . import metrics
+
+
+_lock = threading.Lock()
+_counters = {'retries': 0, 'gave_up': 0}
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def stats():
+    with _lock:
+        return dict(_counters)
+
+
+metrics.register('db_lock_retries', stats)
+
+
+def _retryable(error):
+    # Only lock contention; nothing can be retried inside an outer transaction,
+    # which is already rolled back to its start
+    return 'database is locked' in str(error) and not connection.in_atomic_block
+
+
+def retry_on_lock(func=None, *, attempts=4, delay=0.05):
+    """
+    Retries `func` when SQLite reports "database is locked" after its busy
+    timeout ran out, backing off `delay`, 2*`delay`, ... seconds with jitter.
+    Works on plain functions and coroutine functions; only wrap whole units
+    of work (a save, an atomic block), never something inside a transaction.
+    """
+    if func is None:
+        return functools.partial(retry_on_lock, attempts=attempts, delay=delay)
+
+    def backoff(attempt):
+        return delay * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except OperationalError as e:
+                    if not _retryable(e):
+                        raise
+                    if attempt == attempts - 1:
+                        _count('gave_up')
+                        raise
+                    _count('retries')
+                    await asyncio.sleep(backoff(attempt))
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not _retryable(e):
+                    raise
+                if attempt == attempts - 1:
+                    _count('gave_up')
+                    raise
+                _count('retries')
+                time.sleep(backoff(attempt))
+
+    return wrapper
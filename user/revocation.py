@@ -0,0 +1,174 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Max
+
+from . import metrics
+from .models import RevokedToken
+from .retry import retry_on_lock
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` items at `error_rate`."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: two 64-bit halves of one digest give every probe
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationStore:
+    """
+    Revoked refresh-token JTIs, checked on every refresh.
+
+    Rows live in RevokedToken, partitioned by expiry hour (`bucket`), and
+    are purged a whole bucket at a time once expired
+    (`manage.py purge_revoked_tokens`). Each process mirrors the live JTIs
+    in a Bloom filter, so the usual case of a token that was never revoked
+    is answered without a query; only filter hits are confirmed in the
+    database.
+
+    The filter catches up with other processes' revocations at most every
+    `sync_interval` seconds (one indexed query for rows newer than the last
+    one seen) and is rebuilt every `rebuild_interval` seconds to drop
+    purged JTIs, or sooner when it outgrows its capacity.
+    """
+
+    bucket_seconds = 3600
+
+    def __init__(self, sync_interval=1, rebuild_interval=3600, min_capacity=100_000, error_rate=0.001):
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.min_capacity = min_capacity
+        self.error_rate = error_rate
+
+        self._bloom = None
+        self._last_id = 0
+        self._built_at = 0.0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.db_checks = 0
+        self.false_positives = 0
+        self.revoked = 0
+        self.rebuilds = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'TOKEN_REVOCATION', {})
+        return cls(
+            sync_interval=options.get('SYNC_INTERVAL', 1),
+            rebuild_interval=options.get('REBUILD_INTERVAL', 3600),
+            min_capacity=options.get('MIN_CAPACITY', 100_000),
+            error_rate=options.get('ERROR_RATE', 0.001),
+        )
+
+    @classmethod
+    def bucket(cls, timestamp):
+        return int(timestamp) // cls.bucket_seconds
+
+    def live_tokens(self):
+        # Buckets before the current hour only hold expired tokens
+        return RevokedToken.objects.filter(bucket__gte=self.bucket(time.time()))
+
+    def _rebuild(self):
+        live = self.live_tokens()
+        capacity = max(self.min_capacity, live.count() * 2)
+        bloom = BloomFilter(capacity, self.error_rate)
+
+        last_id = RevokedToken.objects.aggregate(last=Max('id'))['last'] or 0
+        for jti in live.filter(id__lte=last_id).values_list('jti', flat=True).iterator(chunk_size=10_000):
+            bloom.add(jti)
+
+        self._bloom, self._last_id = bloom, last_id
+        self._built_at = self._synced_at = time.monotonic()
+        self.rebuilds += 1
+
+    def _catch_up(self):
+        rows = list(RevokedToken.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'jti'))
+        for row_id, jti in rows:
+            self._bloom.add(jti)
+        if rows:
+            self._last_id = rows[-1][0]
+        self._synced_at = time.monotonic()
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._bloom is not None and now - self._synced_at < self.sync_interval:
+            return
+
+        # Someone else is already syncing; the current filter is good enough for this check
+        if not self._lock.acquire(blocking=self._bloom is None):
+            return
+        try:
+            bloom = self._bloom
+            if bloom is None or now - self._built_at >= self.rebuild_interval or bloom.count > bloom.capacity:
+                self._rebuild()
+            elif now - self._synced_at >= self.sync_interval:
+                self._catch_up()
+        finally:
+            self._lock.release()
+
+    @retry_on_lock
+    def revoke(self, jti, expires_at):
+        """Revoke `jti` until `expires_at` (a UNIX timestamp)."""
+        RevokedToken.objects.bulk_create(
+            [RevokedToken(jti=jti, bucket=self.bucket(expires_at))], ignore_conflicts=True
+        )
+        self.revoked += 1
+        if self._bloom is not None:
+            self._bloom.add(jti)
+
+    def is_revoked(self, jti):
+        self.checks += 1
+        self._sync()
+        if jti not in self._bloom:
+            return False
+
+        self.db_checks += 1
+        if RevokedToken.objects.filter(jti=jti).exists():
+            return True
+        self.false_positives += 1
+        return False
+
+    def purge(self):
+        """Delete every expired bucket, returns the number of rows removed."""
+        deleted, _ = RevokedToken.objects.filter(bucket__lt=self.bucket(time.time())).delete()
+        return deleted
+
+    def stats(self):
+        bloom = self._bloom
+        return {
+            'filter_items': bloom.count if bloom else None,
+            'filter_capacity': bloom.capacity if bloom else None,
+            'filter_bytes': len(bloom.bits) if bloom else None,
+            'checks': self.checks,
+            'db_checks': self.db_checks,
+            'false_positives': self.false_positives,
+            'revoked': self.revoked,
+            'rebuilds': self.rebuilds,
+        }
+
+
+revocations = RevocationStore.from_settings()
+metrics.register('token_revocation', revocations.stats)
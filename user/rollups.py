@@ -0,0 +1,380 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, FloatField, Max, Min, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from . import metrics
+from .models import SpendRollup, SpendRollupBucket
+
+
+User = get_user_model()
+
+# The User fields a rollup depends on; a save touching none of them is skipped
+SEGMENT_FIELDS = ('country', 'city', 'gender')
+ROLLUP_FIELDS = ('total_spent',) + SEGMENT_FIELDS
+
+ANY = '*'
+
+
+def segment_of(country, city, gender):
+    # NULL and '' are the same "not set" segment
+    return country or '', city or '', gender or ''
+
+
+def rollup_keys(segment):
+    """Every rollup a user in `segment` counts towards, from everyone down to the segment itself."""
+    country, city, gender = segment
+    return [
+        (ANY, ANY, ANY), (ANY, ANY, gender),
+        (country, ANY, ANY), (country, ANY, gender),
+        (country, city, ANY), (country, city, gender),
+    ]
+
+
+class LogBucketSketch:
+    """
+    Quantile sketch with relative accuracy `alpha`.
+
+    Bucket i holds the values in (gamma**(i-1), gamma**i], with gamma =
+    (1 + alpha) / (1 - alpha), and reports all of them as one value within
+    `alpha` of each, so any quantile is off by at most alpha. Values below
+    `min_value` (no spend yet) share ZERO_BUCKET and report as 0. Sketches
+    with the same alpha merge by adding bucket counts, which is how a
+    country's sketch is its cities' together; 1% accuracy over 0.01 to
+    10^9 takes at most ~1,300 buckets, however many users there are.
+    """
+
+    ZERO_BUCKET = -2 ** 31
+
+    def __init__(self, alpha=0.01, min_value=0.01, counts=None):
+        self.alpha = alpha
+        self.min_value = min_value
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.counts = defaultdict(int)
+        if counts:
+            self.counts.update(counts)
+
+    def bucket(self, value):
+        if value < self.min_value:
+            return self.ZERO_BUCKET
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def value(self, bucket):
+        if bucket == self.ZERO_BUCKET:
+            return 0.0
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        self.counts[self.bucket(value)] += count
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] += count
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def quantile(self, q):
+        """Value at quantile `q` (0 to 1), None for an empty sketch."""
+        buckets = sorted(bucket for bucket, count in self.counts.items() if count > 0)
+        rank = q * (sum(self.counts[bucket] for bucket in buckets) - 1)
+        seen = 0
+        for bucket in buckets:
+            seen += self.counts[bucket]
+            if seen > rank:
+                return self.value(bucket)
+        return None
+
+
+class _Delta:
+    # What a set of changes does to one rollup
+
+    __slots__ = ('count', 'total', 'low', 'high', 'removed_low', 'removed_high', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.low = self.high = None
+        self.removed_low = self.removed_high = None
+        self.buckets = defaultdict(int)
+
+    def add(self, value, bucket, sign):
+        self.count += sign
+        self.total += sign * value
+        self.buckets[bucket] += sign
+        if sign > 0:
+            self.low = value if self.low is None else min(self.low, value)
+            self.high = value if self.high is None else max(self.high, value)
+        else:
+            self.removed_low = value if self.removed_low is None else min(self.removed_low, value)
+            self.removed_high = value if self.removed_high is None else max(self.removed_high, value)
+
+    @property
+    def empty(self):
+        # A user moving within the rollup with the same spend
+        return not self.count and not self.total and not any(self.buckets.values())
+
+
+class _Aggregate:
+    __slots__ = ('count', 'total', 'low', 'high', 'sketch')
+
+    def __init__(self, sketch):
+        self.count = 0
+        self.total = 0.0
+        self.low = self.high = None
+        self.sketch = sketch
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.low = other.low if self.low is None else min(self.low, other.low)
+        self.high = other.high if self.high is None else max(self.high, other.high)
+        self.sketch.merge(other.sketch)
+
+
+class SpendRollups:
+    """
+    Count, sum, min/max and a LogBucketSketch of `total_spent` for every
+    segment of users by country, city and gender, in SpendRollup rows.
+
+    Each user counts towards six rollups (see rollup_keys), so any
+    segment, down to one city and gender, is a single row plus its
+    sketch buckets to read, however many users it covers. Saves and
+    deletes apply their change in the same transaction as the user row
+    (User.save() and Model.delete() open one, see user/signals.py);
+    `QuerySet.update()` and raw SQL bypass them and need
+    `manage.py rebuild_spend_rollups`, as does a change of
+    RELATIVE_ACCURACY. `migrate` builds them when there are none yet.
+
+    Min and max only grow incrementally. When the user holding one leaves
+    a segment, it is re-derived from the sketch (within alpha) and
+    `bounds_exact` is cleared until the next rebuild.
+    """
+
+    def __init__(self, alpha=0.01, min_value=0.01):
+        self.alpha = alpha
+        self.min_value = min_value
+        self._lock = threading.Lock()
+
+        self.changes = 0
+        self.rederived_bounds = 0
+        self.rebuilds = 0
+        self.last_build_ms = None
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'SPEND_ROLLUPS', {})
+        return cls(
+            alpha=options.get('RELATIVE_ACCURACY', 0.01),
+            min_value=options.get('MIN_VALUE', 0.01),
+        )
+
+    def sketch(self, counts=None):
+        return LogBucketSketch(self.alpha, self.min_value, counts)
+
+    def change(self, old, new):
+        """Apply one user's move from `old` to `new`, each a (segment, total_spent) or None."""
+        if old == new:
+            return
+        changes = []
+        if old is not None:
+            changes.append((old[0], old[1], -1))
+        if new is not None:
+            changes.append((new[0], new[1], 1))
+        self.apply(changes)
+
+    def add_users(self, users):
+        """Count newly inserted `users` in, for writes that send no post_save (bulk_create)."""
+        self.apply([
+            (segment_of(user.country, user.city, user.gender), user.total_spent, 1)
+            for user in users
+        ])
+
+    def apply(self, changes):
+        """Apply (segment, total_spent, +1 or -1) changes with a few statements per distinct change."""
+        sketch = self.sketch()
+        deltas = defaultdict(_Delta)
+        for segment, value, sign in changes:
+            bucket = sketch.bucket(value)
+            for key in rollup_keys(segment):
+                deltas[key].add(value, bucket, sign)
+        deltas = {key: delta for key, delta in deltas.items() if not delta.empty}
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            # Only a rollup gaining users can be new
+            SpendRollup.objects.bulk_create(
+                [
+                    SpendRollup(country=country, city=city, gender=gender)
+                    for (country, city, gender), delta in deltas.items() if delta.count > 0
+                ],
+                ignore_conflicts=True,
+            )
+            keys = reduce(or_, (Q(country=country, city=city, gender=gender) for country, city, gender in deltas))
+            ids = {
+                (country, city, gender): pk
+                for country, city, gender, pk in SpendRollup.objects.filter(keys).values_list('country', 'city', 'gender', 'pk')
+            }
+
+            # Rollups changing the same way share an UPDATE; one user's
+            # spend change is one for all six
+            rollup_updates, bucket_updates, removals = defaultdict(list), defaultdict(list), defaultdict(list)
+            for key, delta in deltas.items():
+                pk = ids.get(key)
+                if pk is None:
+                    # Removal from a rollup that was never built
+                    continue
+                rollup_updates[delta.count, delta.total, delta.low, delta.high].append(pk)
+                for bucket, change in delta.buckets.items():
+                    if change:
+                        bucket_updates[bucket, change].append(pk)
+                if delta.removed_low is not None:
+                    removals[delta.removed_low, delta.removed_high].append(pk)
+
+            for (count, total, low, high), pks in rollup_updates.items():
+                fields = {'count': F('count') + count, 'total': F('total') + total}
+                if low is not None:
+                    fields['min_spent'] = Least(Coalesce('min_spent', Value(low)), Value(low), output_field=FloatField())
+                    fields['max_spent'] = Greatest(Coalesce('max_spent', Value(high)), Value(high), output_field=FloatField())
+                SpendRollup.objects.filter(pk__in=pks).update(**fields)
+
+            SpendRollupBucket.objects.bulk_create(
+                [
+                    SpendRollupBucket(rollup_id=pk, bucket=bucket)
+                    for (bucket, change), pks in bucket_updates.items() if change > 0 for pk in pks
+                ],
+                ignore_conflicts=True,
+            )
+            for (bucket, change), pks in bucket_updates.items():
+                SpendRollupBucket.objects.filter(rollup_id__in=pks, bucket=bucket).update(count=F('count') + change)
+
+            stale = set()
+            for (low, high), pks in removals.items():
+                stale.update(
+                    SpendRollup.objects.filter(pk__in=pks)
+                    .filter(Q(min_spent__gte=low) | Q(max_spent__lte=high))
+                    .values_list('pk', flat=True)
+                )
+            if stale:
+                self._rederive_bounds(stale)
+
+        with self._lock:
+            self.changes += len(changes)
+
+    def _rederive_bounds(self, pks):
+        sketch = self.sketch()
+        bounds = {
+            row['rollup_id']: row
+            for row in SpendRollupBucket.objects.filter(rollup_id__in=pks, count__gt=0)
+            .values('rollup_id').annotate(low=Min('bucket'), high=Max('bucket'))
+        }
+        for pk in pks:
+            row = bounds.get(pk)
+            if row is None:
+                # Nobody left in the segment
+                SpendRollup.objects.filter(pk=pk).update(min_spent=None, max_spent=None, bounds_exact=True)
+            else:
+                SpendRollup.objects.filter(pk=pk).update(
+                    min_spent=sketch.value(row['low']), max_spent=sketch.value(row['high']), bounds_exact=False,
+                )
+        with self._lock:
+            self.rederived_bounds += len(pks)
+
+    def get(self, country=ANY, city=ANY, gender=ANY, quantiles=(0.5, 0.9, 0.99)):
+        """Summary of one segment: the rollup row and its sketch buckets, whatever its size."""
+        rollup = SpendRollup.objects.filter(country=country, city=city, gender=gender).first()
+        if rollup is None or rollup.count <= 0:
+            return {
+                'country': country, 'city': city, 'gender': gender,
+                'count': 0, 'total': 0.0, 'average': None, 'min': None, 'max': None,
+                'bounds_exact': True, 'quantiles': {str(q): None for q in quantiles},
+            }
+
+        sketch = self.sketch(rollup.buckets.filter(count__gt=0).values_list('bucket', 'count'))
+        return {
+            'country': country, 'city': city, 'gender': gender,
+            'count': rollup.count,
+            'total': rollup.total,
+            'average': rollup.total / rollup.count,
+            'min': rollup.min_spent,
+            'max': rollup.max_spent,
+            'bounds_exact': rollup.bounds_exact,
+            'quantiles': {str(q): sketch.quantile(q) for q in quantiles},
+        }
+
+    def rebuild(self, chunk_size=5000):
+        """
+        Recompute every rollup from the User table. Runs in one
+        transaction, so writers wait rather than change users mid-scan.
+        """
+        start = time.perf_counter()
+        with transaction.atomic():
+            # One aggregate per exact segment, merged into the wider ones after
+            segments = {}
+            rows = User.objects.values_list(*SEGMENT_FIELDS, 'total_spent').iterator(chunk_size=chunk_size)
+            for country, city, gender, total_spent in rows:
+                segment = segment_of(country, city, gender)
+                aggregate = segments.get(segment)
+                if aggregate is None:
+                    aggregate = segments[segment] = _Aggregate(self.sketch())
+                aggregate.count += 1
+                aggregate.total += total_spent
+                aggregate.low = total_spent if aggregate.low is None else min(aggregate.low, total_spent)
+                aggregate.high = total_spent if aggregate.high is None else max(aggregate.high, total_spent)
+                aggregate.sketch.add(total_spent)
+
+            rollups = defaultdict(lambda: _Aggregate(self.sketch()))
+            for segment, aggregate in segments.items():
+                for key in rollup_keys(segment):
+                    rollups[key].merge(aggregate)
+
+            SpendRollupBucket.objects.all().delete()
+            SpendRollup.objects.all().delete()
+            created = SpendRollup.objects.bulk_create(
+                [
+                    SpendRollup(
+                        country=country, city=city, gender=gender, count=aggregate.count, total=aggregate.total,
+                        min_spent=aggregate.low, max_spent=aggregate.high, bounds_exact=True,
+                    )
+                    for (country, city, gender), aggregate in rollups.items()
+                ],
+                batch_size=1000,
+            )
+            SpendRollupBucket.objects.bulk_create(
+                [
+                    SpendRollupBucket(rollup_id=rollup.pk, bucket=bucket, count=count)
+                    for rollup, aggregate in zip(created, rollups.values())
+                    for bucket, count in aggregate.sketch.counts.items() if count
+                ],
+                batch_size=2000,
+            )
+
+        with self._lock:
+            self.rebuilds += 1
+            self.last_build_ms = round((time.perf_counter() - start) * 1000, 1)
+        return len(created)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'changes': self.changes,
+                'rederived_bounds': self.rederived_bounds,
+                'rebuilds': self.rebuilds,
+                'last_build_ms': self.last_build_ms,
+            }
+
+
+spend_rollups = SpendRollups.from_settings()
+metrics.register('spend_rollups', spend_rollups.stats)
@@ -0,0 +1,25 @@
+from .replica import replica, replica_reads_enabled
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes, migrations and ordinary reads use `default`. Reads inside
+    replica_reads() (views with ReplicaReadMixin) use the replica while it
+    is within REPLICA['MAX_LAG'] of the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads_enabled():
+            return replica.route_read()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, never migrated itself
+        return db != replica.alias
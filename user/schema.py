@@ -0,0 +1,6 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """CachedJWTAuthentication reads the same bearer tokens as SimpleJWT's."""
+    target_class = 'user.authentication.CachedJWTAuthentication'
@@ -0,0 +1,187 @@
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+
+# Indexed User columns and their relevance weights: a name match counts
+# for more than the email's, and both for more than the city's
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'city')
+WEIGHTS = (10.0, 10.0, 5.0, 1.0)
+MAX_TERMS = 8
+
+TABLE = 'user_search'
+USER_TABLE = 'user_user'
+
+# External-content FTS5 table: it stores only the index and reads the text
+# back from user_user by rowid. The triggers keep it in step with every
+# write, including QuerySet.update(), bulk_create() and raw SQL. user_user
+# has no INTEGER PRIMARY KEY, so its rowids are not stable: a VACUUM may
+# renumber them, after which matches point at the wrong users until
+# `manage.py reindex_user_search` runs. Run it after every VACUUM (a
+# migration that rebuilds user_user reindexes by itself). Emails
+# tokenize like the other fields ("rahim.khan@mail.com" is rahim, khan,
+# mail, com), and the 2 and 3 character prefix indexes keep short
+# type-ahead prefixes off a full term scan.
+_columns = ', '.join(SEARCH_FIELDS)
+_new = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+_old = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+
+SQLITE_TABLE = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        {_columns},
+        content='{USER_TABLE}', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+"""
+SQLITE_TRIGGERS = {
+    f'{TABLE}_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON {USER_TABLE} BEGIN
+            INSERT INTO {TABLE}(rowid, {_columns}) VALUES (new.rowid, {_new});
+        END
+    """,
+    f'{TABLE}_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON {USER_TABLE} BEGIN
+            INSERT INTO {TABLE}({TABLE}, rowid, {_columns}) VALUES ('delete', old.rowid, {_old});
+        END
+    """,
+    f'{TABLE}_update': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF {_columns} ON {USER_TABLE} BEGIN
+            INSERT INTO {TABLE}({TABLE}, rowid, {_columns}) VALUES ('delete', old.rowid, {_old});
+            INSERT INTO {TABLE}(rowid, {_columns}) VALUES (new.rowid, {_new});
+        END
+    """,
+}
+
+# PostgreSQL: a GIN index on this exact expression, which the search query repeats
+PG_DOCUMENT = "to_tsvector('simple', {})".format(
+    " || ' ' || ".join(f"coalesce({field}, '')" for field in SEARCH_FIELDS)
+)
+PG_INDEX = f'{TABLE}_gin'
+
+
+def create_search_index(connection):
+    # Safe to repeat: creates what is missing and indexes every row
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_TABLE)
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON {USER_TABLE} USING gin ({PG_DOCUMENT})')
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+
+def missing_search_triggers(connection):
+    """
+    The triggers that are gone. SQLite drops them with the table whenever a
+    migration rebuilds user_user to alter it.
+    """
+    if connection.vendor != 'sqlite':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [USER_TABLE])
+        existing = {name for name, in cursor.fetchall()}
+    return [name for name in SQLITE_TRIGGERS if name not in existing]
+
+
+def rebuild_search_index(connection):
+    """Restore what is missing and re-read every row; rowids may have changed with the table."""
+    create_search_index(connection)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'REINDEX INDEX {PG_INDEX}')
+
+
+def search_terms(text):
+    # Words only, so nothing the user types can reach the FTS query syntax
+    return re.findall(r'\w+', text.lower())[:MAX_TERMS]
+
+
+def search_queryset(queryset, text):
+    """
+    `queryset` narrowed to users matching every word of `text`, the last
+    one as a prefix since it may still be being typed, with a `search_rank`
+    annotation: lower is more relevant. Unchanged when `text` has no words.
+
+    Only the last word is expanded: a prefix is merged from every term it
+    covers, so "gmail"* would read every gmail user, where "gmail" skips
+    through the list of the rarer words.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+
+    if vendor == 'sqlite':
+        weights = ', '.join(map(str, WEIGHTS))
+        return queryset.extra(
+            tables=[TABLE],
+            where=[f'{TABLE}.rowid = {table}.rowid', f'{TABLE} MATCH %s'],
+            params=[' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'],
+        ).annotate(search_rank=RawSQL(f'bm25({TABLE}, {weights})', (), output_field=FloatField()))
+
+    if vendor == 'postgresql':
+        query = ' & '.join([*terms[:-1], f'{terms[-1]}:*'])
+        return queryset.extra(
+            where=[f"{PG_DOCUMENT} @@ to_tsquery('simple', %s)"],
+            params=[query],
+        ).annotate(search_rank=RawSQL(
+            f"-ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s))", (query,), output_field=FloatField()
+        ))
+
+    # No full-text index elsewhere: a LIKE scan, in the default order
+    matches = [reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS)) for term in terms]
+    return queryset.filter(reduce(and_, matches)).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class UserSearchFilter(BaseFilterBackend):
+    """
+    `?search=` over names, email and city from the full-text index. Results
+    come most relevant first unless the request asks for an `?ordering=`;
+    list it after OrderingFilter so its order wins.
+    """
+
+    search_param = 'search'
+    ordering_param = 'ordering'
+
+    def get_search_text(self, request):
+        return request.query_params.get(self.search_param, '')
+
+    def get_ordering(self, request, queryset, view):
+        if search_terms(self.get_search_text(request)) and self.ordering_param not in request.query_params:
+            return ['search_rank']
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        queryset = search_queryset(queryset, self.get_search_text(request))
+        ordering = self.get_ordering(request, queryset, view)
+        return queryset.order_by(*ordering, 'id') if ordering else queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Words to find in first name, last name, email or city, the last one as a prefix. '
+                           'Results are ordered by relevance unless `ordering` is given.',
+            'schema': {'type': 'string'},
+        }]
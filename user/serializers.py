@@ -4,28 +4,37 @@ from rest_framework import serializers
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model, authenticate
-from jwt.algorithms import RSAAlgorithm
-import jwt
 
 # OAuth2 imports
-from google.oauth2 import id_token
-from google.auth.transport import requests
-import requests as req
-from django.conf import settings
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.files.base import ContentFile
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .authentication import user_snapshots
+from .tokens import TOKEN_VERSION_CLAIM, RefreshToken
+from .images import variant_urls
+from . import provider_profiles
+from .tasks import enqueue_avatar_import
+from .retry import retry_on_lock
 
 
 User = get_user_model()
 
 
+class PictureVariantsField(serializers.ReadOnlyField):
+    # {"48": {"webp": url, "jpeg": url}, "128": {...}, "512": {...}}
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get('request'))
+
+
 class UserListSerializer(ModelSerializer):
+    profile_picture_variants = PictureVariantsField()
+    
     class Meta:
         model = User
         fields = [
             'id', 'first_name', 'last_name', 
             'email', 'phone_number', 
-            'profile_picture', 'gender', 
+            'profile_picture', 'profile_picture_variants', 'gender', 
             'city', 'zip_code', 'country',
             'total_spent',
             'created_at', 'updated_at'
@@ -34,12 +43,14 @@ class UserListSerializer(ModelSerializer):
         
         
 class UserProfileSerializer(ModelSerializer):
+    profile_picture_variants = PictureVariantsField()
+    
     class Meta:
         model = User
         fields = [
             'id', 'first_name', 'last_name', 
             'email', 'phone_number', 
-            'profile_picture', 'gender',
+            'profile_picture', 'profile_picture_variants', 'gender',
             'bio', 'street', 'city', 
             'zip_code', 'country',
         ]
@@ -72,13 +83,51 @@ class UserSignupSerializer(ModelSerializer):
         password = validated_data.pop('password')
         confirm_password = validated_data.pop('confirm_password', None)
         
-        user = User.objects.create(**validated_data)
+        # Hash before the INSERT, so a busy hashing pool fails the signup without a write
+        user = User(**validated_data)
         user.set_password(password)
-        user.save()
+        retry_on_lock(user.save)()
         
         return user
     
     
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    # api/token/ issues tokens that carry token_version too
+    token_class = RefreshToken
+    
+    
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    api/token/refresh/ with the revocation store and the cached user
+    snapshot: a rotated, logged-out or password-changed refresh token is
+    refused without reading the user row.
+    """
+    token_class = RefreshToken
+    
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        
+        snapshot = user_snapshots.get(refresh.payload.get(jwt_settings.USER_ID_CLAIM))
+        if (
+            snapshot is None or not snapshot['is_active']
+            or refresh.payload.get(TOKEN_VERSION_CLAIM, 0) != snapshot['token_version']
+        ):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        
+        data = {'access': str(refresh.access_token)}
+        
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            if jwt_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        
+        return data
+    
+    
 class UserLoginSerializer(ModelSerializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(
@@ -137,427 +186,122 @@ class UserStatsSerializer(ModelSerializer):
         ]        
         
 
-class GoogleOAuthSerializer(serializers.Serializer):
-    id_token = serializers.CharField(required=True)
-    
-    def validate(self, attrs):
-        token = attrs.get('id_token')
-        
-        try:
-            google_user = id_token.verify_oauth2_token(
-                token,
-                requests.Request(),
-                settings.GOOGLE_CLIENT_ID
-            )
-        except Exception:
-            raise serializers.ValidationError("Invalid or expired Google token")
-        
-        # Check if email is verified
-        # if not google_user.get('email_verified'):
-        #     raise serializers.ValidationError('Google email not verified')
-        
-        # Extarct data from google response
-        email = google_user.get('email')
-        if not email:
-            raise serializers.ValidationError(
-                "Google account has no email. Please use another login method."
-            )
-            
-        first_name = google_user.get('given_name', '')
-        last_name = google_user.get('family_name', '')
-        picture = google_user.get('picture', '')
-        provider_id = google_user.get('sub'),
-        
-        user, created = User.objects.get_or_create(
-            email = email,
-            defaults={
-                'first_name': first_name,
-                'last_name': last_name,
-                'is_active': True,
-                'provider': AuthProvider.GOOGLE,
-                'provider_id': provider_id
-            },
-        )
-                
-        if created:
-            user.set_unusable_password()
-            if picture:
-                try:
-                    pic = req.get(picture, timeout=5)
-                    pic.raise_for_status()
-                
-                    if pic.status_code == 200:
-                        file_name = f'{user.id}_google.jpg'
-                        user.profile_picture.save(
-                            file_name,
-                            ContentFile(pic.content),
-                            save=False
-                        )
-                except Exception:
-                    pass
-            user.save()
-            
-        if not created:
-            if user.provider == AuthProvider.SELF:
-                raise serializers.ValidationError('Account already exists. Please login with email and password')
-            elif user.provider != AuthProvider.GOOGLE:
-                raise serializers.ValidationError(f'Account already exists. Please login with {user.provider}.')
-        
-        refresh = RefreshToken.for_user(user)
+class LeaderboardEntrySerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    id = serializers.UUIDField()
+    total_spent = serializers.FloatField()
+
+
+class LeaderboardRankSerializer(LeaderboardEntrySerializer):
+    percentile = serializers.FloatField(help_text='Share of users who spent less, in percent.')
+    total_users = serializers.IntegerField()
+
+
+class LeaderboardNeighboursSerializer(serializers.Serializer):
+    above = LeaderboardEntrySerializer(many=True)
+    user = LeaderboardEntrySerializer()
+    below = LeaderboardEntrySerializer(many=True)
         
-        return {
-            'user': UserProfileSerializer(user).data,
-            'is_new_user': created,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token)
-            }
+
+class AutocompleteEntrySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    first_name = serializers.CharField()
+    last_name = serializers.CharField()
+    email = serializers.EmailField()
+
+
+class SpendSegmentSerializer(serializers.Serializer):
+    country = serializers.CharField(help_text="'*' for every country, '' for not set.")
+    city = serializers.CharField()
+    gender = serializers.CharField()
+    count = serializers.IntegerField()
+    total = serializers.FloatField()
+    average = serializers.FloatField(allow_null=True)
+    min = serializers.FloatField(allow_null=True)
+    max = serializers.FloatField(allow_null=True)
+    bounds_exact = serializers.BooleanField(help_text='False when min/max are sketch estimates, until the next rebuild.')
+    quantiles = serializers.DictField(
+        child=serializers.FloatField(allow_null=True),
+        help_text='Estimated total_spent at each quantile, within the sketch accuracy (1% by default).'
+    )
+
+
+def login_response(user, created):
+    """The body of a successful social login: the profile and a token pair."""
+    refresh = RefreshToken.for_user(user)
+    
+    return {
+        'user': UserProfileSerializer(user).data,
+        'is_new_user': created,
+        'tokens': {
+            'refresh': str(refresh),
+            'access': str(refresh.access_token)
         }
+    }
 
 
-class GitHubOAuthSerializer(serializers.Serializer):
-    code = serializers.CharField(required=True)
+class SocialLoginSerializer(serializers.Serializer):
+    """
+    Logs in, or signs up, the user behind a provider's credentials. The
+    profile fetch is shared with the async views (user/provider_profiles.py);
+    here its calls run on the request thread.
+    """
+    
+    provider = None
     
     def validate(self, attrs):
-        code = attrs.get('code')
-                
-        token_response = req.post(
-            'https://github.com/login/oauth/access_token',
-            headers={'Accept': 'application/json'},
-            data={
-                'client_id': settings.GITHUB_CLIENT_ID,
-                'client_secret': settings.GITHUB_CLIENT_SECRET,
-                'code': code
-            },
-            timeout=5
-        )
-        
-        token_data = token_response.json()
-        access_token = token_data.get('access_token')
-        
-        if not access_token:
-            raise serializers.ValidationError('Invalid GitHub authorization code')
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Accept': 'application/json'
-        }
-        
-        user_response = req.get('https://api.github.com/user', headers=headers)
-        github_user = user_response.json()
-        
-        # Extract data
-        provider_id = str(github_user.get('id'))
-        full_name = github_user.get('name') or ''
-        avatar = github_user.get('avatar_url')
-        
-        # Name handling
-        first_name, last_name = '', ''
-        if full_name:
-            parts = full_name.split(' ', 1)
-            first_name = parts[0]
-            last_name = parts[1] if len(parts) > 1 else ''
-            
-        # Request for Email
-        email_response = req.get('https://api.github.com/user/emails', headers=headers)
-        emails = email_response.json()
-        
-        primary_email = next(
-            (e['email'] for e in emails if e.get('primary') and e.get('verified')), None
-        )
-        if not primary_email:
-               raise serializers.ValidationError(
-                   'GitHub account has no verified email. Please add one or use another login method.'
-               )     
+        profile = provider_profiles.run(provider_profiles.PROVIDERS[self.provider][1](attrs))
         
         user, created = User.objects.get_or_create(
-            email = primary_email,
+            email=profile['email'],
             defaults={
-                'first_name': first_name,
-                'last_name': last_name,
+                'first_name': profile['first_name'],
+                'last_name': profile['last_name'],
                 'is_active': True,
-                'provider': AuthProvider.GITHUB,
-                'provider_id': provider_id
+                'provider': self.provider,
+                'provider_id': profile['provider_id']
             },
         )
         
         if created:
             user.set_unusable_password()
-            
-            if avatar:
-                try:
-                    img = req.get(avatar, timeout=5)
-                    img.raise_for_status()
-                    
-                    user.profile_picture.save(
-                        f'{user.id}_github.jpg',
-                        ContentFile(img.content),
-                        save=False
-                    )
-                except Exception:
-                    pass
             user.save()
             
-        if not created:
-            if user.provider == AuthProvider.SELF:
-                raise serializers.ValidationError('Account already exists. Please login with email and password')
-            elif user.provider != AuthProvider.GITHUB:
-                raise serializers.ValidationError(f'Account already exists. Please login with {user.provider}.')
-        
-        refresh = RefreshToken.for_user(user)
-        
-        return {
-            'user': UserProfileSerializer(user).data,
-            'is_new_user': created,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token)
-            }
-        }
+            # Downloaded by the job worker, the login does not wait for it
+            if profile['picture']:
+                enqueue_avatar_import(user, self.provider, profile['picture'])
+        else:
+            provider_profiles.check_provider(user, self.provider)
         
+        return login_response(user, created)
 
-class FacebookOAuthSerializer(serializers.Serializer):
-    access_token = serializers.CharField(required=True)
+
+class GoogleOAuthSerializer(SocialLoginSerializer):
+    provider = AuthProvider.GOOGLE
     
-    def validate(self, attrs):
-        access_token = attrs.get('access_token')
-        
-        # Receive user data from Facebook
-        fields = 'id,email,first_name,last_name,picture.type(large)'
-        url = (
-            f'{settings.FACEBOOK_GRAPH_API_URL}/me'
-            f'?fields={fields}&access_token={access_token}'
-        )
-        response = req.get(url)
-        
-        if response.status_code != 200:
-            raise serializers.ValidationError('Invalid Facebook access token')
-        
-        # Storing user data in a variable
-        fb_user = response.json()
-        
-        # Extracting user data
-        email = fb_user.get('email')
-        if not email:
-            raise serializers.ValidationError('Facebook account has no eamil. Please try another login method')
-        
-        first_name = fb_user.get('first_name', '')
-        last_name = fb_user.get('last_name', '')
-        provider_id = fb_user.get('id')
-        picture = (
-            fb_user.get('picture', {})
-                .get('data', {})
-                .get('url')
-        )
-        
-        user, created = User.objects.get_or_create(
-            email=email,
-            defaults={
-                'first_name': first_name,
-                'last_name': last_name,
-                'is_active': True,
-                'provider': AuthProvider.FACEBOOK,
-                'provider_id': provider_id
-            }
-        )
-        
-        if created:
-            user.set_unusable_password()
-            
-            if picture:
-                try:
-                    pic = req.get(picture, timeout=5)
-                    pic.raise_for_status()
-                    
-                    user.profile_picture.save(
-                        f'{user.id}_facebook.jpg',
-                        ContentFile(pic.content),
-                        save=False
-                    )
-                except Exception:
-                    pass
-            user.save()
-            
-        if not created:
-            if user.provider == AuthProvider.SELF:
-                raise serializers.ValidationError('Account already exists. Please login with email and password')
-            elif user.provider != AuthProvider.FACEBOOK:
-                raise serializers.ValidationError(f'Account already exists. Please login with {user.provider}.')
-            
-        refresh = RefreshToken.for_user(user)
-        
-        return {
-            'user': UserProfileSerializer(user).data,
-            'is_new_user': created,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token)
-            }
-        }
-        
-        
-class LinkedInOAuthSerializer(serializers.Serializer):
-    code = serializers.CharField(required=True)
+    id_token = serializers.CharField(required=True)
+
+
+class GitHubOAuthSerializer(SocialLoginSerializer):
+    provider = AuthProvider.GITHUB
     
-    def validate(self, attrs):
-        code = attrs.get('code')
-        
-        # Exchange code to get access token
-        token_url = 'https://www/linkedin.com/oauth/v2/accessToken'
-        token_data = {
-            'grant_type': 'authorization_code',
-            'code': code,
-            'redirect_uri': settings.LINKEDIN_REDIRECT_URI,
-            'client_id': settings.LINKEDIN_CLIENT_ID,
-            'client_secret': settings.LINKEDIN_CLIENT_SECRET
-        }
-        
-        token_response = req.post(token_url, data=token_data)
-        
-        if token_response.status_code != 200:
-            raise serializers.ValidationError('Invalid LinkedIn authorization code')
-        
-        token_data = token_response.json()
-        access_token = token_data.get('access_token')
-        
-        if not access_token:
-            raise serializers.ValidationError('Failed to obtain access token')
-        
-        # Use token to get LinkedIn user info
-        url = 'https://api.linkedin.com/v2/userinfo'
-        headers = {'Authorization': f'Bearer {access_token}'}
-        
-        response = req.get(url, headers=headers)
-        
-        if response.status_code != 200:
-            raise serializers.ValidationError('Failed to fetch LinkedIn user data')
-        
-        # Extracting user info from response
-        linkedin_user = response.json()
-        
-        email = linkedin_user.get('email')
-        if not email:
-            raise serializers.ValidationError('LinkedIn account has no email. Please use another login method.')
-        
-        first_name = linkedin_user.get('given_name', '')
-        last_name = linkedin_user.get('family_name', '')
-        picture = linkedin_user.get('picture')
-        provider_id = linkedin_user.get('sub')
+    code = serializers.CharField(required=True)
         
-        user, created = User.objects.get_or_create(
-            email=email,
-            defaults={
-                'first_name': first_name,
-                'last_name': last_name,
-                'is_active': True,
-                'provider': AuthProvider.LINKEDIN,
-                'provider_id': provider_id
-            }
-        )
+
+class FacebookOAuthSerializer(SocialLoginSerializer):
+    provider = AuthProvider.FACEBOOK
+    
+    access_token = serializers.CharField(required=True)
         
-        if created:
-            user.set_unusable_password()
-            
-            if picture:
-                try:
-                    pic = req.get(picture, timeout=5)
-                    pic.raise_for_status()
-                    
-                    user.profile_picture.save(
-                        f'{user.id}_linkedIn.jpg',
-                        ContentFile(pic.content),
-                        save=False
-                    )
-                except Exception:
-                    pass
-            user.save()
-            
-        refresh = RefreshToken.for_user(user)
         
-        return{
-            'user': UserProfileSerializer(user).data,
-            'is_new_user': created,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token)
-            }
-        }
+class LinkedInOAuthSerializer(SocialLoginSerializer):
+    provider = AuthProvider.LINKEDIN
+    
+    code = serializers.CharField(required=True)
         
         
-class AppleOAuthSerializer(serializers.Serializer):
+class AppleOAuthSerializer(SocialLoginSerializer):
+    provider = AuthProvider.APPLE
+    
     id_token = serializers.CharField(required=True)
     user = serializers.JSONField(required=False)
-    
-    def validate(self, attrs):
-        id_token = attrs.get('id_token')
-        user_data = attrs.get('user', {})
-        
-        # Fetch Apple public keys
-        apple_public_keys = req.get('https://appleid.apple.com/auth/keys').json()
-        
-        # Extracts metadata from token [includes: kid; (key id)]
-        header = jwt.get_unverified_header(id_token)
-        
-        # Match correct public key [Apple rotates keys]
-        # This finds the exact key used to sign this token
-        key = next(
-            k for k in apple_public_keys['keys']
-            if k['kid'] == header['kid']
-        )
-        
-        # Convert JWK → RSA public key
-        public_key = RSAAlgorithm.from_jwk(key)
-        
-        # Decode & verify token
-        payload = jwt.decode(
-            id_token,
-            public_key,
-            algorithms=['RS256']
-        )
-        
-        # Extract user data
-        email = payload.get('email')
-        provider_id = payload.get('sub')    # sub → unique Apple user ID
-        
-        if not email:
-            raise serializers.ValidationError('Apple account has no email.')
-        
-        first_name = ''
-        last_name = ''
-        
-        if user_data:
-            name = user_data.get('name', {})
-            first_name = name.get('firstName', '')
-            last_name = name.get('lastName', '')
-            
-        user, created = User.objects.get_or_create(
-            email=email,
-            defaults={
-                'first_name': first_name,
-                'last_name': last_name,
-                'is_active': True,
-                'provider': AuthProvider.APPLE,
-                'provider_id': provider_id
-            }
-        )
-        
-        if created:
-            user.set_unusable_password()
-            user.save()
-        
-        if not created:
-            if user.provider == AuthProvider.SELF:
-                raise serializers.ValidationError('Account already exists. Please login with email and password')
-            if user.provider != AuthProvider.APPLE:
-                raise serializers.ValidationError(f'Account already exists. Please login with {user.provider}')
-            
-        refresh = RefreshToken.for_user(user)
-        
-        return {
-            'user': UserProfileSerializer(user).data,
-            'is_new_user': created,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token)
-            }
-        }
\ No newline at end of file
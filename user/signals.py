@@ -0,0 +1,171 @@
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import user_snapshots
+from .autocomplete import ENTRY_FIELDS, autocomplete, entry_of
+from .counting import counts
+from .leaderboard import leaderboard
+from .models import SpendRollup
+from .profile_cache import profile_cache
+from .replica import replica
+from .rollups import ROLLUP_FIELDS, segment_of, spend_rollups
+from .search import TABLE as SEARCH_TABLE, missing_search_triggers, rebuild_search_index
+from .tasks import enqueue_picture_variants
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def queue_picture_variants(sender, instance, **kwargs):
+    # Upload, provider import or removal: resize in the job worker, not the request
+    if (instance.profile_picture.name or None) != (instance.profile_picture_variants or {}).get('source'):
+        transaction.on_commit(lambda: enqueue_picture_variants(instance))
+
+
+@receiver(post_save, sender=User)
+def update_leaderboard(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'total_spent' not in update_fields:
+        return
+
+    user_id, total_spent = instance.pk, instance.total_spent
+    transaction.on_commit(lambda: leaderboard.update(user_id, total_spent))
+
+
+@receiver(post_delete, sender=User)
+def remove_from_leaderboard(sender, instance, **kwargs):
+    # Read now: a delete clears instance.pk before an outer transaction commits
+    user_id = instance.pk
+    transaction.on_commit(lambda: leaderboard.update(user_id, None))
+
+
+def rollup_entry(values):
+    if any(field not in values for field in ROLLUP_FIELDS):
+        return None
+    return segment_of(values['country'], values['city'], values['gender']), values['total_spent']
+
+
+def touches_rollups(update_fields):
+    return update_fields is None or not set(update_fields).isdisjoint(ROLLUP_FIELDS)
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_delete, sender=User)
+def load_rollup_fields(sender, instance, update_fields=None, **kwargs):
+    # The rollup change needs the old values; fetch those the instance was not loaded with
+    if instance._state.adding or not touches_rollups(update_fields):
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    missing = [field for field in ROLLUP_FIELDS if field not in loaded]
+    if missing:
+        row = User.objects.filter(pk=instance.pk).values(*missing).first()
+        if row is not None:
+            instance._loaded_values = {**loaded, **row}
+
+
+@receiver(post_save, sender=User)
+def update_spend_rollups(sender, instance, created, update_fields=None, **kwargs):
+    # In the transaction User.save() opens, not on commit: the row and the
+    # rollups commit or roll back together
+    if not touches_rollups(update_fields):
+        return
+    deferred = instance.get_deferred_fields()
+    new = rollup_entry({
+        field: instance.loaded_value(field) if field in deferred else getattr(instance, field)
+        for field in ROLLUP_FIELDS
+    })
+    old = None if created else rollup_entry(getattr(instance, '_loaded_values', {}))
+    spend_rollups.change(old, new)
+
+
+@receiver(post_delete, sender=User)
+def remove_from_spend_rollups(sender, instance, **kwargs):
+    spend_rollups.change(rollup_entry(getattr(instance, '_loaded_values', {})), None)
+
+
+def loaded_entry(instance):
+    loaded = getattr(instance, '_loaded_values', {})
+    if any(field not in loaded for field in ENTRY_FIELDS):
+        return False
+    return entry_of(loaded)
+
+
+@receiver(post_save, sender=User)
+def update_autocomplete(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields).isdisjoint(ENTRY_FIELDS):
+        return
+
+    old = None if created else loaded_entry(instance)
+    deferred = instance.get_deferred_fields()
+    if old is False or not deferred.isdisjoint(ENTRY_FIELDS):
+        # Saved from an instance we never saw loaded, so its old entry is unknown
+        transaction.on_commit(autocomplete.invalidate)
+        return
+
+    new = entry_of({field: getattr(instance, field) for field in ENTRY_FIELDS})
+    transaction.on_commit(lambda: autocomplete.update(instance.pk, old, new))
+
+
+@receiver(post_delete, sender=User)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    user_id, old = instance.pk, loaded_entry(instance)
+    if old is False:
+        transaction.on_commit(autocomplete.invalidate)
+    else:
+        transaction.on_commit(lambda: autocomplete.update(user_id, old, None))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_counts(sender, created=True, **kwargs):
+    # Updates only age out with the TTL, a new or removed row changes every count
+    if created:
+        transaction.on_commit(lambda: counts.invalidate(User))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def pin_to_primary(sender, instance, **kwargs):
+    # Read-your-writes: this user's reads skip the replica until it has caught up.
+    # Pinned before the profile cache is invalidated, so no read can refill it from the replica.
+    if replica.configured:
+        user_id = instance.pk
+        transaction.on_commit(lambda: replica.pin(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: profile_cache.invalidate(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    # Drop it now and after commit, so a request in between cannot re-cache the old row
+    user_id = instance.pk
+    user_snapshots.invalidate(user_id)
+    transaction.on_commit(lambda: user_snapshots.invalidate(user_id))
+
+
+@receiver(post_migrate)
+def build_spend_rollups(sender, using, **kwargs):
+    # A new install, or the first migrate with rollups: count in the users already there
+    if sender.name != 'user' or using != router.db_for_write(SpendRollup):
+        return
+    if not SpendRollup.objects.exists() and User.objects.exists():
+        spend_rollups.rebuild()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    # A migration that alters User makes SQLite copy user_user to a new table,
+    # dropping the search triggers and renumbering rowids
+    if sender.name != 'user':
+        return
+    connection = connections[using]
+    if missing_search_triggers(connection) and SEARCH_TABLE in connection.introspection.table_names():
+        rebuild_search_index(connection)
@@ -0,0 +1,41 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+
+from .provider_profiles import PROVIDERS, arun, check_provider
+from .serializers import login_response
+from .tasks import enqueue_avatar_import
+
+
+User = get_user_model()
+
+
+#==================================================#
+# Async social login
+# The provider profile comes from user/provider_profiles.py, its calls
+# that do not depend on each other made concurrently in worker threads;
+# the user upsert uses the async ORM and avatars go to the job queue.
+#==================================================#
+
+async def social_login(provider, data):
+    profile = await arun(PROVIDERS[provider][1](data))
+
+    user, created = await User.objects.aget_or_create(
+        email=profile['email'],
+        defaults={
+            'first_name': profile['first_name'],
+            'last_name': profile['last_name'],
+            'is_active': True,
+            'provider': provider,
+            'provider_id': profile['provider_id']
+        }
+    )
+
+    if created:
+        user.set_unusable_password()
+        await user.asave()
+        if profile['picture']:
+            await sync_to_async(enqueue_avatar_import)(user, provider, profile['picture'])
+    else:
+        check_provider(user, provider)
+
+    return await sync_to_async(login_response)(user, created)
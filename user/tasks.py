@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+
+from .images import generate_variants
+from .jobs import PermanentJobError, enqueue, job
+from .oauth_http import oauth_http
+
+
+User = get_user_model()
+
+
+def enqueue_avatar_import(user, provider, url):
+    enqueue(
+        'import_avatar',
+        {'user_id': str(user.id), 'provider': provider, 'url': url},
+        dedup_key=f'import_avatar:{user.id}',
+    )
+
+
+@job('import_avatar')
+def import_avatar(user_id, provider, url):
+    user = User.objects.filter(pk=user_id).first()
+
+    # Deleted meanwhile, or the user already uploaded a picture of their own
+    if user is None or user.profile_picture:
+        return
+
+    pic = oauth_http.get('avatar', url)
+    if 400 <= pic.status_code < 500:
+        raise PermanentJobError(f'Avatar download returned {pic.status_code}')
+    pic.raise_for_status()
+
+    user.profile_picture.save(
+        f'{user.id}_{provider}.jpg',
+        ContentFile(pic.content),
+        save=False
+    )
+    user.save(update_fields=['profile_picture', 'updated_at'])
+
+
+def enqueue_picture_variants(user):
+    enqueue(
+        'generate_picture_variants',
+        {'user_id': str(user.id)},
+        dedup_key=f'generate_picture_variants:{user.id}',
+    )
+
+
+@job('generate_picture_variants')
+def generate_picture_variants(user_id):
+    generate_variants(user_id)
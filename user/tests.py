@@ -1,3 +1,1366 @@
-from django.test import TestCase
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from asgiref.sync import async_to_sync
+import requests as req
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from drf_spectacular.generators import SchemaGenerator
+from jwt.algorithms import RSAAlgorithm
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import TokenError
+
+from . import images, jobs, ratelimit, retry
+from .authentication import CachedJWTAuthentication, user_snapshots
+from .autocomplete import AutocompleteIndex
+from .counting import CountStrategy, counts
+from .export import export_chunks, export_queryset
+from .hashing import HashingBusy, HashingExecutor, password_hashing
+from .jwks import GoogleTokenVerifier, JWKSKeyStore
+from .leaderboard import SpendLeaderboard
+from .management.commands.import_users import Command as ImportUsers
+from .management.commands.refresh_replica import Command as RefreshReplica
+from .models import AuthProvider, Job, JobStatus, RevokedToken, SpendRollup, User
+from .oauth_http import ProviderBusyError, ProviderHTTPClient, oauth_http
+from .profile_cache import ProfileCache, profile_cache
+from .ratelimit import IPRateThrottle
+from .readonly import ValuesConverter
+from .replica import ReplicaMonitor, replica, replica_reads
+from .retry import retry_on_lock
+from .revocation import BloomFilter, RevocationStore
+from .rollups import spend_rollups
+from .search import TABLE as SEARCH_TABLE, missing_search_triggers, search_queryset
+from .serializers import UserAddressSerializer, UserListSerializer, UserProfileSerializer, UserStatsSerializer
+from .signals import build_spend_rollups
+from .tokens import RefreshToken
+from .views import MyProfileView
+
+
+_emails = (f'user{n}@example.com' for n in itertools.count())
+
+
+def make_user(**fields):
+    # No password hashing: most tests never log in
+    fields.setdefault('email', next(_emails))
+    fields.setdefault('password', '!')
+    return User.objects.create(**fields)
+
+
+def isolate_rate_limits(test):
+    # A rate limit store of the test's own, so earlier runs can't throttle it
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path)
+    patcher = mock.patch.object(ratelimit, 'rate_limiter', ratelimit.SlidingWindowLimiter(os.path.join(path, 'hits.sqlite3')))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def jwks_response(keys, cache_control='max-age=3600', status_code=200):
+    response = mock.Mock(status_code=status_code, headers={'Cache-Control': cache_control})
+    response.json.return_value = {'keys': [
+        {**RSAAlgorithm.to_jwk(key.public_key(), as_dict=True), 'kid': kid} for kid, key in keys.items()
+    ]}
+    response.raise_for_status.side_effect = req.HTTPError() if status_code >= 400 else None
+    return response
+
+
+def image_file(color='red', size=(600, 400)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue())
+
+
+def locked_for(failures):
+    # A save that finds the database locked `failures` times, then returns its call count
+    calls = []
+
+    def save():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise OperationalError('database is locked')
+        return len(calls)
+    return save
+
+
+class JWKSKeyStoreTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key = rsa_key()
+
+    def store(self, *responses, **kwargs):
+        client = mock.Mock()
+        client.get.side_effect = responses
+        return JWKSKeyStore('apple', 'https://example.com/keys', client=client, **kwargs), client
+
+    def test_keys_are_fetched_once(self):
+        store, client = self.store(jwks_response({'a': self.key}))
+
+        self.assertIsNotNone(store.get_key('a'))
+        self.assertIs(store.get_key('a'), store.get_key('a'))
+        self.assertEqual(client.get.call_count, 1)
+        self.assertEqual(store.stats()['hits'], 2)
+
+    def test_unknown_kid_refetches(self):
+        store, client = self.store(
+            jwks_response({'a': self.key}), jwks_response({'a': self.key, 'b': self.key}),
+            min_refresh_interval=0,
+        )
+        store.get_key('a')
+
+        self.assertIsNotNone(store.get_key('b'))
+        self.assertEqual(client.get.call_count, 2)
+
+    def test_unknown_kids_cannot_hammer_the_provider(self):
+        store, client = self.store(jwks_response({'a': self.key}), min_refresh_interval=60)
+        store.get_key('a')
+
+        self.assertIsNone(store.get_key('made-up'))
+        self.assertIsNone(store.get_key('made-up'))
+        self.assertEqual(client.get.call_count, 1)
+
+    def test_max_age_expiry_refetches(self):
+        store, client = self.store(
+            jwks_response({'a': self.key}, cache_control='max-age=0'), jwks_response({'a': self.key}),
+            min_refresh_interval=0,
+        )
+        store.get_key('a')
+        store.get_key('a')
+        self.assertEqual(client.get.call_count, 2)
+
+    def test_failed_refresh_serves_the_stale_keys(self):
+        store, client = self.store(
+            jwks_response({'a': self.key}, cache_control='max-age=0'), jwks_response({}, status_code=503),
+            min_refresh_interval=0,
+        )
+        key = store.get_key('a')
+
+        with self.assertLogs('user.jwks', 'WARNING'):
+            self.assertIs(store.get_key('a'), key)
+        self.assertEqual(store.stats()['fetch_errors'], 1)
+
+
+class GoogleTokenVerifierTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key = rsa_key()
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.get.return_value = jwks_response({'g1': self.key})
+        self.verifier = GoogleTokenVerifier(JWKSKeyStore('google', 'https://example.com/certs', client=self.client))
+
+    def token(self, key=None, kid='g1', **claims):
+        now = int(time.time())
+        claims = {
+            'iss': 'https://accounts.google.com', 'aud': 'client-id', 'sub': '42',
+            'email': 'g@example.com', 'iat': now, 'exp': now + 600, **claims,
+        }
+        return jwt.encode(claims, key or self.key, algorithm='RS256', headers={'kid': kid})
+
+    def test_valid_tokens_verify_against_cached_keys(self):
+        for _ in range(3):
+            self.assertEqual(self.verifier.verify(self.token(), 'client-id')['email'], 'g@example.com')
+        self.assertEqual(self.client.get.call_count, 1)
+
+    def test_rejects(self):
+        tokens = {
+            'audience': self.token(aud='someone-else'),
+            'issuer': self.token(iss='https://evil.example.com'),
+            'expired': self.token(exp=int(time.time()) - 60),
+            'signature': self.token(key=rsa_key()),
+            'kid': self.token(kid='unknown'),
+        }
+        for reason, token in tokens.items():
+            with self.subTest(reason), self.assertRaises(jwt.InvalidTokenError):
+                self.verifier.verify(token, 'client-id')
+
+
+class ProviderHTTPTests(TestCase):
+    def setUp(self):
+        isolate_rate_limits(self)
+
+    def test_full_host_fails_fast(self):
+        client = ProviderHTTPClient(connect_timeout=0.01, max_per_host=1)
+        _, slots = client._host('example.com')
+        slots.acquire()
+
+        with self.assertRaises(ProviderBusyError):
+            client.get('github', 'https://example.com/user')
+        self.assertEqual(client.stats()['providers']['github']['errors'], 1)
+
+    def test_unavailable_provider_is_a_503(self):
+        for error in (ProviderBusyError(), req.ReadTimeout(), req.ConnectTimeout()):
+            for url in (reverse('github-login'), reverse('github-login-async')):
+                with self.subTest(error=type(error).__name__, url=url), \
+                        mock.patch.object(oauth_http, 'request', side_effect=error):
+                    response = self.client.post(url, {'code': 'abc'}, content_type='application/json')
+
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response['Retry-After'], str(oauth_http.retry_after))
+
+
+    @override_settings(FRONTEND_LOGIN_ERROR_URL='https://app.example.com/login')
+    def test_google_callback_exchanges_the_code_through_the_shared_client(self):
+        session = self.client.session
+        session.update({'google_oauth_state': 'state', 'google_oauth_code_verifier': 'verifier'})
+        session.save()
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'id_token': 'id-token'}
+
+        with mock.patch.object(oauth_http, 'request', return_value=response) as request, \
+                mock.patch('user.views2.GoogleOAuthSerializer') as serializer:
+            serializer.return_value.validated_data = {'is_new_user': False}
+            self.assertEqual(self.client.get(reverse('google-login2-callback'), {'code': 'abc', 'state': 'state'}).status_code, 200)
+
+        provider, method, url = request.call_args.args
+        self.assertEqual((provider, method, url), ('google', 'POST', 'https://oauth2.googleapis.com/token'))
+        self.assertEqual(
+            {key: request.call_args.kwargs['data'][key] for key in ('code', 'code_verifier')},
+            {'code': 'abc', 'code_verifier': 'verifier'},
+        )
+        serializer.assert_called_once_with(data={'id_token': 'id-token'})
+
+        # A callback that doesn't carry the state we sent never reaches Google
+        with mock.patch.object(oauth_http, 'request') as request:
+            self.assertEqual(self.client.get(reverse('google-login2-callback'), {'code': 'abc', 'state': 'forged'}).status_code, 302)
+        request.assert_not_called()
+
+
+class AsyncSocialLoginTests(TestCase):
+    def setUp(self):
+        isolate_rate_limits(self)
+        # Both calls made with the access token must be in flight at once to get past this
+        self.together = threading.Barrier(2, timeout=5)
+
+    def github(self, provider, method, url, **kwargs):
+        if url.endswith('/access_token'):
+            body = {'access_token': 'token'}
+        elif url.endswith('/user'):
+            self.together.wait()
+            body = {'id': 7, 'name': 'Ada Lovelace', 'avatar_url': 'https://example.com/ada.png'}
+        else:
+            self.together.wait()
+            body = [{'email': 'ada@example.com', 'primary': True, 'verified': True}]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = body
+        return response
+
+    def login(self):
+        with mock.patch.object(oauth_http, 'request', side_effect=self.github):
+            return self.client.post(reverse('github-login-async'), {'code': 'abc'}, content_type='application/json')
+
+    def test_signup_fetches_profile_and_emails_concurrently(self):
+        response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_new_user'])
+        self.assertIn('access', response.json()['tokens'])
+        user = User.objects.get(email='ada@example.com')
+        self.assertEqual((user.first_name, user.last_name, user.provider), ('Ada', 'Lovelace', AuthProvider.GITHUB))
+        # The avatar is left to the job worker
+        self.assertEqual(Job.objects.get().name, 'import_avatar')
+
+    def test_second_login_is_not_new(self):
+        self.login()
+        self.together.reset()
+        response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_new_user'])
+
+    def test_sync_login_makes_the_same_calls_in_turn(self):
+        # No barrier: the sync login makes one call at a time
+        self.together = mock.Mock()
+        with mock.patch.object(oauth_http, 'request', side_effect=self.github) as request:
+            response = self.client.post(reverse('github-login'), {'code': 'abc'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_new_user'])
+        self.assertEqual(
+            [call.args[2] for call in request.call_args_list],
+            ['https://github.com/login/oauth/access_token', 'https://api.github.com/user', 'https://api.github.com/user/emails'],
+        )
+        self.assertEqual(User.objects.get().provider, AuthProvider.GITHUB)
+
+    def test_sync_and_async_logins_share_the_profile_checks(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'id': '7', 'first_name': 'Ada'}
+
+        for url in (reverse('facebook-login'), reverse('facebook-login-async')):
+            with self.subTest(url=url), mock.patch.object(oauth_http, 'request', return_value=response) as request:
+                login = self.client.post(url, {'access_token': 'token'}, content_type='application/json')
+
+                self.assertEqual(login.status_code, 400)
+                self.assertEqual(
+                    login.json()['non_field_errors'],
+                    ['Facebook account has no email. Please try another login method'],
+                )
+                self.assertEqual(request.call_args.kwargs['params']['access_token'], 'token')
+        self.assertFalse(User.objects.exists())
+
+    def test_email_account_cannot_log_in_with_github(self):
+        make_user(email='ada@example.com')
+        response = self.login()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Job.objects.count(), 0)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tied = timezone.now()
+        cls.users = [make_user(total_spent=n % 3) for n in range(10)]
+        # Ties on the ordering column, broken by id
+        User.objects.filter(pk__in=[user.pk for user in cls.users[:6]]).update(created_at=tied)
+
+    def walk(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            ids += [row['id'] for row in pages[-1]['results']]
+            url = pages[-1]['next']
+        return ids, pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for ordering, expected in [
+            ('-created_at', User.objects.order_by('-created_at', '-id')),
+            ('total_spent', User.objects.order_by('total_spent', 'id')),
+            ('email', User.objects.order_by('email')),
+        ]:
+            with self.subTest(ordering):
+                ids, pages = self.walk(f'{reverse("user_list-list")}?page_size=3&ordering={ordering}')
+                self.assertEqual(ids, [str(pk) for pk in expected.values_list('pk', flat=True)])
+                self.assertEqual(len(pages), 4)
+                self.assertNotIn('count', pages[0])
+
+    def test_previous_returns_the_page_before(self):
+        _, pages = self.walk(f'{reverse("user_list-list")}?page_size=3')
+        back = self.client.get(pages[2]['previous']).json()
+
+        self.assertEqual(back['results'], pages[1]['results'])
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_cursor_is_tied_to_its_ordering(self):
+        first = self.client.get(f'{reverse("user_list-list")}?page_size=3').json()
+        cursor = first['next'].split('cursor=')[1].split('&')[0]
+
+        response = self.client.get(f'{reverse("user_list-list")}?ordering=email&cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(f'{reverse("user_list-list")}?cursor=garbage').status_code, 404)
+
+    def test_page_numbers_fall_back_to_counted_pages(self):
+        response = self.client.get(f'{reverse("user_list-list")}?page=1').json()
+        self.assertEqual((response['count'], response['count_exact']), (10, True))
+        self.assertEqual(len(response['results']), 10)
+
+
+class UserListIndexTests(TestCase):
+    def test_no_filter_and_ordering_scans_the_table(self):
+        out = StringIO()
+        # --strict fails on any full table scan
+        call_command('explain_user_list', strict=True, stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.board = SpendLeaderboard()
+        patcher = mock.patch('user.signals.leaderboard', self.board)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ranks_follow_spend_with_ties(self):
+        users = [make_user(total_spent=spent) for spent in (50, 80, 80, 10)]
+        top = self.board.top(10)
+
+        self.assertEqual([entry['total_spent'] for entry in top], [80, 80, 50, 10])
+        self.assertEqual([entry['rank'] for entry in top], [1, 1, 3, 4])
+        rank = self.board.rank(users[3].pk)
+        self.assertEqual((rank['rank'], rank['percentile'], rank['total_users']), (4, 0.0, 4))
+        window = self.board.neighbours(users[0].pk, 1)
+        self.assertEqual([entry['id'] for entry in window['above']], [top[1]['id']])
+        self.assertEqual(window['below'][0]['id'], users[3].pk)
+
+    def test_saves_and_deletes_apply_without_a_rebuild(self):
+        user, other = make_user(total_spent=10), make_user(total_spent=20)
+        self.board.top(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.total_spent = 30
+            user.save()
+        self.assertEqual(self.board.top(1)[0]['id'], user.pk)
+
+        # Loaded without its spend: the old entry is found from the id
+        with self.captureOnCommitCallbacks(execute=True):
+            deferred = User.objects.only('id').get(pk=other.pk)
+            deferred.total_spent = 40
+            deferred.save(update_fields=['total_spent'])
+        self.assertEqual([entry['total_spent'] for entry in self.board.top(10)], [40, 30])
+
+        # The callbacks run after delete() has cleared the instance's pk
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual([entry['id'] for entry in self.board.top(10)], [other.pk])
+        self.assertEqual(self.board.rebuilds, 1)
+
+    def test_changes_during_a_build_are_replayed(self):
+        user = make_user(total_spent=10)
+        values_list = User.objects.values_list
+
+        def read_then_change(*args, **kwargs):
+            rows = list(values_list(*args, **kwargs))
+            # Committed after the build read the row: replayed over the result
+            self.board.update(user.pk, 99)
+            return mock.Mock(iterator=lambda chunk_size: iter(rows))
+
+        with mock.patch.object(User.objects, 'values_list', side_effect=read_then_change):
+            self.board.rebuild()
+        self.assertEqual(self.board.top(1)[0]['total_spent'], 99)
+        self.assertEqual(self.board.stats()['users'], 1)
+
+    def test_a_stale_ranking_is_served_while_it_rebuilds_in_the_background(self):
+        user = make_user(total_spent=10)
+        self.board.top(1)
+        User.objects.filter(pk=user.pk).update(total_spent=50)
+        self.board.invalidate()
+
+        with mock.patch.object(self.board, 'warm') as warm:
+            self.assertEqual(self.board.top(1)[0]['total_spent'], 10)
+        warm.assert_called_once_with()
+        self.assertEqual(self.board.rebuilds, 1)
+
+    def test_an_unranked_user_starts_a_background_build(self):
+        self.board.top(1)
+        user = make_user(total_spent=10)
+
+        with mock.patch.object(self.board, 'warm') as warm:
+            self.assertIsNone(self.board.rank(user.pk))
+            warm.assert_called_once_with()
+            # An id nobody has does not
+            self.assertIsNone(self.board.rank(uuid.uuid4()))
+            warm.assert_called_once_with()
+        self.assertEqual(self.board.rebuilds, 1)
+
+
+class CountStrategyTests(TestCase):
+    def setUp(self):
+        for gender in ('male', 'male', 'female'):
+            make_user(gender=gender)
+
+    def test_small_tables_count_exactly_every_time(self):
+        strategy = CountStrategy(exact_below=100)
+        self.assertEqual(strategy.count(User.objects.filter(gender='male')), (2, True))
+        make_user(gender='male')
+        self.assertEqual(strategy.count(User.objects.filter(gender='male')), (3, True))
+
+    def test_bigger_tables_cache_per_filter_until_a_row_is_added(self):
+        strategy = CountStrategy(exact_below=0)
+        males = User.objects.filter(gender='male')
+        self.assertEqual(strategy.count(males), (2, True))
+        self.assertEqual(strategy.count(User.objects.filter(gender='female')), (1, True))
+
+        User.objects.filter(gender='female').update(gender='male')
+        self.assertEqual(strategy.count(males), (2, True))
+        self.assertEqual(strategy.stats()['hits'], 1)
+
+        strategy.invalidate(User)
+        self.assertEqual(strategy.count(males), (3, True))
+
+    def test_creates_and_deletes_invalidate_the_shared_strategy(self):
+        with mock.patch.multiple(counts, exact_below=0):
+            counts.invalidate(User)
+            self.assertEqual(counts.count(User.objects.all()), (3, True))
+            with self.captureOnCommitCallbacks(execute=True):
+                make_user()
+            self.assertEqual(counts.count(User.objects.all()), (4, True))
+
+    def test_huge_unfiltered_tables_use_the_table_size(self):
+        strategy = CountStrategy(exact_below=0, estimate_above=1)
+        self.assertEqual(strategy.count(User.objects.all()), (3, False))
+        # SQLite has no estimate for a filtered query
+        self.assertEqual(strategy.count(User.objects.filter(gender='male')), (2, True))
+
+
+    def test_sqlite_table_size_is_an_upper_bound(self):
+        make_user()
+        User.objects.filter(gender='female').delete()
+        # Deleted rows below the newest one still count
+        self.assertEqual(CountStrategy().table_size(User, 'default'), 4)
+        self.assertEqual(User.objects.count(), 3)
+
+
+class ValuesConverterTests(TestCase):
+    def test_rows_convert_to_the_serializer_output(self):
+        request = Request(APIRequestFactory().get('/'))
+        users = [
+            make_user(
+                first_name='Rahim', last_name='Khan', phone_number='+8801712345678', gender='male',
+                profile_picture='dps/rahim.png', bio='Hi', street='1 Road', city='Dhaka', zip_code=1207,
+                country='BD', total_spent=12.5,
+                profile_picture_variants={'source': 'dps/rahim.png', '48': {'webp': 'dps/rahim_48.webp'}},
+            ),
+            # Nulls and defaults everywhere
+            make_user(),
+        ]
+        for serializer_class in (UserListSerializer, UserProfileSerializer, UserAddressSerializer, UserStatsSerializer):
+            converter = ValuesConverter(serializer_class)
+            for user in users:
+                with self.subTest(serializer_class.__name__, user=user.email):
+                    row = User.objects.values(*converter.columns).get(pk=user.pk)
+                    expected = serializer_class(User.objects.get(pk=user.pk), context={'request': request}).data
+                    self.assertEqual(converter.convert(row, request), expected)
+
+    def test_list_endpoint_matches_the_serializer(self):
+        user = make_user(first_name='Ada', total_spent=3)
+        response = self.client.get(reverse('user_list-detail', args=[user.pk]))
+
+        request = response.wsgi_request
+        self.assertEqual(response.json(), UserListSerializer(user, context={'request': request}).data)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.user = make_user(first_name='Ada', phone_number='+8801712345678')
+
+    def test_fields_narrow_the_response_and_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{reverse("user_list-list")}?fields=id,email')
+
+        self.assertEqual(response.json()['results'], [{'id': str(self.user.pk), 'email': self.user.email}])
+        select = next(query['sql'] for query in queries.captured_queries if 'FROM "user_user"' in query['sql'])
+        self.assertNotIn('phone_number', select)
+
+    def test_exclude(self):
+        response = self.client.get(reverse('user_list-detail', args=[self.user.pk]), {'exclude': 'phone_number,email'})
+        self.assertNotIn('phone_number', response.json())
+        self.assertEqual(response.json()['first_name'], 'Ada')
+
+    def test_unknown_or_empty_selections_are_rejected(self):
+        url = reverse('user_list-list')
+        self.assertIn('fields', self.client.get(url, {'fields': 'id,password'}).json())
+        self.assertEqual(self.client.get(url, {'fields': 'id', 'exclude': 'id'}).status_code, 400)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        self.user = make_user(first_name='Ada')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_profile_is_a_304(self):
+        url = reverse('profile', args=[self.user.pk])
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.user.first_name = 'Grace'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_the_fields_asked_for(self):
+        url = reverse('profile', args=[self.user.pk])
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(url, {'fields': 'id'})['ETag'])
+
+    def test_my_unchanged_profile_is_a_304_without_loading_the_row(self):
+        url = reverse('me')
+        etag = self.client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('first_name', queries[0]['sql'])
+
+    def test_stale_if_match_is_a_412(self):
+        url = reverse('me')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.patch(url, {'first_name': 'Grace'}, HTTP_IF_MATCH=etag).status_code, 200)
+
+        response = self.client.patch(url, {'first_name': 'Ada'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Grace')
+
+
+# Stands in for Redis: LocMemCache instances with one LOCATION share their entries
+SHARED_CACHES = {**settings.CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'}}
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return {'loads': self.loads}
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_misses_load_once_then_hit_the_shared_cache(self):
+        user_id = make_user().pk
+        self.assertEqual(ProfileCache(alias='shared').get('profile', user_id, '', self.load), {'loads': 1})
+
+        other_worker = ProfileCache(alias='shared')
+        self.assertEqual(other_worker.get('profile', user_id, '', self.load), {'loads': 1})
+        self.assertEqual((self.loads, other_worker.shared_hits), (1, 1))
+        self.assertTrue(caches['shared'].get(f'user-profile:profile:{user_id}:0:'))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_invalidate_retires_entries_everywhere(self):
+        user_id = make_user().pk
+        other_worker = ProfileCache(alias='shared', local_ttl=0)
+        other_worker.get('profile', user_id, '', self.load)
+
+        ProfileCache(alias='shared').invalidate(user_id)
+        self.assertEqual(other_worker.get('profile', user_id, '', self.load), {'loads': 2})
+
+    def test_without_a_shared_cache_entries_stay_in_the_process(self):
+        self.assertIsNone(profile_cache.alias)
+        user_id = make_user().pk
+        cache, other_worker = ProfileCache(), ProfileCache()
+        cache.get('profile', user_id, '', self.load)
+        self.assertEqual(cache.get('profile', user_id, '', self.load), {'loads': 1})
+        self.assertEqual(other_worker.get('profile', user_id, '', self.load), {'loads': 2})
+
+        cache.invalidate(user_id)
+        self.assertEqual(cache.get('profile', user_id, '', self.load), {'loads': 3})
+        self.assertEqual(cache.stats()['local_hits'], 1)
+
+    def test_delete_invalidates_by_the_deleted_id(self):
+        user = make_user()
+        user_id = user.pk
+        with mock.patch.object(profile_cache, 'invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                user.delete()
+
+        invalidate.assert_called_once_with(user_id)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_repeat_requests_authenticate_without_a_query(self):
+        user = make_user()
+        token = RefreshToken.for_user(user).access_token
+        self.authenticate(token)
+
+        with self.assertNumQueries(0):
+            authenticated, _ = self.authenticate(token)
+        self.assertEqual((authenticated.pk, authenticated.is_active), (user.pk, True))
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticated.email, user.email)
+
+    def test_new_password_revokes_existing_tokens(self):
+        user = make_user()
+        token = RefreshToken.for_user(user).access_token
+        self.authenticate(token)
+
+        user.set_password('a new password')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        with self.assertRaises(AuthenticationFailed) as failure:
+            self.authenticate(token)
+        self.assertEqual(failure.exception.detail['code'], 'token_revoked')
+        self.assertTrue(self.authenticate(RefreshToken.for_user(user).access_token))
+
+    def test_schema_declares_the_bearer_scheme(self):
+        generator = SchemaGenerator(patterns=[path('me/', MyProfileView.as_view())])
+        schema = generator.get_schema(request=None, public=True)
+        self.assertEqual(schema['components']['securitySchemes']['jwtAuth']['scheme'], 'bearer')
+        self.assertIn({'jwtAuth': []}, schema['paths']['/me/']['get']['security'])
+
+    def test_delete_drops_the_snapshot_by_the_deleted_id(self):
+        user = make_user()
+        user_id = user.pk
+        with mock.patch.object(user_snapshots, 'invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                user.delete()
+
+        self.assertEqual(invalidate.call_args_list, [mock.call(user_id), mock.call(user_id)])
+
+
+class RevocationStoreTests(TestCase):
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add(f'in-{n}')
+
+        self.assertTrue(all(f'in-{n}' in bloom for n in range(1000)))
+        false_positives = sum(f'out-{n}' in bloom for n in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    def test_unrevoked_tokens_are_answered_without_a_query(self):
+        store = RevocationStore(min_capacity=100)
+        store.revoke('revoked', time.time() + 3600)
+        store.is_revoked('warm-up')
+
+        with self.assertNumQueries(0):
+            self.assertFalse(store.is_revoked('never-revoked'))
+        self.assertTrue(store.is_revoked('revoked'))
+
+    def test_other_processes_revocations_are_caught_up(self):
+        store, other_process = RevocationStore(sync_interval=0, min_capacity=100), RevocationStore(min_capacity=100)
+        self.assertFalse(store.is_revoked('jti'))
+
+        other_process.revoke('jti', time.time() + 3600)
+        self.assertTrue(store.is_revoked('jti'))
+        self.assertEqual(store.rebuilds, 1)
+
+    def test_purge_keeps_live_buckets(self):
+        store = RevocationStore(min_capacity=100)
+        store.revoke('expired', time.time() - 2 * RevocationStore.bucket_seconds)
+        store.revoke('live', time.time() + 60)
+
+        self.assertEqual(store.purge(), 1)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+
+    def test_blacklisted_refresh_tokens_fail_verification(self):
+        token = RefreshToken.for_user(make_user())
+        token.blacklist()
+
+        with self.assertRaises(TokenError):
+            RefreshToken(str(token))
+
+
+class HashingExecutorTests(TestCase):
+    def test_full_pool_fails_fast(self):
+        pool = HashingExecutor(max_workers=1, max_queue=1, retry_after=3)
+        release = threading.Event()
+        running = [pool.submit(release.wait), pool.submit(release.wait)]
+
+        with self.assertRaises(HashingBusy) as busy:
+            pool.submit(release.wait)
+        self.assertEqual((busy.exception.wait, pool.stats()['rejected']), (3, 1))
+
+        release.set()
+        for future in running:
+            future.result(timeout=5)
+        self.assertTrue(pool.run(lambda: True))
+
+    def test_no_workers_hashes_inline(self):
+        pool = HashingExecutor(max_workers=0)
+        self.assertIs(pool.run(threading.current_thread), threading.current_thread())
+
+    def test_hash_upgrades_save_on_the_calling_thread(self):
+        old_hash = PBKDF2PasswordHasher().encode('correct horse', 'salt', iterations=1000)
+        user = make_user(password=old_hash)
+        saved_on = []
+        save = User.save
+
+        def record_thread(instance, *args, **kwargs):
+            saved_on.append(threading.current_thread())
+            return save(instance, *args, **kwargs)
+
+        with mock.patch.object(User, 'save', autospec=True, side_effect=record_thread):
+            self.assertTrue(user.check_password('correct horse'))
+            self.assertEqual(saved_on, [threading.current_thread()])
+            self.assertTrue(async_to_sync(user.acheck_password)('correct horse'))
+            # Upgraded once: the new hash needs nothing more
+            self.assertEqual(len(saved_on), 1)
+
+        user.refresh_from_db()
+        self.assertNotEqual(user.password, old_hash)
+        self.assertTrue(user.check_password('correct horse'))
+        self.assertEqual(user.token_version, 0)
+
+    def test_async_checks_upgrade_off_the_pool(self):
+        user = make_user(password=PBKDF2PasswordHasher().encode('correct horse', 'salt', iterations=1000))
+        with mock.patch.object(User, 'save', autospec=True) as save:
+            self.assertTrue(async_to_sync(user.acheck_password)('correct horse'))
+        save.assert_called_once_with(user, update_fields=['password'])
+        self.assertFalse(async_to_sync(user.acheck_password)('wrong horse'))
+
+    def test_async_signup_is_a_429_while_the_pool_is_full(self):
+        isolate_rate_limits(self)
+        with mock.patch.object(password_hashing, 'arun', side_effect=HashingBusy(wait=3)):
+            response = self.client.post(
+                reverse('signup-async'),
+                {'email': 'ada@example.com', 'password': 'correct horse battery', 'confirm_password': 'correct horse battery'},
+                content_type='application/json',
+            )
+
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '3'))
+        self.assertFalse(User.objects.exists())
+
+
+class IPRateThrottleTests(TestCase):
+    def setUp(self):
+        isolate_rate_limits(self)
+
+    def test_forwarded_for_cannot_dodge_the_limit(self):
+        for peer, url in enumerate([reverse('github-login'), reverse('github-login-async')]):
+            with self.subTest(url=url), mock.patch.object(IPRateThrottle, 'rate', '3/min', create=True), \
+                    mock.patch.object(oauth_http, 'request', side_effect=ProviderBusyError()):
+                statuses = [
+                    self.client.post(url, {'code': 'abc'}, content_type='application/json',
+                                     REMOTE_ADDR=f'192.0.2.{peer}', HTTP_X_FORWARDED_FOR=f'203.0.113.{n}').status_code
+                    for n in range(4)
+                ]
+                self.assertEqual(statuses, [503, 503, 503, 429])
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+    def test_behind_a_proxy_the_client_is_the_last_forwarded_address(self):
+        request = APIRequestFactory().post('/', HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.7', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(IPRateThrottle().get_key(request, None), '203.0.113.7')
+
+
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def run_import(self, name, content, *args):
+        source = os.path.join(self.dir, name)
+        with open(source, 'w') as f:
+            f.write(content)
+        call_command('import_users', source, '--workers=1', '--batch-size=2', *args, stdout=StringIO())
+        rejects = f'{source}.rejects.ndjson'
+        if not os.path.exists(rejects):
+            return {}
+        with open(rejects) as f:
+            return {(reject := json.loads(line))['line']: reject['errors'] for line in f}
+
+    def test_csv_imports_valid_rows_and_rejects_the_rest(self):
+        make_user(email='taken@example.com')
+        rejects = self.run_import('users.csv', (
+            'email,first_name,password,password_hash\n'
+            'Ada@Example.com,Ada,correct horse,\n'
+            'not-an-email,Bad,,\n'
+            'Ada@EXAMPLE.COM,Twice,,\n'
+            'taken@example.com,Taken,,\n'
+            'grace@example.com,Grace,,pbkdf2_sha256$1000$salt$aGFzaA==\n'
+        ))
+
+        self.assertEqual(sorted(rejects), [3, 4, 5])
+        self.assertIn('email', rejects[3])
+        self.assertEqual(rejects[4]['email'], ['Duplicate of an earlier row.'])
+        self.assertEqual(rejects[5]['email'], ['A user with this email already exists.'])
+
+        ada = User.objects.get(email='Ada@example.com')
+        self.assertTrue(ada.check_password('correct horse'))
+        self.assertEqual(User.objects.get(first_name='Grace').password, 'pbkdf2_sha256$1000$salt$aGFzaA==')
+
+    def test_ndjson_rejects_malformed_lines(self):
+        rejects = self.run_import('users.ndjson', (
+            '{"email": "ada@example.com", "is_active": false}\n'
+            '{"email": \n'
+            '["ada"]\n'
+        ))
+
+        self.assertEqual(sorted(rejects), [2, 3])
+        self.assertFalse(User.objects.get(email='ada@example.com').is_active)
+
+    def test_passwords_are_hashed_before_the_write_transaction(self):
+        savepoints = []
+
+        def hash_passwords(command, raw_passwords):
+            savepoints.append(len(connection.savepoint_ids))
+            return [make_password(password) for password in raw_passwords]
+
+        depth = len(connection.savepoint_ids)
+        with mock.patch.object(ImportUsers, 'hash_passwords', hash_passwords):
+            self.run_import('users.csv', 'email,password\nada@example.com,a\ngrace@example.com,b\nalan@example.com,c\n')
+        self.assertEqual(savepoints, [depth, depth])
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_unknown_csv_columns_stop_the_import(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown CSV column(s): nickname'):
+            self.run_import('users.csv', 'email,nickname\nada@example.com,ada\n')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(first_name=name) for name in ('Ada', 'Grace', 'Alan')]
+        self.client = APIClient()
+        self.client.force_authenticate(make_user(is_staff=True))
+        self.url = reverse('user_list-export')
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_rows_match_the_serializer_in_update_order(self):
+        response = self.client.get(self.url, {'output': 'ndjson'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        context = {'request': response.wsgi_request}
+        expected = [UserListSerializer(user, context=context).data for user in User.objects.order_by('updated_at', 'id')]
+        self.assertEqual(rows, json.loads(json.dumps(expected, default=str)))
+
+    def test_csv_with_filters(self):
+        since = timezone.now()
+        self.users[0].save()
+
+        lines = self.content(self.client.get(self.url, {'since': since.isoformat()})).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('id,'))
+        self.assertIn('Ada', lines[1])
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, 400)
+
+    def test_rows_are_sent_in_chunks(self):
+        chunks = list(export_chunks(export_queryset(User.objects.all()), 'ndjson', chunk_size=2))
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [2, 2])
+
+    def test_admins_only(self):
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class RetryOnLockTests(SimpleTestCase):
+    def test_lock_errors_are_retried(self):
+        retries = retry.stats()['retries']
+        self.assertEqual(retry_on_lock(locked_for(2), delay=0)(), 3)
+        self.assertEqual(retry.stats()['retries'], retries + 2)
+
+    def test_gives_up_after_the_last_attempt(self):
+        gave_up = retry.stats()['gave_up']
+        with self.assertRaises(OperationalError):
+            retry_on_lock(locked_for(4), attempts=4, delay=0)()
+        self.assertEqual(retry.stats()['gave_up'], gave_up + 1)
+
+    def test_coroutines(self):
+        flaky = locked_for(1)
+
+        async def save():
+            return flaky()
+        self.assertEqual(async_to_sync(retry_on_lock(save, delay=0))(), 2)
+
+    def test_other_errors_are_not_retried(self):
+        def fail():
+            raise OperationalError('no such table: user_user')
+
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            retry_on_lock(fail, delay=0)()
+
+
+class RetryInTransactionTests(TestCase):
+    def test_nothing_is_retried_inside_a_transaction(self):
+        save = locked_for(1)
+        with self.assertRaises(OperationalError):
+            retry_on_lock(save, delay=0)()
+
+
+class ReplicaRoutingTests(TestCase):
+    def test_reads_leave_a_lagging_or_missing_replica(self):
+        monitor = ReplicaMonitor(max_lag=10, check_interval=0)
+        for lag, alias in ((3, 'replica'), (30, 'default'), (None, 'default')):
+            with self.subTest(lag=lag), mock.patch.object(monitor, '_check', return_value=lag):
+                self.assertEqual(monitor.route_read(), alias)
+
+    def test_written_users_read_from_the_primary(self):
+        user, written, viewer = make_user(), make_user(), make_user()
+        replica.pin(written.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(viewer)
+
+        with mock.patch.object(replica, 'available', return_value=True), \
+                mock.patch.object(replica, 'route_read', return_value='default') as route_read:
+            self.client.get(reverse('profile', args=[user.pk]))
+            self.assertTrue(route_read.called)
+
+            route_read.reset_mock()
+            pinned_requests = replica.pinned_requests
+            self.client.get(reverse('profile', args=[written.pk]))
+            self.assertFalse(route_read.called)
+            self.assertEqual(replica.pinned_requests, pinned_requests + 1)
+
+    def test_refresh_copies_a_snapshot_and_swaps_it_in(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        source_name, target_name = os.path.join(path, 'primary.sqlite3'), os.path.join(path, 'replica.sqlite3')
+        with sqlite3.connect(source_name) as source:
+            source.execute('PRAGMA journal_mode=WAL')
+            source.execute('CREATE TABLE t (name TEXT)')
+            source.executemany('INSERT INTO t VALUES (?)', [('a',), ('b',), ('c',)])
+            source.execute("DELETE FROM t WHERE name = 'a'")
+        RefreshReplica().copy(source_name, target_name)
+
+        reader = sqlite3.connect(target_name)
+        self.addCleanup(reader.close)
+        reader.execute('BEGIN')
+        self.assertEqual(reader.execute('SELECT rowid, name FROM t').fetchall(), [(2, 'b'), (3, 'c')])
+        self.assertEqual(reader.execute('PRAGMA journal_mode').fetchone(), ('delete',))
+
+        with sqlite3.connect(source_name) as source:
+            source.execute("INSERT INTO t VALUES ('d')")
+        RefreshReplica().copy(source_name, target_name)
+        # An open read keeps its copy; the next one sees the new one
+        self.assertEqual(reader.execute('SELECT count(*) FROM t').fetchone(), (2,))
+        reader.execute('COMMIT')
+        with sqlite3.connect(target_name) as fresh:
+            self.assertEqual(fresh.execute('SELECT count(*) FROM t').fetchone(), (3,))
+        self.assertEqual([name for name in os.listdir(path) if name.startswith('replica')], ['replica.sqlite3'])
+
+    def test_replica_connections_reopen_on_the_refreshed_copy(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        source_name, target_name = os.path.join(path, 'primary.sqlite3'), os.path.join(path, 'replica.sqlite3')
+        with sqlite3.connect(source_name) as source:
+            source.execute('CREATE TABLE t (name TEXT)')
+            source.execute("INSERT INTO t VALUES ('a')")
+        RefreshReplica().copy(source_name, target_name)
+
+        # A connection configured like the replica's, on the temporary copy
+        connection = SQLiteDatabaseWrapper({**settings.DATABASES['replica'], 'NAME': target_name}, alias='replica-copy')
+        self.addCleanup(connection.close)
+        connection.close_if_unusable_or_obsolete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM t')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+        with sqlite3.connect(source_name) as source:
+            source.execute("INSERT INTO t VALUES ('b')")
+        RefreshReplica().copy(source_name, target_name)
+
+        # What the end of a request does: the next one opens the new file
+        connection.close_if_unusable_or_obsolete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM t')
+            self.assertEqual(cursor.fetchone(), (2,))
+
+    def test_delete_pins_the_deleted_id(self):
+        user = make_user()
+        user_id = user.pk
+        with mock.patch.object(replica, 'pin') as pin:
+            with self.captureOnCommitCallbacks(execute=True):
+                user.delete()
+
+        pin.assert_called_once_with(user_id)
+
+
+class SpendRollupTests(TestCase):
+    def ground_truth(self, **segment):
+        users = User.objects.filter(**segment)
+        spend = list(users.values_list('total_spent', flat=True))
+        return len(spend), sum(spend), min(spend, default=None), max(spend, default=None)
+
+    def summary(self, **segment):
+        rollup = spend_rollups.get(**segment)
+        return rollup['count'], rollup['total'], rollup['min'], rollup['max']
+
+    def assertMatchesUsers(self, rollup, **users_in):
+        count, total, low, high = self.ground_truth(**users_in)
+        summary = spend_rollups.get(**rollup)
+        self.assertEqual((summary['count'], summary['total']), (count, total))
+        # Bounds re-derived from the sketch are within alpha
+        delta = 0 if summary['bounds_exact'] else high * spend_rollups.alpha
+        self.assertAlmostEqual(summary['min'], low, delta=delta)
+        self.assertAlmostEqual(summary['max'], high, delta=delta)
+
+    def test_saves_and_deletes_keep_every_segment_exact(self):
+        spends = [5, 10, 20, 40, 80, 160]
+        users = [
+            make_user(country='BD', city=city, gender=gender, total_spent=spend)
+            for spend, (city, gender) in zip(spends, itertools.cycle([('Dhaka', 'female'), ('Sylhet', 'male'), ('Dhaka', 'male')]))
+        ]
+        users[1].total_spent = 300
+        users[1].save()
+        users[2].city = 'Sylhet'
+        users[2].save(update_fields=['city'])
+        users[4].delete()
+
+        segments = [
+            ({}, {}), ({'country': 'BD'}, {'country': 'BD'}),
+            ({'city': 'Dhaka'}, {'country': 'BD', 'city': 'Dhaka'}),
+            ({'city': 'Sylhet', 'gender': 'male'}, {'country': 'BD', 'city': 'Sylhet', 'gender': 'male'}),
+            ({'gender': 'female'}, {'gender': 'female'}),
+        ]
+        for users_in, rollup in segments:
+            with self.subTest(rollup=rollup):
+                self.assertMatchesUsers(rollup, **users_in)
+
+        spend_rollups.rebuild()
+        for users_in, rollup in segments:
+            self.assertTrue(spend_rollups.get(**rollup)['bounds_exact'])
+            self.assertEqual(self.summary(**rollup), self.ground_truth(**users_in))
+
+    def test_losing_the_lowest_spender_rederives_min_within_alpha(self):
+        lowest = make_user(country='BD', total_spent=1)
+        make_user(country='BD', total_spent=50)
+        make_user(country='BD', total_spent=7)
+        lowest.delete()
+
+        rollup = spend_rollups.get(country='BD')
+        self.assertFalse(rollup['bounds_exact'])
+        self.assertAlmostEqual(rollup['min'], 7, delta=7 * spend_rollups.alpha)
+        self.assertAlmostEqual(rollup['max'], 50, delta=50 * spend_rollups.alpha)
+
+    def test_rolled_back_saves_leave_the_rollups_alone(self):
+        make_user(country='BD', total_spent=10)
+        with self.assertRaises(ValueError), transaction.atomic():
+            make_user(country='BD', total_spent=99)
+            raise ValueError
+        self.assertEqual(self.summary(country='BD'), (1, 10, 10, 10))
+
+    def test_a_failed_rollup_change_rolls_back_the_user(self):
+        user = User(email='ada@example.com', password='!', country='BD', total_spent=10)
+        with mock.patch.object(spend_rollups, 'apply', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                user.save()
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+
+        # Saved again, as retry_on_lock would: inserted and counted
+        user.save()
+        self.assertEqual(self.summary(country='BD'), (1, 10, 10, 10))
+
+    def test_migrate_builds_missing_rollups(self):
+        make_user(country='BD', total_spent=10)
+        SpendRollup.objects.all().delete()
+
+        build_spend_rollups(apps.get_app_config('user'), using='default')
+        self.assertEqual(self.summary(country='BD'), (1, 10, 10, 10))
+
+
+class UserSearchTests(TestCase):
+    def search(self, text):
+        return list(search_queryset(User.objects.all(), text).order_by('search_rank', 'id').values_list('first_name', flat=True))
+
+    def test_names_rank_above_cities_and_the_last_word_is_a_prefix(self):
+        make_user(first_name='Dhaka', last_name='Rahman')
+        make_user(first_name='Rahim', city='Dhaka')
+        make_user(first_name='Karim', city='Sylhet')
+
+        self.assertEqual(self.search('dhaka'), ['Dhaka', 'Rahim'])
+        self.assertCountEqual(self.search('rah'), ['Dhaka', 'Rahim'])
+        self.assertEqual(self.search('dhaka rahi'), ['Rahim'])
+        self.assertEqual(self.search('"*) OR'), [])
+
+    def test_list_endpoint_orders_by_relevance(self):
+        make_user(first_name='Rahim', city='Dhaka')
+        make_user(first_name='Dhaka')
+        response = self.client.get(reverse('user_list-list'), {'search': 'dhaka'})
+        self.assertEqual([user['first_name'] for user in response.json()['results']], ['Dhaka', 'Rahim'])
+
+    def test_triggers_follow_every_write(self):
+        user = make_user(first_name='Rahim')
+        user.first_name = 'Karim'
+        user.save()
+        self.assertEqual((self.search('rahim'), self.search('karim')), ([], ['Karim']))
+
+        User.objects.filter(pk=user.pk).update(city='Sylhet')
+        self.assertEqual(self.search('sylhet'), ['Karim'])
+        user.delete()
+        self.assertEqual(self.search('karim'), [])
+
+    def test_rebuild_restores_dropped_triggers_and_reindexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {SEARCH_TABLE}_insert')
+        make_user(first_name='Rahim')
+        self.assertEqual(missing_search_triggers(connection), [f'{SEARCH_TABLE}_insert'])
+        self.assertEqual(self.search('rahim'), [])
+
+        call_command('reindex_user_search', stdout=StringIO())
+        self.assertEqual(missing_search_triggers(connection), [])
+        self.assertEqual(self.search('rahim'), ['Rahim'])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.index = AutocompleteIndex()
+        patcher = mock.patch('user.signals.autocomplete', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entries(self, prefix):
+        return [(entry['first_name'], entry['last_name']) for entry in self.index.lookup(prefix, limit=50)]
+
+    def test_lookup_matches_a_scan(self):
+        names = ['Rahim', 'Rahima', 'Karim', 'Ruhul', 'Rana', 'Anika']
+        for first, last in itertools.product(names, names[:3]):
+            make_user(first_name=first, last_name=last, email=f'{first}.{last}@example.com'.lower())
+        make_user(first_name='Rahim', last_name='Inactive', is_active=False)
+
+        for prefix in ('r', 'ra', 'rahim', 'rahim k', 'karim', 'ka', 'rahim.', 'z'):
+            with self.subTest(prefix=prefix):
+                expected = {
+                    user.pk for user in User.objects.filter(is_active=True)
+                    if any(text.startswith(prefix) for text in (
+                        f'{user.first_name} {user.last_name}'.lower(), user.last_name.lower(), user.email.lower(),
+                    ))
+                }
+                self.assertEqual({entry['id'] for entry in self.index.lookup(prefix, limit=50)}, expected)
+
+    def test_a_rename_replayed_over_a_build_leaves_one_entry(self):
+        user = make_user(first_name='Rahim', last_name='Khan')
+        old, new = ('Rahim', 'Khan', user.email), ('Karim', 'Khan', user.email)
+        User.objects.filter(pk=user.pk).update(first_name='Karim')
+        self.index.rebuild()
+
+        # The rename committed while the build was reading the table
+        self.index._apply(user.pk, old, new)
+        self.assertEqual(self.entries('karim'), [('Karim', 'Khan')])
+        self.assertEqual(self.entries('rahim'), [])
+        self.assertEqual([len(positions) for positions in self.index._sorted.values()], [1, 1, 1])
+
+    def test_a_failed_build_stops_queueing_changes(self):
+        with mock.patch.object(User.objects, 'filter', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.index.rebuild()
+
+        self.index.update(uuid.uuid4(), None, ('Ada', 'Lovelace', 'ada@example.com'))
+        self.assertEqual(self.index._pending, [])
+        self.assertEqual(self.index.stats()['rebuilds'], 0)
+
+    def test_saves_and_deletes_apply_as_they_commit(self):
+        user = make_user(first_name='Rahim', last_name='Khan')
+        self.index.rebuild()
+
+        user.first_name = 'Karim'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.entries('kha'), [('Karim', 'Khan')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(self.entries('kha'), [])
+        self.assertEqual(self.index.stats()['users'], 0)
+
+    def test_endpoint_needs_a_login(self):
+        url = reverse('user_list-autocomplete')
+        self.assertEqual(self.client.get(url, {'q': 'ra'}).status_code, 401)
+
+        client = APIClient()
+        client.force_authenticate(make_user(first_name='Rahim'))
+        with mock.patch('user.views.autocomplete_index', self.index):
+            self.assertEqual([entry['first_name'] for entry in client.get(url, {'q': 'ra'}).json()], ['Rahim'])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        handlers = mock.patch.dict(jobs.HANDLERS, {'record': lambda **payload: self.calls.append(payload)})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def test_enqueue_refreshes_the_pending_job(self):
+        jobs.enqueue('record', {'n': 1}, dedup_key='k')
+        jobs.enqueue('record', {'n': 2}, dedup_key='k')
+
+        job = Job.objects.get()
+        self.assertEqual(job.payload, {'n': 2})
+        self.assertEqual(job.status, JobStatus.PENDING)
+
+    def test_enqueue_while_running_queues_behind_the_run(self):
+        jobs.enqueue('record', {'n': 1}, dedup_key='k')
+        [running] = jobs.claim(10)
+
+        jobs.enqueue('record', {'n': 2}, dedup_key='k')
+        self.assertEqual(Job.objects.filter(status=JobStatus.PENDING).count(), 1)
+        # Not claimed while its predecessor still runs
+        self.assertEqual(jobs.claim(10), [])
+
+        jobs.run(running)
+        jobs.run_pending()
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 2}])
+
+    def test_failed_run_gives_way_to_a_newer_pending_job(self):
+        jobs.HANDLERS['fail'] = mock.Mock(side_effect=RuntimeError('boom'))
+        jobs.enqueue('fail', {}, dedup_key='k')
+        [running] = jobs.claim(10)
+        jobs.enqueue('record', {'n': 2}, dedup_key='k')
+
+        with self.assertLogs('user.jobs', 'WARNING'):
+            self.assertEqual(jobs.run(running).status, JobStatus.FAILED)
+        self.assertEqual(Job.objects.get(status=JobStatus.PENDING).payload, {'n': 2})
+
+    def test_requeue_stale(self):
+        jobs.enqueue('record', {'n': 1}, dedup_key='a')
+        jobs.enqueue('record', {'n': 1}, dedup_key='b')
+        jobs.claim(10)
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        jobs.enqueue('record', {'n': 2}, dedup_key='b')
+
+        self.assertEqual(jobs.requeue_stale(60), 1)
+        statuses = dict(Job.objects.filter(payload={'n': 1}).values_list('dedup_key', 'status'))
+        self.assertEqual(statuses, {'a': JobStatus.PENDING, 'b': JobStatus.FAILED})
+
+
+class PictureVariantsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, user, name, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile_picture.save(name, image_file(color), save=False)
+            user.save()
+
+    def test_upload_gets_variants(self):
+        user = make_user()
+        self.upload(user, 'a.png', 'red')
+        jobs.run_pending()
+
+        user.refresh_from_db()
+        variants = user.profile_picture_variants
+        self.assertEqual(variants['source'], user.profile_picture.name)
+        self.assertEqual(set(variants), {'source', '48', '128', '512'})
+        self.assertTrue(user.profile_picture.storage.exists(variants['48']['webp']))
+
+    def test_reupload_during_a_run_gets_variants(self):
+        user = make_user()
+        self.upload(user, 'a.png', 'red')
+        [running] = jobs.claim(10)
+        build_variants = images.build_variants
+        built = []
+
+        def reupload_then_build(storage, name):
+            # The user replaces the picture while the first job is resizing it
+            self.upload(User.objects.get(pk=user.pk), 'b.png', 'blue')
+            built.append(build_variants(storage, name))
+            return built[-1]
+
+        with mock.patch.object(images, 'build_variants', side_effect=reupload_then_build):
+            jobs.run(running)
+        jobs.run_pending()
+
+        user.refresh_from_db()
+        storage = user.profile_picture.storage
+        self.assertTrue(user.profile_picture.name.startswith('dps/b'))
+        self.assertEqual(user.profile_picture_variants['source'], user.profile_picture.name)
+        self.assertTrue(storage.exists(user.profile_picture_variants['512']['jpeg']))
+        # The superseded run removes what it made for the old picture
+        self.assertFalse(storage.exists(built[0]['512']['jpeg']))
@@ -0,0 +1,41 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .revocation import revocations
+
+
+TOKEN_VERSION_CLAIM = 'token_version'
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    simplejwt's RefreshToken plus the user's `token_version`. Access tokens
+    made from it copy the claim, and CachedJWTAuthentication rejects a
+    token whose version is behind the user's.
+
+    Blacklisting goes to the revocation store instead of simplejwt's
+    token_blacklist app, and every verified token is checked against it.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+    def verify(self, *args, **kwargs):
+        self.check_blacklist()
+        super().verify(*args, **kwargs)
+
+    def check_blacklist(self):
+        if revocations.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        revocations.revoke(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    def outstand(self):
+        # Only revoked tokens are stored, not every token issued
+        return None
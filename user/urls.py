@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.urls import path, include
 from .views import *
 from .views2 import *
+from .async_views import AsyncLoginView, AsyncSignupView, AsyncSocialLoginView
+from .models import AuthProvider
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -32,11 +34,22 @@ urlpatterns = [
     path('auth/linkedin2/login/', LinkedInLoginRedirectView.as_view(), name='linkedin-login2'),
     path('auth/linkedin2/callback/', LinkedInOAuthCallbackView.as_view(), name='linkedin-login2-callback'),
     
+    # Async OAuth2 logins (same request/response as above, run natively under ASGI)
+    path('auth/google/async/', AsyncSocialLoginView.as_view(provider=AuthProvider.GOOGLE), name='google-login-async'),
+    path('auth/apple/async/', AsyncSocialLoginView.as_view(provider=AuthProvider.APPLE), name='apple-login-async'),
+    path('auth/github/async/', AsyncSocialLoginView.as_view(provider=AuthProvider.GITHUB), name='github-login-async'),
+    path('auth/facebook/async/', AsyncSocialLoginView.as_view(provider=AuthProvider.FACEBOOK), name='facebook-login-async'),
+    path('auth/linkedin/async/', AsyncSocialLoginView.as_view(provider=AuthProvider.LINKEDIN), name='linkedin-login-async'),
+    
     # User endpoints
     path('signup/', UserSignupView.as_view(), name='signup'),
     path('login/', UserLoginView.as_view(), name='login'),
+    path('signup/async/', AsyncSignupView.as_view(), name='signup-async'),
+    path('login/async/', AsyncLoginView.as_view(), name='login-async'),
     path('logout/', UserLogoutView.as_view(), name='logout'),
     path('me/', MyProfileView.as_view(), name='me'),
     path('profile/<uuid:id>/', PublicProfileView.as_view(), name='profile'),
-    path('addr/<uuid:id>/', PublicAddressView.as_view(), name='address')
+    path('addr/<uuid:id>/', PublicAddressView.as_view(), name='address'),
+    
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
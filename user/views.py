@@ -1,3 +1,5 @@
+import uuid
+
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.generics import RetrieveUpdateDestroyAPIView, RetrieveAPIView
@@ -6,27 +8,96 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
 from django.contrib.auth import login, logout, get_user_model
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from .tokens import RefreshToken
 from .serializers import *
-from drf_spectacular.utils import extend_schema, OpenApiResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import GenericAPIView
+from rest_framework.filters import OrderingFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from . import metrics
+from .authentication import resolve_user
+from .autocomplete import autocomplete as autocomplete_index
+from .leaderboard import leaderboard
+from .oauth_http import ProviderErrorsMixin
+from .pagination import KeysetPagination
+from .conditional import ConditionalRetrieveMixin
+from .fieldsets import SparseFieldsMixin, sparse_fields_parameters
+from .readonly import CachedRetrieveMixin, ValuesReadMixin
+from .export import FORMATS as EXPORT_FORMATS, UserExportFilter, export_queryset, streaming_export
+from .ratelimit import AUTH_THROTTLES, OAUTH_THROTTLES, RateLimitHeadersMixin
+from .replica import ReplicaReadMixin
+from .retry import retry_on_lock
+from .rollups import ANY, spend_rollups
+from .search import UserSearchFilter
+from rest_framework_simplejwt import views as jwt_views
 
 
 User = get_user_model()
 
 
-class UserListViewSet(ReadOnlyModelViewSet):
+@extend_schema_view(
+    list=extend_schema(parameters=sparse_fields_parameters(UserListSerializer)),
+    retrieve=extend_schema(parameters=sparse_fields_parameters(UserListSerializer)),
+)
+class UserListViewSet(ReplicaReadMixin, SparseFieldsMixin, ValuesReadMixin, ReadOnlyModelViewSet):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
     serializer_class = UserListSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter, UserSearchFilter]
     ordering_fields = ["created_at", "updated_at", "email", "first_name", "last_name", "total_spent"]
     filterset_fields = ["is_active", "gender"]
     ordering = ["-created_at"]
     lookup_field = 'id'
     
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('output', str, enum=list(EXPORT_FORMATS), description='csv (default) or ndjson'),
+            OpenApiParameter('is_active', bool),
+            OpenApiParameter('gender', str, enum=[choice for choice, _ in User.GENDER_CHOICES]),
+            OpenApiParameter('since', OpenApiTypes.DATETIME, description='Only rows updated at or after this time.'),
+        ],
+        responses={(200, 'text/csv'): OpenApiTypes.STR, (200, 'application/x-ndjson'): OpenApiTypes.STR},
+        filters=False,
+    )
+    @action(detail=False, permission_classes=[IsAdminUser], pagination_class=None)
+    def export(self, request):
+        # The whole directory in one streamed response, no pages or counts
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': [f'Choose one of: {", ".join(EXPORT_FORMATS)}.']})
+        
+        filterset = UserExportFilter(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        
+        return streaming_export(request, export_queryset(filterset.qs), output, 'users')
+    
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('q', str, required=True, description='Start of a full name, last name or email.'),
+            OpenApiParameter('limit', int, description='Number of users, at most 50.'),
+        ],
+        responses=AutocompleteEntrySerializer(many=True),
+        filters=False,
+    )
+    @action(detail=False, permission_classes=[IsAuthenticated], pagination_class=None, filter_backends=[])
+    def autocomplete(self, request):
+        # From the in-memory index, no database query per keystroke
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 10
+        entries = autocomplete_index.lookup(request.query_params.get('q', ''), limit)
+        return Response(AutocompleteEntrySerializer(entries, many=True).data, status=status.HTTP_200_OK)
+    
  
-class UserSignupView(APIView):
+class UserSignupView(RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = AUTH_THROTTLES
     serializer_class = UserSignupSerializer
     
     def post(self, request):
@@ -50,8 +121,9 @@ class UserSignupView(APIView):
         )
        
 
-class UserLoginView(APIView):
+class UserLoginView(RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = AUTH_THROTTLES
     serializer_class = UserLoginSerializer
     
     def post(self, request):
@@ -74,6 +146,10 @@ class UserLoginView(APIView):
         status = status.HTTP_200_OK)
         
 
+class TokenObtainPairView(RateLimitHeadersMixin, jwt_views.TokenObtainPairView):
+    throttle_classes = AUTH_THROTTLES
+    
+
 @extend_schema(
     responses={205: OpenApiResponse(description="Logged out successfully")}
 )
@@ -105,39 +181,111 @@ class UserLogoutView(APIView):
             )
             
             
-class MyProfileView(RetrieveUpdateDestroyAPIView):
+class MyProfileView(ConditionalRetrieveMixin, RetrieveUpdateDestroyAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
     
     def get_object(self):
-        return self.request.user
+        return resolve_user(self.request.user)
+    
+    def get_version(self):
+        # Two columns, so a 304 or 412 never loads the row (the auth snapshot has no updated_at)
+        return User.objects.filter(pk=self.request.user.pk).values_list('pk', 'updated_at').first()
+    
+    def perform_update(self, serializer):
+        retry_on_lock(serializer.save)()
     
+    def perform_destroy(self, instance):
+        retry_on_lock(instance.delete)()
     
-class PublicProfileView(RetrieveAPIView):
+    
+@extend_schema(parameters=sparse_fields_parameters(UserProfileSerializer))
+class PublicProfileView(ReplicaReadMixin, ConditionalRetrieveMixin, SparseFieldsMixin, CachedRetrieveMixin, RetrieveAPIView):
     queryset = User.objects.all()
+    cache_kind = 'profile'
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
     
     
-class PublicAddressView(RetrieveAPIView):
+class PublicAddressView(ReplicaReadMixin, ConditionalRetrieveMixin, CachedRetrieveMixin, RetrieveAPIView):
     queryset = User.objects.all()
+    cache_kind = 'address'
     serializer_class = UserAddressSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
     
 
-class UserStatsViewSet(ReadOnlyModelViewSet):
+class UserStatsViewSet(ReplicaReadMixin, ValuesReadMixin, ReadOnlyModelViewSet):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
     serializer_class = UserStatsSerializer
+    pagination_class = KeysetPagination
     ordering = ["-total_spent"]
     lookup_field = 'id'
     
+    @staticmethod
+    def int_param(request, name, default, maximum):
+        try:
+            value = int(request.query_params[name])
+        except (KeyError, ValueError):
+            return default
+        return max(1, min(value, maximum))
     
-class GoogleOAuthView(GenericAPIView):
+    def leaderboard_lookup(self, method, *args):
+        try:
+            result = method(uuid.UUID(str(self.kwargs[self.lookup_field])), *args)
+        except ValueError:
+            result = None
+        if result is None:
+            raise NotFound()
+        return result
+    
+    @extend_schema(
+        parameters=[OpenApiParameter('n', int, description='Number of users, at most 100.')],
+        responses=LeaderboardEntrySerializer(many=True)
+    )
+    @action(detail=False, pagination_class=None)
+    def top(self, request):
+        entries = leaderboard.top(self.int_param(request, 'n', 10, 100))
+        return Response(LeaderboardEntrySerializer(entries, many=True).data, status=status.HTTP_200_OK)
+    
+    @extend_schema(responses=LeaderboardRankSerializer)
+    @action(detail=True)
+    def rank(self, request, id=None):
+        entry = self.leaderboard_lookup(leaderboard.rank)
+        return Response(LeaderboardRankSerializer(entry).data, status=status.HTTP_200_OK)
+    
+    @extend_schema(
+        parameters=[OpenApiParameter('k', int, description='Users either side, at most 50.')],
+        responses=LeaderboardNeighboursSerializer
+    )
+    @action(detail=True)
+    def neighbours(self, request, id=None):
+        window = self.leaderboard_lookup(leaderboard.neighbours, self.int_param(request, 'k', 5, 50))
+        return Response(LeaderboardNeighboursSerializer(window).data, status=status.HTTP_200_OK)
+    
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name, str, description=f"Only users with this {name} ('' for not set), all of them if omitted.")
+            for name in ('country', 'city', 'gender')
+        ],
+        responses=SpendSegmentSerializer
+    )
+    @action(detail=False, pagination_class=None)
+    def segments(self, request):
+        # One rollup row and its sketch, not an aggregate over the table
+        segment = {name: request.query_params.get(name, ANY) for name in ('country', 'city', 'gender')}
+        if segment['city'] != ANY and segment['country'] == ANY:
+            raise ValidationError({'city': ['A city needs its country.']})
+        return Response(SpendSegmentSerializer(spend_rollups.get(**segment)).data, status=status.HTTP_200_OK)
+    
+    
+class GoogleOAuthView(ProviderErrorsMixin, RateLimitHeadersMixin, GenericAPIView):
     serializer_class = GoogleOAuthSerializer
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.GOOGLE
     
     def post(self, request):
         serializer = self.get_serializer(data = request.data)
@@ -146,9 +294,11 @@ class GoogleOAuthView(GenericAPIView):
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
     
     
-class GitHubOAuthView(GenericAPIView):
+class GitHubOAuthView(ProviderErrorsMixin, RateLimitHeadersMixin, GenericAPIView):
     serializer_class = GitHubOAuthSerializer
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.GITHUB
     
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -157,9 +307,11 @@ class GitHubOAuthView(GenericAPIView):
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
     
     
-class FacebookOAuthView(GenericAPIView):
+class FacebookOAuthView(ProviderErrorsMixin, RateLimitHeadersMixin, GenericAPIView):
     serializer_class = FacebookOAuthSerializer
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.FACEBOOK
     
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -168,12 +320,25 @@ class FacebookOAuthView(GenericAPIView):
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
     
     
-class LinkedInOAuthView(GenericAPIView):
+class LinkedInOAuthView(ProviderErrorsMixin, RateLimitHeadersMixin, GenericAPIView):
     serializer_class = LinkedInOAuthSerializer
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.LINKEDIN
     
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        return Response(serializer.validated_data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+        
+        
+@extend_schema(
+    responses={200: OpenApiResponse(description="Counters of the in-process caches and clients")}
+)
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    serializer_class = None
+    
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
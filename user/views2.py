@@ -4,11 +4,17 @@ from google_auth_oauthlib.flow import Flow
 from django.conf import settings
 from django.shortcuts import redirect
 from .serializers import *
+from .oauth_http import ProviderErrorsMixin, oauth_http
+from .models import AuthProvider
+from .ratelimit import OAUTH_THROTTLES, RateLimitHeadersMixin
 from rest_framework.response import Response
 import jwt
 import time
 
 
+GOOGLE_TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+
 #==================================================#
 # Frontend → call backend URL
 # Backend → redirect to Google account chooser
@@ -27,7 +33,7 @@ class GoogleLoginRedirectView(APIView):
                     'client_id': settings.GOOGLE_CLIENT_ID,
                     'client_secret': settings.GOOGLE_CLIENT_SECRET,
                     'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
-                    'token_uri': 'https://oauth2.googleapis.com/token'
+                    'token_uri': GOOGLE_TOKEN_URI
                 }
             },
             scopes=[
@@ -45,40 +51,48 @@ class GoogleLoginRedirectView(APIView):
         )
         
         request.session['google_oauth_state'] = state
+        # The PKCE verifier behind the code_challenge in the URL; the callback sends it back
+        request.session['google_oauth_code_verifier'] = flow.code_verifier
         return redirect(authorization_url)
     
     
-class GoogleOAuthCallbackView(APIView):
+class GoogleOAuthCallbackView(ProviderErrorsMixin, RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.GOOGLE
     
     def get(self, request):
         state = request.session.get('google_oauth_state')
+        code = request.GET.get('code')
         
-        flow = Flow.from_client_config(
-            {
-                'web': {
-                    'client_id': settings.GOOGLE_CLIENT_ID,
-                    'client_secret': settings.GOOGLE_CLIENT_SECRET,
-                    'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
-                    'token_uri': 'https://oauth2.googleapis.com/token'
-                }
-            },
-            scopes = [
-                'openid',
-                'https://www.googleapis.com/auth/userinfo.email',
-                'https://www.googleapis.com/auth/userinfo.profile'
-            ],
-            state=state,
-            redirect_uri = settings.GOOGLE_REDIRECT_URI
+        if not code or not state or request.GET.get('state') != state:
+            return redirect(
+                f'{settings.FRONTEND_LOGIN_ERROR_URL}?error=Google login failed'
+            )
+        
+        # Sends the code to Google’s token endpoint through the shared provider client
+        token_response = oauth_http.post(
+            'google',
+            GOOGLE_TOKEN_URI,
+            data={
+                'grant_type': 'authorization_code',
+                'code': code,
+                'client_id': settings.GOOGLE_CLIENT_ID,
+                'client_secret': settings.GOOGLE_CLIENT_SECRET,
+                'redirect_uri': settings.GOOGLE_REDIRECT_URI,
+                'code_verifier': request.session.get('google_oauth_code_verifier'),
+            }
         )
         
-        # Extracts code from callback URL --> Sends it to Google’s token endpoint
-        flow.fetch_token(authorization_response=request.build_absolute_uri())
+        if token_response.status_code != 200:
+            return redirect(
+                f'{settings.FRONTEND_LOGIN_ERROR_URL}?error=Failed to get Google tokens'
+            )
         
         # Reuse existing serializer logic
         try:
             serializer = GoogleOAuthSerializer(
-                data={'id_token': flow.credentials.id_token}
+                data={'id_token': token_response.json().get('id_token')}
             )
             serializer.is_valid(raise_exception=True)
         except ValidationError as e:
@@ -127,8 +141,10 @@ class GitHubOAuthLoginRedirectView(APIView):
         return redirect(url)
     
     
-class GitHubOAuthCallbackView(APIView):
+class GitHubOAuthCallbackView(ProviderErrorsMixin, RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.GITHUB
     
     def get(self, request):
         code = request.GET.get('code')
@@ -204,8 +220,10 @@ class AppleLoginRedirectView(APIView):
         return redirect(url)
     
     
-class AppleOAuthCallbackView(APIView):
+class AppleOAuthCallbackView(ProviderErrorsMixin, RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.APPLE
     
     def post(self, request):
         id_token = request.data.get('id_token')
@@ -262,8 +280,10 @@ class FacebookLoginRedirectView(APIView):
         return redirect()
         
 
-class FacebookOAuthCallbackView(APIView):
+class FacebookOAuthCallbackView(ProviderErrorsMixin, RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.FACEBOOK
     
     def get(self, request):
         code = request.GET.get('code')
@@ -280,10 +300,10 @@ class FacebookOAuthCallbackView(APIView):
             'code': code
         }
         
-        token_response = req.get(
+        token_response = oauth_http.get(
+            'facebook',
             settings.FACEBOOK_OAUTH_TOKEN_URL,
-            params=token_params,
-            timeout=5
+            params=token_params
         )
         
         if token_response.status_code != 200:
@@ -348,8 +368,10 @@ class LinkedInLoginRedirectView(APIView):
         return redirect(url)
     
     
-class LinkedInOAuthCallbackView(APIView):
+class LinkedInOAuthCallbackView(ProviderErrorsMixin, RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = OAUTH_THROTTLES
+    provider = AuthProvider.LINKEDIN
     
     def get(self, request):
         code = request.GET.get('code')